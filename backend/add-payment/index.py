@@ -3,9 +3,16 @@ import os
 import psycopg2
 from datetime import datetime, timedelta
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def handler(event: dict, context) -> dict:
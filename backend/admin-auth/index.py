@@ -2,6 +2,22 @@ import json
 import os
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
 
 def get_client_ip(event):
     hdrs = event.get('headers') or {}
@@ -17,6 +33,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -61,8 +80,7 @@ def handler(event, context):
     if event.get('httpMethod') != 'POST':
         return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
 
-    dsn = os.environ['DATABASE_URL']
-    conn = psycopg2.connect(dsn)
+    conn = get_conn()
     cur = conn.cursor()
     client_ip = get_client_ip(event)
     if check_rate_limit(cur, conn, client_ip, 'admin-auth', 5, 60):
@@ -79,9 +97,8 @@ def handler(event, context):
     if not email or '@' not in email:
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid email'})}
 
-    dsn = os.environ['DATABASE_URL']
     schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn)
+    conn = get_conn()
     cur = conn.cursor()
 
     cur.execute(
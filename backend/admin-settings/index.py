@@ -9,10 +9,17 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr, formatdate, make_msgid
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 ADMIN_PASSWORD_ENV = os.environ.get('ADMIN_PASSWORD', 'admin2024')
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def hash_pw(password):
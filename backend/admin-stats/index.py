@@ -3,10 +3,17 @@ import os
 import hashlib
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 ADMIN_PASSWORD_ENV = os.environ.get('ADMIN_PASSWORD', 'admin2024')
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def hash_pw(password):
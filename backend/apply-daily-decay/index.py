@@ -3,7 +3,62 @@ import os
 import psycopg2
 from datetime import datetime, timezone, timedelta
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+try:
+    import scheduler
+except ImportError:
+    scheduler = None
+
 MSK = timezone(timedelta(hours=3))
+DECAY_CHUNK = 1000
+# Сколько пропущенных дней догоняется за раз: при давно не обновлявшемся last_decay_date
+# (например, 2000-01-01 в новой базе) рейтинг не обнуляется одним проходом
+DECAY_MAX_CATCHUP_DAYS = 7
+
+# Ключ pg_try_advisory_lock: POST и планировщик шлюза не снижают рейтинг одновременно
+DECAY_LOCK_KEY = 720007
+
+# Ширина корзины rating_histogram; такая же в finish-game, verify-otp и leaderboard
+HISTOGRAM_BUCKET = 50
+
+HISTOGRAM_SQL = """INSERT INTO rating_histogram (scope, name, bucket, players) VALUES %s
+ON CONFLICT (scope, name, bucket) DO UPDATE SET players = rating_histogram.players + EXCLUDED.players"""
+
+# Новые рейтинги уходят в таблицу рейтинга шлюза событиями по LB_EVENT_BATCH игроков (pg_notify до 8000 байт)
+LB_EVENT_BATCH = 80
+
+# Одна порция: следующие DECAY_CHUNK игроков после курсора, снижение за дни после последней партии
+DECAY_CHUNK_SQL = """
+WITH chunk AS (
+    SELECT id, rating, COALESCE(city, '') AS city, NULLIF(region, '') AS region
+    FROM users WHERE id > '%(after_id)s' ORDER BY id LIMIT %(chunk)d
+), updated AS (
+    UPDATE users u SET
+        rating = GREATEST(u.rating - %(decay)d * (DATE '%(target)s' - GREATEST(u.last_played_date, DATE '%(since)s')), %(min_rating)d),
+        updated_at = NOW()
+    FROM chunk c
+    WHERE u.id = c.id AND u.rating > %(min_rating)d
+      AND (u.last_played_date IS NULL OR u.last_played_date < DATE '%(target)s')
+    RETURNING u.id, u.rating, c.rating AS before, c.city, c.region
+)
+SELECT (SELECT MAX(id) FROM chunk),
+       (SELECT COALESCE(json_agg(json_build_array(id, rating, before, city, region)), '[]') FROM updated)
+"""
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
 
 
 def get_client_ip(event):
@@ -20,6 +75,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -55,68 +113,147 @@ def handler(event: dict, context) -> dict:
     if event.get('httpMethod') != 'POST':
         return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
 
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_conn()
     cur = conn.cursor()
     client_ip = get_client_ip(event)
     if check_rate_limit(cur, conn, client_ip, 'apply-daily-decay', 5, 60):
         cur.close()
         conn.close()
         return {'statusCode': 429, 'headers': headers, 'body': json.dumps({'error': 'Too many requests'})}
+
+    result = apply_decay(conn)
     cur.close()
     conn.close()
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps(result)}
 
-    now_msk = datetime.now(MSK)
-    today_msk = now_msk.strftime('%Y-%m-%d')
 
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+def esc(val):
+    return str(val).replace("'", "''")
+
+
+def set_setting(cur, key, value):
+    cur.execute("UPDATE rating_settings SET value = '%s', updated_at = NOW() WHERE key = '%s'" % (esc(value), esc(key)))
+    if cur.rowcount == 0:
+        cur.execute("INSERT INTO rating_settings (key, value) VALUES ('%s', '%s')" % (esc(key), esc(value)))
+
+
+def update_histogram(cur, changes):
+    """Переносит игроков порции между корзинами rating_histogram одним запросом"""
+    deltas = {}
+    for before, after, city, region in changes:
+        scopes = [('country', '')] + ([('city', city)] if city else []) + ([('region', region)] if region else [])
+        for scope, name in scopes:
+            for rating, delta in ((before, -1), (after, 1)):
+                key = (scope, name, rating // HISTOGRAM_BUCKET * HISTOGRAM_BUCKET)
+                deltas[key] = deltas.get(key, 0) + delta
+    values = ', '.join("('%s', '%s', %d, %d)" % (scope, esc(name), bucket, delta)
+                       for (scope, name, bucket), delta in sorted(deltas.items()) if delta)
+    if values:
+        cur.execute(HISTOGRAM_SQL % values)
+
+
+def decay_pass(conn, cur, since, target, decay, min_rating, after_id=''):
+    """Снижает рейтинг за дни (since, target] порциями по DECAY_CHUNK игроков в порядке id.
+    Игрок теряет decay за каждый день после последней партии; дни до неё в этом интервале
+    не учитываются. Курсор в rating_settings.decay_cursor фиксируется вместе с каждой порцией,
+    поэтому прерванный проход продолжается с того же места без повторного снижения"""
+    affected = 0
+    while True:
+        cur.execute(DECAY_CHUNK_SQL % {
+            'after_id': esc(after_id), 'chunk': DECAY_CHUNK, 'decay': decay, 'min_rating': min_rating,
+            'since': since, 'target': target,
+        })
+        last_id, updated = cur.fetchone()
+        if last_id is None:
+            break
+        affected += len(updated)
+        update_histogram(cur, [(before, rating, city, region) for _, rating, before, city, region in updated])
+        entries = [row[:2] for row in updated]
+        for i in range(0, len(entries), LB_EVENT_BATCH):
+            event = json.dumps({'type': 'lb_rating', 'users': entries[i:i + LB_EVENT_BATCH]})
+            cur.execute("SELECT pg_notify('game_events', '%s')" % esc(event))
+        after_id = last_id
+        set_setting(cur, 'decay_cursor', '%s|%s|%s' % (since, target, after_id))
+        conn.commit()
+    return affected
+
+
+def apply_decay(conn):
+    """Снижение рейтинга за все дни МСК с последнего применения, включая пропущенные"""
     cur = conn.cursor()
+    cur.execute("SELECT pg_try_advisory_lock(%d)" % DECAY_LOCK_KEY)
+    locked = cur.fetchone()[0]
+    conn.commit()
+    if not locked:
+        cur.close()
+        return {'applied': False, 'reason': 'in_progress'}
+    try:
+        return run_decay(conn, cur)
+    finally:
+        conn.rollback()
+        cur.execute("SELECT pg_advisory_unlock(%d)" % DECAY_LOCK_KEY)
+        conn.commit()
+        cur.close()
+
+
+def run_decay(conn, cur):
+    now_msk = datetime.now(MSK)
+    today_msk = now_msk.strftime('%Y-%m-%d')
 
-    cur.execute("SELECT key, value FROM rating_settings WHERE key IN ('daily_decay', 'min_rating', 'last_decay_date')")
+    cur.execute("SELECT key, value FROM rating_settings WHERE key IN ('daily_decay', 'min_rating', 'last_decay_date', 'decay_cursor')")
     settings = {r[0]: r[1] for r in cur.fetchall()}
 
     last_decay_date = settings.get('last_decay_date', '2000-01-01')
+    cursor = settings.get('decay_cursor', '')
 
-    if last_decay_date >= today_msk:
-        cur.close()
-        conn.close()
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'applied': False, 'reason': 'already_applied_today', 'last_decay_date': last_decay_date, 'today': today_msk})}
+    if last_decay_date >= today_msk and not cursor:
+        return {'applied': False, 'reason': 'already_applied_today', 'last_decay_date': last_decay_date, 'today': today_msk}
 
     decay = abs(int(settings.get('daily_decay', '1')))
     min_rating = int(settings.get('min_rating', '500'))
+    oldest = (now_msk - timedelta(days=DECAY_MAX_CATCHUP_DAYS)).strftime('%Y-%m-%d')
+
+    affected = 0
+    days = 0
+    # Сначала дописываем прерванный проход, затем снижаем за дни после него
+    passes = []
+    if cursor:
+        since, target, after_id = cursor.split('|', 2)
+        passes.append((since, target, after_id))
+        last_decay_date = target
+    if last_decay_date < today_msk:
+        passes.append((max(last_decay_date, oldest), today_msk, ''))
 
-    if decay == 0:
-        cur.execute("UPDATE rating_settings SET value = '%s', updated_at = NOW() WHERE key = 'last_decay_date'" % today_msk)
+    for since, target, after_id in passes:
+        if decay:
+            affected += decay_pass(conn, cur, since, target, decay, min_rating, after_id)
+        days += (datetime.strptime(target, '%Y-%m-%d') - datetime.strptime(since, '%Y-%m-%d')).days
+        set_setting(cur, 'last_decay_date', target)
+        set_setting(cur, 'decay_cursor', '')
         conn.commit()
-        cur.close()
+
+    return {
+        'applied': True,
+        'affected': affected,
+        'decay': decay,
+        'days': days,
+        'min_rating': min_rating,
+        'date': today_msk
+    }
+
+
+def scheduled_decay():
+    """Задача планировщика шлюза: то же, что POST, но без HTTP-вызова извне"""
+    conn = get_conn()
+    try:
+        return apply_decay(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         conn.close()
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'applied': True, 'affected': 0, 'decay': 0})}
-
-    cur.execute(
-        """UPDATE users SET rating = GREATEST(rating - %d, %d), updated_at = NOW()
-        WHERE rating > %d
-          AND id NOT IN (
-            SELECT DISTINCT user_id FROM game_history
-            WHERE created_at >= TIMESTAMP '%s 00:00:00' AND created_at < TIMESTAMP '%s 00:00:00' + INTERVAL '1 day'
-          )
-        RETURNING id"""
-        % (decay, min_rating, min_rating, today_msk, today_msk)
-    )
-    affected = len(cur.fetchall())
-
-    cur.execute("UPDATE rating_settings SET value = '%s', updated_at = NOW() WHERE key = 'last_decay_date'" % today_msk)
 
-    conn.commit()
-    cur.close()
-    conn.close()
 
-    return {
-        'statusCode': 200,
-        'headers': headers,
-        'body': json.dumps({
-            'applied': True,
-            'affected': affected,
-            'decay': decay,
-            'min_rating': min_rating,
-            'date': today_msk
-        })
-    }
\ No newline at end of file
+# В шлюзе снижение запускает планировщик сразу после полуночи МСК; POST остаётся для serverless-среды
+if scheduler:
+    scheduler.register('daily-decay', '0 0 * * *', scheduled_decay, jitter=30)
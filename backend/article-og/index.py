@@ -4,6 +4,11 @@ import html
 import time
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 SITE = 'https://podelam.su'
 
@@ -11,6 +16,8 @@ _cache = {}
 CACHE_TTL = 600
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def esc(text):
@@ -8,6 +8,11 @@ import random
 import boto3
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 ADMIN_PASSWORD_ENV = os.environ.get('ADMIN_PASSWORD', 'admin2024')
 
@@ -21,6 +26,8 @@ CORS = {
 }
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def hash_pw(password):
@@ -2,6 +2,11 @@ import json
 import os
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 
 TOOL_LIMITS = {
@@ -15,6 +20,8 @@ TOOL_LIMITS = {
 }
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def make_fingerprint(sd):
@@ -3,6 +3,22 @@ import os
 import psycopg2
 from datetime import datetime
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
 
 def esc(val):
     return str(val).replace("'", "''")
@@ -22,6 +38,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -53,7 +72,7 @@ def handler(event: dict, context) -> dict:
         return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
 
     headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_conn()
     cur = conn.cursor()
 
     client_ip = get_client_ip(event)
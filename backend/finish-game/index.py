@@ -1,6 +1,40 @@
 import json
 import os
 import psycopg2
+from datetime import datetime, timezone, timedelta
+
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+try:
+    import scheduler
+except ImportError:
+    scheduler = None
+
+from rating_engine import SCORES, RatingConfig, Rating, bot_opponent, rate, rate_pair
+import user_stats
+
+MSK = timezone(timedelta(hours=3))
+# Аватары длиннее (загруженные картинки) в событие таблицы рейтинга не кладутся
+AVATAR_INLINE_MAX = 512
+# Ширина корзины rating_histogram; такая же в apply-daily-decay, verify-otp и leaderboard
+HISTOGRAM_BUCKET = 50
+
+HISTOGRAM_SQL = """INSERT INTO rating_histogram (scope, name, bucket, players) VALUES %s
+ON CONFLICT (scope, name, bucket) DO UPDATE SET players = rating_histogram.players + EXCLUDED.players"""
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
 
 
 def get_client_ip(event):
@@ -17,6 +51,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -52,15 +89,13 @@ def handler(event: dict, context) -> dict:
     if event.get('httpMethod') != 'POST':
         return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
 
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_conn()
     cur = conn.cursor()
     client_ip = get_client_ip(event)
     if check_rate_limit(cur, conn, client_ip, 'finish-game', 10, 60):
         cur.close()
         conn.close()
         return {'statusCode': 429, 'headers': headers, 'body': json.dumps({'error': 'Too many requests'})}
-    cur.close()
-    conn.close()
 
     body = json.loads(event.get('body', '{}'))
     user_id = body.get('user_id', '')
@@ -73,119 +108,241 @@ def handler(event: dict, context) -> dict:
     user_color = body.get('user_color', 'white')
     time_control = body.get('time_control', '10+0')
     difficulty = body.get('difficulty')
-    moves_count = body.get('moves_count', 0)
-    move_history = body.get('move_history', '')
-    move_times = body.get('move_times', '')
-    duration_seconds = body.get('duration_seconds')
-    end_reason = body.get('end_reason', 'checkmate')
+    online_game_id = body.get('online_game_id')
 
     if not user_id or result not in ('win', 'loss', 'draw'):
+        cur.close()
+        conn.close()
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id and valid result required'})}
 
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
+    cur.execute("SELECT key, value FROM rating_settings")
+    config = RatingConfig({r[0]: r[1] for r in cur.fetchall()})
+    today = datetime.now(MSK).date()
 
-    cur.execute("SELECT id, rating, games_played, wins, losses, draws FROM users WHERE id = '%s'" % user_id.replace("'", "''"))
-    user = cur.fetchone()
+    if online_game_id:
+        status, payload = finish_online_game(cur, conn, int(online_game_id), user_id, body, config, today)
+        cur.close()
+        conn.close()
+        return {'statusCode': status, 'headers': headers, 'body': json.dumps(payload)}
 
-    cur.execute("SELECT key, value FROM rating_settings")
-    settings_rows = cur.fetchall()
-    settings = {r[0]: r[1] for r in settings_rows}
+    changes = []
+    player = load_player(cur, user_id, username, avatar, config, changes)
+    new_state = rate(player, bot_opponent(opponent_rating, difficulty), SCORES[result], config, today)
+    current_rating = int(player.rating)
+    new_rating = int(round(new_state.rating))
+    counters = update_player(cur, user_id, player, new_state, result, today, changes)
+    update_histogram(cur, changes)
 
-    win_points = int(settings.get('win_points', '25'))
-    loss_points = int(settings.get('loss_points', '15'))
-    draw_points = int(settings.get('draw_points', '5'))
-    initial_rating = int(settings.get('initial_rating', '1200'))
-    min_rating = int(settings.get('min_rating', '500'))
+    game = {
+        'user_id': user_id, 'opponent_name': opponent_name, 'opponent_type': opponent_type,
+        'opponent_rating': opponent_rating, 'result': result, 'user_color': user_color,
+        'time_control': time_control, 'difficulty': difficulty, 'moves_count': body.get('moves_count', 0),
+        'move_history': body.get('move_history', ''), 'move_times': body.get('move_times', ''),
+        'rating_before': current_rating, 'rating_after': new_rating,
+        'duration_seconds': body.get('duration_seconds'), 'end_reason': body.get('end_reason', 'checkmate'),
+    }
+    game_id = insert_history(cur, game)
+    user_stats.record(cur, user_id, game, today)
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps(dict({
+            'game_id': game_id,
+            'rating_before': current_rating,
+            'rating_after': new_rating,
+            'rating_change': new_rating - current_rating,
+        }, **counters))
+    }
+
+
+def esc(val):
+    return str(val).replace("'", "''")
+
+
+def load_player(cur, user_id, username, avatar, config, changes):
+    """Рейтинг игрока под блокировкой строки; нового игрока создаёт с начальным рейтингом"""
+    cur.execute(
+        "INSERT INTO users (id, username, avatar, rating, games_played, wins, losses, draws) VALUES ('%s', '%s', '%s', %d, 0, 0, 0, 0) "
+        "ON CONFLICT (id) DO NOTHING" % (esc(user_id), esc(username), esc(avatar or ''), config.initial_rating)
+    )
+    if cur.rowcount == 1:
+        changes.append((None, config.initial_rating, '', None))
+    cur.execute(
+        "SELECT rating, rating_deviation, rating_volatility, games_played, last_played_date FROM users WHERE id = '%s' FOR UPDATE"
+        % esc(user_id)
+    )
+    row = cur.fetchone()
+    return Rating(row[0], row[1], row[2], row[3], row[4])
 
-    if not user:
-        cur.execute(
-            "INSERT INTO users (id, username, avatar, rating, games_played, wins, losses, draws) VALUES ('%s', '%s', '%s', %d, 0, 0, 0, 0)"
-            % (user_id.replace("'", "''"), username.replace("'", "''"), avatar.replace("'", "''"), initial_rating)
-        )
-        conn.commit()
-        current_rating = initial_rating
-        games_played = 0
-        wins = 0
-        losses = 0
-        draws = 0
-    else:
-        current_rating = user[1]
-        games_played = user[2]
-        wins = user[3]
-        losses = user[4]
-        draws = user[5]
-
-    if result == 'win':
-        rating_change = win_points
-        wins += 1
-    elif result == 'loss':
-        rating_change = -loss_points
-        losses += 1
-    else:
-        rating_change = draw_points
-        draws += 1
-
-    new_rating = current_rating + rating_change
-    if new_rating < min_rating:
-        new_rating = min_rating
-        rating_change = new_rating - current_rating
-
-    games_played += 1
 
+def update_player(cur, user_id, before, state, result, today, changes):
+    # last_played_date (день МСК) освобождает игрока от ежедневного снижения рейтинга за этот день
     cur.execute(
-        "UPDATE users SET rating = %d, games_played = %d, wins = %d, losses = %d, draws = %d, updated_at = NOW() WHERE id = '%s'"
-        % (new_rating, games_played, wins, losses, draws, user_id.replace("'", "''"))
+        """UPDATE users SET rating = %d, rating_deviation = %.3f, rating_volatility = %.6f,
+        games_played = games_played + 1, wins = wins + %d, losses = losses + %d, draws = draws + %d,
+        last_played_date = '%s', updated_at = NOW()
+        WHERE id = '%s' RETURNING games_played, wins, losses, draws, rating, username, COALESCE(city, ''),
+            CASE WHEN LENGTH(COALESCE(avatar, '')) <= %d THEN COALESCE(avatar, '') END, NULLIF(region, '')"""
+        % (round(state.rating), state.rd, state.volatility, result == 'win', result == 'loss', result == 'draw',
+           today.isoformat(), esc(user_id), AVATAR_INLINE_MAX)
     )
+    row = cur.fetchone()
+    notify_leaderboard(cur, [[user_id] + list(row[4:])])
+    changes.append((int(before.rating), row[4], row[6], row[8]))
+    return {'games_played': row[0], 'wins': row[1], 'losses': row[2], 'draws': row[3]}
+
+
+def notify_leaderboard(cur, entries):
+    """Событие для таблицы рейтинга в памяти шлюза (deploy/backend/leaderboard_index.py);
+    уходит при COMMIT вместе с новым рейтингом, без шлюза его просто никто не слушает"""
+    event = json.dumps({'type': 'lb_rating', 'users': entries})
+    cur.execute("SELECT pg_notify('game_events', '%s')" % esc(event))
+
+
+def histogram_deltas(changes):
+    """(рейтинг до или None для нового игрока, рейтинг после, город, регион) → {(scope, name, корзина): прирост}"""
+    deltas = {}
+    for before, after, city, region in changes:
+        scopes = [('country', '')] + ([('city', city)] if city else []) + ([('region', region)] if region else [])
+        for scope, name in scopes:
+            if before is not None:
+                key = (scope, name, before // HISTOGRAM_BUCKET * HISTOGRAM_BUCKET)
+                deltas[key] = deltas.get(key, 0) - 1
+            key = (scope, name, after // HISTOGRAM_BUCKET * HISTOGRAM_BUCKET)
+            deltas[key] = deltas.get(key, 0) + 1
+    return {key: delta for key, delta in deltas.items() if delta}
 
-    move_history_escaped = move_history.replace("'", "''") if move_history else ''
-    move_times_escaped = move_times.replace("'", "''") if move_times else ''
-    opponent_name_escaped = opponent_name.replace("'", "''")
-    difficulty_val = "'%s'" % difficulty.replace("'", "''") if difficulty else 'NULL'
-    opponent_rating_val = str(opponent_rating) if opponent_rating else 'NULL'
-    duration_val = str(duration_seconds) if duration_seconds else 'NULL'
 
+def update_histogram(cur, changes):
+    """Один запрос на партию: строки корзин блокируются в одном порядке, встречные партии не взаимоблокируются"""
+    deltas = histogram_deltas(changes)
+    if deltas:
+        cur.execute(HISTOGRAM_SQL % ', '.join(
+            "('%s', '%s', %d, %d)" % (scope, esc(name), bucket, delta)
+            for (scope, name, bucket), delta in sorted(deltas.items())))
+
+
+def insert_history(cur, game):
+    difficulty = game.get('difficulty')
     cur.execute(
-        """INSERT INTO game_history 
-        (user_id, opponent_name, opponent_type, opponent_rating, result, user_color, time_control, difficulty, moves_count, move_history, move_times, rating_before, rating_after, rating_change, duration_seconds, end_reason)
-        VALUES ('%s', '%s', '%s', %s, '%s', '%s', '%s', %s, %d, '%s', '%s', %d, %d, %d, %s, '%s')
+        """INSERT INTO game_history
+        (user_id, opponent_name, opponent_type, opponent_rating, result, user_color, time_control, difficulty, moves_count, move_history, move_times, rating_before, rating_after, rating_change, duration_seconds, end_reason, online_game_id)
+        VALUES ('%s', '%s', '%s', %s, '%s', '%s', '%s', %s, %d, '%s', '%s', %d, %d, %d, %s, '%s', %s)
         RETURNING id"""
         % (
-            user_id.replace("'", "''"),
-            opponent_name_escaped,
-            opponent_type.replace("'", "''"),
-            opponent_rating_val,
-            result,
-            user_color,
-            time_control.replace("'", "''"),
-            difficulty_val,
-            moves_count,
-            move_history_escaped,
-            move_times_escaped,
-            current_rating,
-            new_rating,
-            rating_change,
-            duration_val,
-            end_reason.replace("'", "''")
+            esc(game['user_id']),
+            esc(game['opponent_name']),
+            esc(game['opponent_type']),
+            str(int(game['opponent_rating'])) if game.get('opponent_rating') else 'NULL',
+            game['result'],
+            esc(game['user_color']),
+            esc(game['time_control']),
+            "'%s'" % esc(difficulty) if difficulty else 'NULL',
+            int(game.get('moves_count') or 0),
+            esc(game.get('move_history') or ''),
+            esc(game.get('move_times') or ''),
+            game['rating_before'],
+            game['rating_after'],
+            game['rating_after'] - game['rating_before'],
+            str(int(game['duration_seconds'])) if game.get('duration_seconds') else 'NULL',
+            esc(game.get('end_reason') or 'checkmate'),
+            str(int(game['online_game_id'])) if game.get('online_game_id') else 'NULL',
         )
     )
-    game_id = cur.fetchone()[0]
+    return cur.fetchone()[0]
+
+
+def finish_online_game(cur, conn, game_id, user_id, body, config, today):
+    """Итог партии между игроками берётся из online_games, а не из отчёта клиента.
+    Первый из игроков, сообщивший о конце партии, под блокировкой строки партии пересчитывает
+    рейтинг обоих и пишет историю обоим; повторные вызовы только возвращают записанный итог"""
+    cur.execute(
+        """SELECT white_user_id, white_username, black_user_id, black_username, status, winner, end_reason,
+                  time_control, move_history, move_number, rated,
+                  EXTRACT(EPOCH FROM (updated_at - created_at))::int
+           FROM online_games WHERE id = %d FOR UPDATE""" % game_id
+    )
+    row = cur.fetchone()
+    if not row or user_id not in (row[0], row[2]):
+        conn.rollback()
+        return 404, {'error': 'game not found'}
+    white_uid, white_name, black_uid, black_name, status, winner, end_reason = row[:7]
+    if status != 'finished':
+        conn.rollback()
+        return 409, {'error': 'game not finished'}
+
+    if not row[10]:
+        # Строки игроков блокируются в порядке id, чтобы встречные вызовы не взаимоблокировались
+        players = {}
+        hist_changes = []
+        for uid, name in sorted([(white_uid, white_name), (black_uid, black_name)]):
+            players[uid] = load_player(cur, uid, name, '', config, hist_changes)
+        white, black = players[white_uid], players[black_uid]
+        white_score = 1.0 if winner == white_uid else 0.0 if winner == black_uid else 0.5
+        new_white, new_black = rate_pair(white, black, white_score, config, today)
+        changes = {}
+        for color, uid, opp_name, before, after, opp_before, score in (
+                ('white', white_uid, black_name, white, new_white, black, white_score),
+                ('black', black_uid, white_name, black, new_black, white, 1.0 - white_score)):
+            result = 'win' if score == 1.0 else 'loss' if score == 0.0 else 'draw'
+            reporter = uid == user_id
+            update_player(cur, uid, before, after, result, today, hist_changes)
+            game = {
+                'user_id': uid, 'opponent_name': opp_name, 'opponent_type': 'online',
+                'opponent_rating': int(opp_before.rating), 'result': result, 'user_color': color,
+                'time_control': row[7], 'moves_count': row[9],
+                'move_history': body.get('move_history') if reporter and body.get('move_history') else row[8],
+                'move_times': body.get('move_times', '') if reporter else '',
+                'rating_before': int(before.rating), 'rating_after': int(round(after.rating)),
+                'duration_seconds': row[11], 'end_reason': end_reason or body.get('end_reason'),
+                'online_game_id': game_id,
+            }
+            insert_history(cur, game)
+            user_stats.record(cur, uid, game, today)
+            changes[color] = int(round(after.rating)) - int(before.rating)
+        update_histogram(cur, hist_changes)
+        cur.execute(
+            "UPDATE online_games SET rated = TRUE, white_rating_change = %d, black_rating_change = %d WHERE id = %d"
+            % (changes['white'], changes['black'], game_id)
+        )
+        conn.commit()
 
+    cur.execute(
+        "SELECT id, rating_before, rating_after, rating_change FROM game_history WHERE online_game_id = %d AND user_id = '%s'"
+        % (game_id, esc(user_id))
+    )
+    history = cur.fetchone()
+    cur.execute("SELECT games_played, wins, losses, draws FROM users WHERE id = '%s'" % esc(user_id))
+    counters = cur.fetchone()
     conn.commit()
-    cur.close()
-    conn.close()
+    if not history:
+        return 404, {'error': 'game result not recorded'}
+    return 200, {
+        'game_id': history[0],
+        'rating_before': history[1],
+        'rating_after': history[2],
+        'rating_change': history[3],
+        'games_played': counters[0],
+        'wins': counters[1],
+        'losses': counters[2],
+        'draws': counters[3],
+    }
 
-    return {
-        'statusCode': 200,
-        'headers': headers,
-        'body': json.dumps({
-            'game_id': game_id,
-            'rating_before': current_rating,
-            'rating_after': new_rating,
-            'rating_change': rating_change,
-            'games_played': games_played,
-            'wins': wins,
-            'losses': losses,
-            'draws': draws
-        })
-    }
\ No newline at end of file
+
+def scheduled_stats_rebuild():
+    """Задача планировщика шлюза: пересчёт user_stats по всей game_history"""
+    conn = get_conn()
+    try:
+        return user_stats.rebuild(conn)
+    finally:
+        conn.close()
+
+
+# Статистику ведёт каждая партия; еженедельный пересчёт исправляет правки истории в обход finish-game
+if scheduler:
+    scheduler.register('user-stats-rebuild', '0 4 * * 1', scheduled_stats_rebuild, jitter=300)
@@ -0,0 +1,309 @@
+"""
+Расчёт рейтинга по результату партии.
+Система выбирается настройкой rating_system в rating_settings:
+  points  — прежние фиксированные win_points / loss_points / draw_points;
+  elo     — Эло с коэффициентом elo_k (elo_k_provisional для первых PROVISIONAL_GAMES партий);
+  glicko2 — Глико-2: у игрока кроме рейтинга есть отклонение (RD) и волатильность, каждая партия
+            считается отдельным рейтинговым периодом, а за дни без игры (glicko_period_days на период)
+            RD растёт, и рейтинг вернувшегося игрока меняется быстрее.
+Соперник-бот имеет рейтинг по сложности (BOT_RATINGS), если клиент не прислал opponent_rating.
+Пакетный пересчёт всех рейтингов по game_history после смены настроек:
+  DATABASE_URL=... python rating_engine.py replay [--dry-run]
+Замер скорости на синтетических партиях: python rating_engine.py bench [партий]
+"""
+import math
+import os
+import random
+import sys
+import time
+from datetime import date
+
+DEFAULT_RD = 350.0
+MIN_RD = 30.0
+DEFAULT_VOLATILITY = 0.06
+GLICKO_SCALE = 173.7178
+GLICKO_CENTER = 1500.0
+PROVISIONAL_GAMES = 30
+REPLAY_FETCH = 50000
+REPLAY_WRITE_BATCH = 5000
+# Ширина корзины rating_histogram; такая же в leaderboard/rating_histogram.py
+HISTOGRAM_BUCKET = 50
+
+BOT_RATINGS = {'easy': 800, 'medium': 1200, 'hard': 1600, 'master': 2000}
+
+SCORES = {'win': 1.0, 'draw': 0.5, 'loss': 0.0}
+
+
+class RatingConfig:
+    def __init__(self, settings):
+        self.system = settings.get('rating_system', 'elo')
+        self.win_points = int(settings.get('win_points', '25'))
+        self.loss_points = int(settings.get('loss_points', '15'))
+        self.draw_points = int(settings.get('draw_points', '5'))
+        self.initial_rating = int(settings.get('initial_rating', '500'))
+        self.min_rating = int(settings.get('min_rating', '500'))
+        self.elo_k = float(settings.get('elo_k', '32'))
+        self.elo_k_provisional = float(settings.get('elo_k_provisional', '40'))
+        self.glicko_tau = float(settings.get('glicko_tau', '0.5'))
+        self.glicko_period_days = max(1, int(settings.get('glicko_period_days', '1')))
+
+
+class Rating:
+    """Состояние игрока: рейтинг (float внутри расчёта), RD, волатильность, число партий, день последней партии"""
+    __slots__ = ('rating', 'rd', 'volatility', 'games', 'last_played')
+
+    def __init__(self, rating, rd=DEFAULT_RD, volatility=DEFAULT_VOLATILITY, games=0, last_played=None):
+        self.rating = float(rating)
+        self.rd = float(rd if rd is not None else DEFAULT_RD)
+        self.volatility = float(volatility if volatility is not None else DEFAULT_VOLATILITY)
+        self.games = games or 0
+        self.last_played = last_played
+
+
+def expected_score(rating, opponent):
+    return 1.0 / (1.0 + 10.0 ** ((opponent - rating) / 400.0))
+
+
+def elo_update(player, opponent_rating, score, config):
+    k = config.elo_k_provisional if player.games < PROVISIONAL_GAMES else config.elo_k
+    return player.rating + k * (score - expected_score(player.rating, opponent_rating))
+
+
+def _idle_periods(player, day, config):
+    if player.last_played is None or day is None:
+        return 0
+    return max(0, (day - player.last_played).days // config.glicko_period_days)
+
+
+def _volatility(phi, sigma, delta, v, tau):
+    """Новая волатильность Глико-2: корень f(x) = 0 методом Иллинойса (шаг 5 у Гликмана)"""
+    a = math.log(sigma * sigma)
+    phi2 = phi * phi
+
+    def f(x):
+        ex = math.exp(x)
+        return ex * (delta * delta - phi2 - v - ex) / (2.0 * (phi2 + v + ex) ** 2) - (x - a) / (tau * tau)
+
+    big_a = a
+    if delta * delta > phi2 + v:
+        big_b = math.log(delta * delta - phi2 - v)
+    else:
+        k = 1
+        while f(a - k * tau) < 0:
+            k += 1
+        big_b = a - k * tau
+    fa, fb = f(big_a), f(big_b)
+    for _ in range(100):
+        if abs(big_b - big_a) <= 1e-6:
+            break
+        c = big_a + (big_a - big_b) * fa / (fb - fa)
+        fc = f(c)
+        if fc * fb <= 0:
+            big_a, fa = big_b, fb
+        else:
+            fa /= 2.0
+        big_b, fb = c, fc
+    return math.exp(big_a / 2.0)
+
+
+def glicko2_update(player, opponent, score, config, day=None):
+    """(рейтинг, RD, волатильность) игрока после одной партии против opponent (Rating)"""
+    mu = (player.rating - GLICKO_CENTER) / GLICKO_SCALE
+    phi = player.rd / GLICKO_SCALE
+    sigma = player.volatility
+    idle = _idle_periods(player, day, config)
+    if idle:
+        phi = min(math.sqrt(phi * phi + idle * sigma * sigma), DEFAULT_RD / GLICKO_SCALE)
+    mu_j = (opponent.rating - GLICKO_CENTER) / GLICKO_SCALE
+    phi_j = opponent.rd / GLICKO_SCALE
+
+    g = 1.0 / math.sqrt(1.0 + 3.0 * phi_j * phi_j / (math.pi * math.pi))
+    e = 1.0 / (1.0 + math.exp(-g * (mu - mu_j)))
+    v = 1.0 / (g * g * e * (1.0 - e))
+    delta = v * g * (score - e)
+
+    sigma = _volatility(phi, sigma, delta, v, config.glicko_tau)
+    phi_star = math.sqrt(phi * phi + sigma * sigma)
+    phi = 1.0 / math.sqrt(1.0 / (phi_star * phi_star) + 1.0 / v)
+    mu = mu + phi * phi * g * (score - e)
+    rd = min(max(phi * GLICKO_SCALE, MIN_RD), DEFAULT_RD)
+    return mu * GLICKO_SCALE + GLICKO_CENTER, rd, sigma
+
+
+def rate(player, opponent, score, config, day=None):
+    """Новое состояние игрока после партии: score — 1, 0.5 или 0 с его стороны"""
+    if config.system == 'elo':
+        rating, rd, volatility = elo_update(player, opponent.rating, score, config), player.rd, player.volatility
+    elif config.system == 'glicko2':
+        rating, rd, volatility = glicko2_update(player, opponent, score, config, day)
+    else:
+        change = config.win_points if score == 1.0 else -config.loss_points if score == 0.0 else config.draw_points
+        rating, rd, volatility = player.rating + change, player.rd, player.volatility
+    return Rating(max(rating, config.min_rating), rd, volatility, player.games + 1, day or player.last_played)
+
+
+def rate_pair(white, black, white_score, config, day=None):
+    """Обе стороны одной партии считаются от рейтингов до неё"""
+    return (rate(white, black, white_score, config, day),
+            rate(black, white, 1.0 - white_score, config, day))
+
+
+def bot_opponent(opponent_rating, difficulty):
+    rating = opponent_rating or BOT_RATINGS.get(difficulty or '', BOT_RATINGS['medium'])
+    return Rating(rating)
+
+
+# --- пакетный пересчёт ---
+
+REPLAY_SQL = """
+SELECT h.user_id, g.black_user_id, h.result, h.opponent_rating, h.difficulty, h.created_at::date
+FROM game_history h
+LEFT JOIN online_games g ON g.id = h.online_game_id
+WHERE h.online_game_id IS NULL OR h.user_color = 'white'
+ORDER BY h.created_at, h.id
+"""
+
+WRITE_SQL = """UPDATE users u SET rating = v.rating, rating_deviation = v.rd, rating_volatility = v.vol, updated_at = NOW()
+FROM (VALUES %s) AS v(id, rating, rd, vol) WHERE u.id = v.id"""
+
+# После пересчёта корзины распределения собираются заново в той же транзакции, что и рейтинги,
+# как в ночной задаче rating-histogram (без среза дня)
+HISTOGRAM_SQL = (
+    "LOCK TABLE rating_histogram IN EXCLUSIVE MODE",
+    "DELETE FROM rating_histogram",
+    """INSERT INTO rating_histogram (scope, name, bucket, players)
+SELECT 'country', '', rating / {w} * {w}, COUNT(*) FROM users GROUP BY 3
+UNION ALL
+SELECT 'city', city, rating / {w} * {w}, COUNT(*) FROM users WHERE city <> '' GROUP BY 2, 3
+UNION ALL
+SELECT 'region', region, rating / {w} * {w}, COUNT(*) FROM users WHERE region <> '' GROUP BY 2, 3""",
+)
+
+
+def replay_rows(rows, config):
+    """Проигрывает партии по порядку. Состояние игроков хранится в параллельных списках
+    по плотному индексу, чтобы цикл по миллионам строк не создавал объектов на каждую партию.
+    rows: (user_id, online_opponent_id | None, result, opponent_rating, difficulty, день)"""
+    index = {}
+    ratings, rds, vols, games, days = [], [], [], [], []
+
+    def slot(uid):
+        i = index.get(uid)
+        if i is None:
+            i = index[uid] = len(ratings)
+            ratings.append(float(config.initial_rating))
+            rds.append(DEFAULT_RD)
+            vols.append(DEFAULT_VOLATILITY)
+            games.append(0)
+            days.append(None)
+        return i
+
+    def load(i):
+        return Rating(ratings[i], rds[i], vols[i], games[i], days[i])
+
+    def store(i, state):
+        ratings[i], rds[i], vols[i], games[i], days[i] = (
+            state.rating, state.rd, state.volatility, state.games, state.last_played)
+
+    count = 0
+    for user_id, opponent_id, result, opponent_rating, difficulty, day in rows:
+        score = SCORES.get(result)
+        if score is None:
+            continue
+        i = slot(user_id)
+        if opponent_id:
+            j = slot(opponent_id)
+            if config.system == 'elo':
+                # Горячий путь: Эло без промежуточных объектов
+                e = 1.0 / (1.0 + 10.0 ** ((ratings[j] - ratings[i]) / 400.0))
+                ki = config.elo_k_provisional if games[i] < PROVISIONAL_GAMES else config.elo_k
+                kj = config.elo_k_provisional if games[j] < PROVISIONAL_GAMES else config.elo_k
+                ratings[i] = max(ratings[i] + ki * (score - e), config.min_rating)
+                ratings[j] = max(ratings[j] + kj * (e - score), config.min_rating)
+                games[i] += 1
+                games[j] += 1
+                days[i] = days[j] = day
+            else:
+                new_i, new_j = rate_pair(load(i), load(j), score, config, day)
+                store(i, new_i)
+                store(j, new_j)
+        else:
+            store(i, rate(load(i), bot_opponent(opponent_rating, difficulty), score, config, day))
+        count += 1
+    return {uid: (ratings[i], rds[i], vols[i]) for uid, i in index.items()}, count
+
+
+def replay(conn, dry_run=False):
+    """Пересчитывает рейтинги всех игроков из game_history по текущим rating_settings,
+    затем корзины rating_histogram и индекс лидерборда шлюза"""
+    cur = conn.cursor()
+    cur.execute("SELECT key, value FROM rating_settings")
+    config = RatingConfig({r[0]: r[1] for r in cur.fetchall()})
+    cur.close()
+
+    started = time.perf_counter()
+    stream = conn.cursor(name='rating_replay')
+    stream.itersize = REPLAY_FETCH
+    stream.execute(REPLAY_SQL)
+    result, games = replay_rows(stream, config)
+    stream.close()
+    elapsed = time.perf_counter() - started
+
+    if not dry_run:
+        cur = conn.cursor()
+        items = list(result.items())
+        for offset in range(0, len(items), REPLAY_WRITE_BATCH):
+            values = ','.join("('%s', %d, %.3f, %.6f)" % (uid.replace("'", "''"), round(r), rd, vol)
+                              for uid, (r, rd, vol) in items[offset:offset + REPLAY_WRITE_BATCH])
+            cur.execute(WRITE_SQL % values)
+        for sql in HISTOGRAM_SQL:
+            cur.execute(sql.format(w=HISTOGRAM_BUCKET))
+        # Шлюз перестраивает индекс лидерборда по событию resync без game_id (уйдёт после commit)
+        cur.execute("SELECT pg_notify('game_events', '{\"type\": \"resync\"}')")
+        cur.close()
+    conn.commit()
+    return {'system': config.system, 'games': games, 'players': len(result), 'seconds': round(elapsed, 2),
+            'dry_run': dry_run}
+
+
+def synthetic_games(count, players=20000, seed=1):
+    rnd = random.Random(seed)
+    strength = [rnd.gauss(1400, 300) for _ in range(players)]
+    day = date(2024, 1, 1).toordinal()
+    for n in range(count):
+        a, b = rnd.randrange(players), rnd.randrange(players)
+        if a == b:
+            continue
+        p = expected_score(strength[a], strength[b])
+        x = rnd.random()
+        result = 'draw' if abs(x - p) < 0.05 else 'win' if x < p else 'loss'
+        yield 'u%d' % a, 'u%d' % b, result, None, None, date.fromordinal(day + n * 365 // count)
+
+
+def bench(count):
+    for system in ('elo', 'glicko2'):
+        config = RatingConfig({'rating_system': system, 'initial_rating': '1200', 'min_rating': '100'})
+        started = time.perf_counter()
+        result, games = replay_rows(synthetic_games(count), config)
+        elapsed = time.perf_counter() - started
+        print('%-8s %9d games %7.2fs  %8.0f games/s  %d players' % (
+            system, games, elapsed, games / elapsed if elapsed else 0, len(result)))
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'bench'
+    if command == 'bench':
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
+    elif command == 'replay':
+        import psycopg2
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        try:
+            print(replay(conn, dry_run='--dry-run' in sys.argv))
+        finally:
+            conn.close()
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Сводная статистика игрока для профиля (таблица user_stats, одна строка на игрока):
+результаты по цвету, контролю времени и типу соперника, текущая и лучшая серия побед,
+средняя длина партии, пик и минимум рейтинга, число партий по дням за ACTIVITY_DAYS дней.
+finish-game обновляет строку в той же транзакции, что и рейтинг, под блокировкой строки users.
+Если строки ещё нет, она один раз собирается из game_history этого игрока.
+Пакетный пересчёт по всей истории (задача планировщика user-stats-rebuild или вручную):
+  DATABASE_URL=... python user_stats.py rebuild
+"""
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+
+ACTIVITY_DAYS = 365
+REBUILD_CHUNK = 500
+
+COLUMNS = ('by_color', 'by_time_control', 'by_opponent', 'current_streak', 'best_streak', 'games',
+           'total_moves', 'timed_games', 'total_duration', 'rating_peak', 'rating_low', 'activity')
+JSON_COLUMNS = ('by_color', 'by_time_control', 'by_opponent', 'activity')
+
+HISTORY_SQL = """SELECT user_id, result, user_color, time_control, opponent_type, moves_count,
+       duration_seconds, rating_before, rating_after, created_at::date
+FROM game_history WHERE %s ORDER BY user_id, created_at, id"""
+
+SAVE_SQL = """INSERT INTO user_stats (user_id, %s, updated_at) VALUES %s
+ON CONFLICT (user_id) DO UPDATE SET %s, updated_at = NOW()"""
+
+
+def esc(val):
+    return str(val).replace("'", "''")
+
+
+def empty():
+    return {'by_color': {}, 'by_time_control': {}, 'by_opponent': {}, 'current_streak': 0, 'best_streak': 0,
+            'games': 0, 'total_moves': 0, 'timed_games': 0, 'total_duration': 0,
+            'rating_peak': None, 'rating_low': None, 'activity': {}}
+
+
+def apply(stats, game, day):
+    """Добавляет партию к статистике. current_streak > 0 — победы подряд, < 0 — поражения подряд"""
+    result = game['result']
+    for column, key in (('by_color', game.get('user_color')), ('by_time_control', game.get('time_control')),
+                        ('by_opponent', game.get('opponent_type'))):
+        counts = stats[column].setdefault(key or '', {'win': 0, 'loss': 0, 'draw': 0})
+        counts[result] = counts.get(result, 0) + 1
+    streak = stats['current_streak']
+    if result == 'win':
+        streak = streak + 1 if streak > 0 else 1
+    elif result == 'loss':
+        streak = streak - 1 if streak < 0 else -1
+    else:
+        streak = 0
+    stats['current_streak'] = streak
+    stats['best_streak'] = max(stats['best_streak'], streak)
+    stats['games'] += 1
+    stats['total_moves'] += int(game.get('moves_count') or 0)
+    if game.get('duration_seconds'):
+        stats['timed_games'] += 1
+        stats['total_duration'] += int(game['duration_seconds'])
+    ratings = [r for r in (stats['rating_peak'], stats['rating_low'], game['rating_before'], game['rating_after'])
+               if r is not None]
+    stats['rating_peak'], stats['rating_low'] = max(ratings), min(ratings)
+    activity = stats['activity']
+    key = day.isoformat()
+    activity[key] = activity.get(key, 0) + 1
+    cutoff = (day - timedelta(days=ACTIVITY_DAYS)).isoformat()
+    for old in [d for d in activity if d <= cutoff]:
+        del activity[old]
+    return stats
+
+
+def _values(user_id, stats):
+    return "('%s', %s, NOW())" % (esc(user_id), ', '.join(
+        "'%s'::jsonb" % esc(json.dumps(stats[c], sort_keys=True)) if c in JSON_COLUMNS
+        else 'NULL' if stats[c] is None else '%d' % stats[c]
+        for c in COLUMNS))
+
+
+def save(cur, items):
+    """items — [(user_id, статистика)]; одним запросом, в порядке user_id"""
+    if items:
+        cur.execute(SAVE_SQL % (', '.join(COLUMNS), ', '.join(_values(uid, s) for uid, s in sorted(items)),
+                                ', '.join('%s = EXCLUDED.%s' % (c, c) for c in COLUMNS)))
+
+
+def _replay(rows):
+    """Строки HISTORY_SQL, упорядоченные по игроку → {user_id: статистика}"""
+    by_user = {}
+    for user_id, result, color, time_control, opponent_type, moves, duration, before, after, day in rows:
+        stats = by_user.get(user_id)
+        if stats is None:
+            stats = by_user[user_id] = empty()
+        apply(stats, {'result': result, 'user_color': color, 'time_control': time_control,
+                      'opponent_type': opponent_type, 'moves_count': moves, 'duration_seconds': duration,
+                      'rating_before': before, 'rating_after': after}, day)
+    return by_user
+
+
+def record(cur, user_id, game, day):
+    """Партия уже записана в game_history этой транзакцией; строка users игрока заблокирована"""
+    cur.execute("SELECT %s FROM user_stats WHERE user_id = '%s'" % (', '.join(COLUMNS), esc(user_id)))
+    row = cur.fetchone()
+    if row is None:
+        # Первая партия после появления user_stats: собираем по всей истории игрока, включая эту
+        cur.execute(HISTORY_SQL % ("user_id = '%s'" % esc(user_id)))
+        stats = _replay(cur.fetchall()).get(user_id) or apply(empty(), game, day)
+    else:
+        stats = apply(dict(zip(COLUMNS, row)), game, day)
+    save(cur, [(user_id, stats)])
+
+
+def rebuild(conn, chunk=REBUILD_CHUNK):
+    """Пересчитывает user_stats по game_history порциями игроков. Строки users порции блокируются,
+    чтобы партия, завершённая во время пересчёта, не потерялась при перезаписи"""
+    started = time.monotonic()
+    cur = conn.cursor()
+    last_id, players, games = '', 0, 0
+    try:
+        while True:
+            cur.execute("SELECT id FROM users WHERE id > '%s' ORDER BY id LIMIT %d FOR UPDATE"
+                        % (esc(last_id), chunk))
+            ids = [r[0] for r in cur.fetchall()]
+            if not ids:
+                break
+            cur.execute(HISTORY_SQL % ('user_id IN (%s)' % ', '.join("'%s'" % esc(uid) for uid in ids)))
+            rows = cur.fetchall()
+            stats = _replay(rows)
+            save(cur, list(stats.items()))
+            conn.commit()
+            last_id = ids[-1]
+            players += len(stats)
+            games += len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {'players': players, 'games': games, 'seconds': round(time.monotonic() - started, 2)}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'rebuild':
+        import psycopg2
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        try:
+            print(rebuild(conn))
+        finally:
+            conn.close()
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import base64
 import json
 import os
 import psycopg2
@@ -5,6 +6,58 @@ import random
 import string
 from datetime import datetime, timedelta
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+# Страница партий друга, как в game-history
+GAMES_PAGE_DEFAULT = 50
+GAMES_PAGE_MAX = 100
+
+
+def encode_cursor(created_at, game_id):
+    raw = '%s|%d' % (created_at.isoformat(), game_id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    created_at, game_id = raw.split('|')
+    return datetime.fromisoformat(created_at), int(game_id)
+
+
+# Сводная статистика из user_stats (ведёт finish-game), читается вместе с профилем по первичному ключу
+STATS_SELECT = ("s.by_color, s.by_time_control, s.by_opponent, s.current_streak, s.best_streak, s.games, "
+                "s.total_moves, s.timed_games, s.total_duration, s.rating_peak, s.rating_low, s.activity")
+
+
+def format_stats(row):
+    """Столбцы STATS_SELECT → статистика профиля; None, если игрок ещё не играл после появления user_stats"""
+    (by_color, by_time_control, by_opponent, current_streak, best_streak, games,
+     total_moves, timed_games, total_duration, rating_peak, rating_low, activity) = row
+    if games is None:
+        return None
+    return {
+        'by_color': by_color, 'by_time_control': by_time_control, 'by_opponent': by_opponent,
+        'current_streak': current_streak, 'best_streak': best_streak,
+        'avg_moves': round(total_moves / float(games), 1) if games else 0,
+        'avg_duration_seconds': int(total_duration / timed_games) if timed_games else None,
+        'rating_peak': rating_peak, 'rating_low': rating_low, 'activity': activity,
+    }
+
 
 def esc(val):
     return str(val).replace("'", "''")
@@ -24,6 +77,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -60,7 +116,7 @@ def handler(event: dict, context) -> dict:
         return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
 
     headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_conn()
     cur = conn.cursor()
 
     client_ip = get_client_ip(event)
@@ -174,7 +230,10 @@ def handler(event: dict, context) -> dict:
                 cur.close()
                 conn.close()
                 return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'friend_id required'})}
-            cur.execute("SELECT id, username, avatar, rating, city, games_played, wins, losses, draws, last_online FROM users WHERE id = '%s'" % esc(friend_id))
+            cur.execute(
+                """SELECT u.id, u.username, u.avatar, u.rating, u.city, u.games_played, u.wins, u.losses, u.draws,
+                          u.last_online, %s
+                   FROM users u LEFT JOIN user_stats s ON s.user_id = u.id WHERE u.id = '%s'""" % (STATS_SELECT, esc(friend_id)))
             row = cur.fetchone()
             cur.close()
             conn.close()
@@ -183,7 +242,8 @@ def handler(event: dict, context) -> dict:
             return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
                 'user': {'id': row[0], 'username': row[1], 'avatar': row[2] or '', 'rating': row[3], 'city': row[4] or '',
                          'games_played': row[5], 'wins': row[6], 'losses': row[7], 'draws': row[8],
-                         'last_online': row[9].isoformat() if row[9] else None}
+                         'last_online': row[9].isoformat() if row[9] else None,
+                         'stats': format_stats(row[10:])}
             })}
 
         if action == 'friend_games':
@@ -192,22 +252,36 @@ def handler(event: dict, context) -> dict:
                 cur.close()
                 conn.close()
                 return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'friend_id required'})}
+            try:
+                limit = min(max(int(qs.get('limit') or GAMES_PAGE_DEFAULT), 1), GAMES_PAGE_MAX)
+                cursor = decode_cursor(qs['cursor']) if qs.get('cursor') else None
+            except (ValueError, TypeError):
+                cur.close()
+                conn.close()
+                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid limit or cursor'})}
+            # Без ходов: партию целиком отдаёт game-history?game_id=
+            cond = "user_id = '%s'" % esc(friend_id)
+            if cursor is not None:
+                cond += " AND (created_at, id) < ('%s', %d)" % (cursor[0].isoformat(), cursor[1])
             cur.execute(
                 """SELECT id, opponent_name, opponent_type, opponent_rating, result, user_color,
                           time_control, difficulty, moves_count, rating_before, rating_after,
                           rating_change, duration_seconds, end_reason, created_at
-                   FROM game_history WHERE user_id = '%s' ORDER BY created_at DESC LIMIT 50""" % esc(friend_id))
+                   FROM game_history WHERE %s ORDER BY created_at DESC, id DESC LIMIT %d""" % (cond, limit + 1))
             rows = cur.fetchall()
             cur.close()
             conn.close()
+            next_cursor = None
+            if len(rows) > limit and rows[limit - 1][14] is not None:
+                next_cursor = encode_cursor(rows[limit - 1][14], rows[limit - 1][0])
             games = []
-            for r in rows:
+            for r in rows[:limit]:
                 games.append({'id': r[0], 'opponent_name': r[1], 'opponent_type': r[2], 'opponent_rating': r[3],
                               'result': r[4], 'user_color': r[5], 'time_control': r[6], 'difficulty': r[7],
                               'moves_count': r[8], 'rating_before': r[9], 'rating_after': r[10], 'rating_change': r[11],
                               'duration_seconds': r[12], 'end_reason': r[13],
                               'created_at': r[14].isoformat() if r[14] else None})
-            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'games': games})}
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'games': games, 'next_cursor': next_cursor})}
 
         if action == 'pending':
             cur.execute(
@@ -1,7 +1,117 @@
+import base64
 import json
 import os
+from datetime import datetime
+
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+
+# Страница истории: по умолчанию и не больше
+PAGE_DEFAULT = 50
+PAGE_MAX = 100
+
+# Поле ответа → столбец game_history, в порядке вывода
+FIELDS = (
+    ('id', 'id'), ('opponent_name', 'opponent_name'), ('opponent_type', 'opponent_type'),
+    ('opponent_rating', 'opponent_rating'), ('result', 'result'), ('user_color', 'user_color'),
+    ('time_control', 'time_control'), ('difficulty', 'difficulty'), ('moves_count', 'moves_count'),
+    ('move_history', 'move_history'), ('rating_before', 'rating_before'), ('rating_after', 'rating_after'),
+    ('rating_change', 'rating_change'), ('duration_seconds', 'duration_seconds'), ('end_reason', 'end_reason'),
+    ('created_at', 'created_at'), ('move_times', 'move_times'),
+)
+FIELD_NAMES = tuple(name for name, _ in FIELDS)
+# Ходы нужны только в просмотре одной партии (game_id=), в списке их не отдаём
+MOVE_FIELDS = ('move_history', 'move_times')
+LIST_FIELDS = tuple(name for name in FIELD_NAMES if name not in MOVE_FIELDS)
+
+# Сводная статистика из user_stats (ведёт finish-game), читается вместе с профилем по первичному ключу
+STATS_SELECT = ("s.by_color, s.by_time_control, s.by_opponent, s.current_streak, s.best_streak, s.games, "
+                "s.total_moves, s.timed_games, s.total_duration, s.rating_peak, s.rating_low, s.activity")
+
+
+def format_stats(row):
+    """Столбцы STATS_SELECT → статистика профиля; None, если игрок ещё не играл после появления user_stats"""
+    (by_color, by_time_control, by_opponent, current_streak, best_streak, games,
+     total_moves, timed_games, total_duration, rating_peak, rating_low, activity) = row
+    if games is None:
+        return None
+    return {
+        'by_color': by_color, 'by_time_control': by_time_control, 'by_opponent': by_opponent,
+        'current_streak': current_streak, 'best_streak': best_streak,
+        'avg_moves': round(total_moves / float(games), 1) if games else 0,
+        'avg_duration_seconds': int(total_duration / timed_games) if timed_games else None,
+        'rating_peak': rating_peak, 'rating_low': rating_low, 'activity': activity,
+    }
+
+
+def esc(val):
+    return str(val).replace("'", "''")
+
+
+def parse_fields(text, default):
+    """fields=a,b,c → поля ответа в порядке FIELDS; all — все поля; неизвестные имена пропускаются"""
+    if not text:
+        return default
+    wanted = {name.strip() for name in text.split(',')}
+    if 'all' in wanted:
+        return FIELD_NAMES
+    return tuple(name for name in FIELD_NAMES if name in wanted or name == 'id')
+
+
+def encode_cursor(created_at, game_id):
+    raw = '%s|%d' % (created_at.isoformat(), game_id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, id) последней партии предыдущей страницы или ValueError"""
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    created_at, game_id = raw.split('|')
+    return datetime.fromisoformat(created_at), int(game_id)
+
+
+def select_games(cur, user_id, fields, limit, cursor=None, game_id=None):
+    """Партии игрока по убыванию (created_at, id) — индекс idx_game_history_user_created.
+    Возвращает (партии, курсор следующей страницы или None)"""
+    columns = dict(FIELDS)
+    select = ', '.join(columns[name] for name in fields)
+    cond = "user_id = '%s'" % esc(user_id)
+    if game_id is not None:
+        cond += " AND id = %d" % game_id
+    elif cursor is not None:
+        cond += " AND (created_at, id) < ('%s', %d)" % (cursor[0].isoformat(), cursor[1])
+    cur.execute(
+        "SELECT %s, created_at AS page_created_at FROM game_history WHERE %s "
+        "ORDER BY created_at DESC, id DESC LIMIT %d" % (select, cond, limit + 1)
+    )
+    rows = cur.fetchall()
+    games = []
+    for row in rows[:limit]:
+        game = dict(zip(fields, row))
+        if game.get('created_at'):
+            game['created_at'] = game['created_at'].isoformat()
+        games.append(game)
+    next_cursor = None
+    if len(rows) > limit and rows[limit - 1][-1] is not None:
+        next_cursor = encode_cursor(rows[limit - 1][-1], rows[limit - 1][0])
+    return games, next_cursor
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
 
 def get_client_ip(event):
     hdrs = event.get('headers') or {}
@@ -17,6 +127,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -58,19 +171,47 @@ def handler(event: dict, context) -> dict:
     if not user_id:
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id required'})}
 
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        limit = min(max(int(params.get('limit') or PAGE_DEFAULT), 1), PAGE_MAX)
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+        game_id = int(params['game_id']) if params.get('game_id') else None
+    except (ValueError, TypeError):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Invalid limit, cursor or game_id'})}
+
+    conn = get_conn()
     cur = conn.cursor()
 
+    if game_id is not None:
+        # Одна партия целиком, с ходами и временем ходов
+        games, _ = select_games(cur, user_id, parse_fields(params.get('fields'), FIELD_NAMES), 1, game_id=game_id)
+        cur.close()
+        conn.close()
+        if not games:
+            return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Game not found'})}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'game': games[0]}, ensure_ascii=False)}
+
+    games, next_cursor = select_games(cur, user_id, parse_fields(params.get('fields'), LIST_FIELDS), limit, cursor)
+    if cursor is not None:
+        # Следующие страницы — только партии, профиль пришёл с первой
+        cur.close()
+        conn.close()
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({'games': games, 'next_cursor': next_cursor}, ensure_ascii=False)
+        }
+
     cur.execute(
-        "SELECT id, username, avatar, rating, games_played, wins, losses, draws FROM users WHERE id = '%s'"
-        % user_id.replace("'", "''")
+        "SELECT u.id, u.username, u.avatar, u.rating, u.games_played, u.wins, u.losses, u.draws, %s "
+        "FROM users u LEFT JOIN user_stats s ON s.user_id = u.id WHERE u.id = '%s'"
+        % (STATS_SELECT, esc(user_id))
     )
     user_row = cur.fetchone()
+    cur.close()
+    conn.close()
 
     if not user_row:
-        cur.close()
-        conn.close()
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'user': None, 'games': []})}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'user': None, 'games': [], 'next_cursor': None})}
 
     user = {
         'id': user_row[0],
@@ -80,47 +221,12 @@ def handler(event: dict, context) -> dict:
         'games_played': user_row[4],
         'wins': user_row[5],
         'losses': user_row[6],
-        'draws': user_row[7]
+        'draws': user_row[7],
+        'stats': format_stats(user_row[8:])
     }
 
-    limit = int(params.get('limit', '50'))
-    offset = int(params.get('offset', '0'))
-
-    cur.execute(
-        """SELECT id, opponent_name, opponent_type, opponent_rating, result, user_color, time_control, difficulty, 
-           moves_count, move_history, rating_before, rating_after, rating_change, duration_seconds, end_reason, created_at, move_times
-        FROM game_history WHERE user_id = '%s' ORDER BY created_at DESC LIMIT %d OFFSET %d"""
-        % (user_id.replace("'", "''"), limit, offset)
-    )
-    rows = cur.fetchall()
-
-    games = []
-    for r in rows:
-        games.append({
-            'id': r[0],
-            'opponent_name': r[1],
-            'opponent_type': r[2],
-            'opponent_rating': r[3],
-            'result': r[4],
-            'user_color': r[5],
-            'time_control': r[6],
-            'difficulty': r[7],
-            'moves_count': r[8],
-            'move_history': r[9],
-            'rating_before': r[10],
-            'rating_after': r[11],
-            'rating_change': r[12],
-            'duration_seconds': r[13],
-            'end_reason': r[14],
-            'created_at': r[15].isoformat() if r[15] else None,
-            'move_times': r[16]
-        })
-
-    cur.close()
-    conn.close()
-
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps({'user': user, 'games': games}, ensure_ascii=False)
-    }
\ No newline at end of file
+        'body': json.dumps({'user': user, 'games': games, 'next_cursor': next_cursor}, ensure_ascii=False)
+    }
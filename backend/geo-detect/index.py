@@ -3,6 +3,24 @@ import os
 import urllib.request
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+from player_location import known_region, region_for, relocate
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
 
 def get_client_ip(event):
     hdrs = event.get('headers') or {}
@@ -18,6 +36,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -163,8 +184,63 @@ REGION_MAP = {
 }
 
 
+def detect(source_ip):
+    """Город и регион по IP (ip-api.com); для локальных адресов и при ошибке — Москва"""
+    default = {'city': 'Москва', 'region': 'Москва', 'source': 'default'}
+    if not source_ip or source_ip.startswith('127.') or source_ip.startswith('10.') or source_ip.startswith('192.168.'):
+        return default
+
+    try:
+        url = 'http://ip-api.com/json/{}?fields=city,regionName,country,status&lang=en'.format(source_ip)
+        req = urllib.request.Request(url, headers={'User-Agent': 'LigaChess/1.0'})
+        with urllib.request.urlopen(req, timeout=3) as resp:
+            data = json.loads(resp.read().decode('utf-8'))
+    except Exception:
+        return default
+
+    if data.get('status') != 'success':
+        return default
+
+    en_city = data.get('city', '')
+    en_region = data.get('regionName', '')
+    return {
+        'city': CITY_MAP.get(en_city, '') or en_city,
+        'region': REGION_MAP.get(en_region, '') or en_region,
+        'source': 'ip'
+    }
+
+
+def save_region(user_id, region, detected_city=None, strict=False):
+    """Записывает регион игрока для таблиц рейтинга: только известный регион (city_regions) и только
+    совпадающий с регионом города профиля (region_for). Регион по IP записывается, только если город
+    из профиля совпал с определённым по IP (или город не указан). Возвращает (город, регион) игрока
+    после записи, None — игрока нет, False — при strict регион неизвестен"""
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        if strict and not known_region(cur, region):
+            conn.rollback()
+            return False
+        cur.execute("SELECT COALESCE(city, ''), COALESCE(region, '') FROM users WHERE id = '%s' FOR UPDATE"
+                    % user_id.replace("'", "''"))
+        row = cur.fetchone()
+        if not row:
+            conn.rollback()
+            return None
+        city, current = row
+        allowed = region_for(cur, city, region)
+        if allowed and (detected_city is None or city in ('', detected_city)):
+            city, current = relocate(cur, user_id, region=allowed)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return city, current
+
+
 def handler(event, context):
-    """Определение города пользователя по IP-адресу"""
+    """Определение города пользователя по IP-адресу. С user_id сохраняет регион игрока:
+    region из запроса (регион города профиля) или определённый по IP"""
     if event.get('httpMethod') == 'OPTIONS':
         return {
             'statusCode': 200,
@@ -178,66 +254,37 @@ def handler(event, context):
         }
 
     headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+    qs = event.get('queryStringParameters') or {}
+    user_id = qs.get('user_id', '')
+    region_hint = qs.get('region', '').strip()
 
-    hdrs = event.get('headers') or {}
-    source_ip = hdrs.get('X-Forwarded-For', hdrs.get('x-forwarded-for', ''))
-    if source_ip:
-        source_ip = source_ip.split(',')[0].strip()
-
-    if not source_ip:
-        source_ip = hdrs.get('X-Real-Ip', hdrs.get('x-real-ip', ''))
-
-    if not source_ip:
-        rc = event.get('requestContext') or {}
-        identity = rc.get('identity') or {}
-        source_ip = identity.get('sourceIp', '')
-
-    print('Detected IP: {}'.format(source_ip))
-
-    if not source_ip or source_ip.startswith('127.') or source_ip.startswith('10.') or source_ip.startswith('192.168.'):
+    if user_id and region_hint:
+        # Регион известен по городу профиля — ip-api не нужен
+        saved = save_region(user_id, region_hint, strict=True)
+        if saved is False:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Unknown region'})}
+        if saved is None:
+            return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'User not found'})}
         return {
             'statusCode': 200,
             'headers': headers,
-            'body': json.dumps({'city': 'Москва', 'region': 'Москва', 'source': 'default'})
+            'body': json.dumps({'city': saved[0], 'region': saved[1], 'source': 'profile'})
         }
 
-    try:
-        url = 'http://ip-api.com/json/{}?fields=city,regionName,country,status&lang=en'.format(source_ip)
-        req = urllib.request.Request(url, headers={'User-Agent': 'LigaChess/1.0'})
-        with urllib.request.urlopen(req, timeout=3) as resp:
-            data = json.loads(resp.read().decode('utf-8'))
-
-        if data.get('status') != 'success':
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({'city': 'Москва', 'region': 'Москва', 'source': 'default'})
-            }
-
-        en_city = data.get('city', '')
-        en_region = data.get('regionName', '')
-
-        ru_city = CITY_MAP.get(en_city, '')
-        ru_region = REGION_MAP.get(en_region, '')
-
-        if not ru_city:
-            ru_city = en_city
+    source_ip = get_client_ip(event)
+    if source_ip == 'unknown':
+        source_ip = ''
+    print('Detected IP: {}'.format(source_ip))
 
-        if not ru_region:
-            ru_region = en_region
+    result = detect(source_ip)
+    if user_id and result['source'] == 'ip' and result['region']:
+        try:
+            save_region(user_id, result['region'], result['city'])
+        except Exception as e:
+            print('Failed to save region: {}'.format(e))
 
-        return {
-            'statusCode': 200,
-            'headers': headers,
-            'body': json.dumps({
-                'city': ru_city,
-                'region': ru_region,
-                'source': 'ip'
-            })
-        }
-    except Exception:
-        return {
-            'statusCode': 200,
-            'headers': headers,
-            'body': json.dumps({'city': 'Москва', 'region': 'Москва', 'source': 'default'})
-        }
\ No newline at end of file
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps(result)
+    }
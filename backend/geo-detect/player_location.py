@@ -0,0 +1,90 @@
+"""
+Город и регион игрока для таблиц рейтинга. Допустимые пары город → регион берутся из таблицы
+city_regions (те же, что cityRegions во фронтенде). Модуль общий для geo-detect и verify-otp:
+copy_functions.sh кладёт его в deploy/backend/functions/ рядом с обоими хендлерами.
+relocate меняет город и регион игрока, add_player учитывает нового игрока; оба в той же транзакции
+меняют корзины rating_histogram и шлют lb_rating таблице рейтинга в памяти шлюза.
+"""
+import json
+
+# Ширина корзины rating_histogram; такая же в finish-game, apply-daily-decay и leaderboard
+HISTOGRAM_BUCKET = 50
+AVATAR_INLINE_MAX = 512
+
+HISTOGRAM_SQL = """INSERT INTO rating_histogram (scope, name, bucket, players) VALUES %s
+ON CONFLICT (scope, name, bucket) DO UPDATE SET players = rating_histogram.players + EXCLUDED.players"""
+
+
+def esc(val):
+    return str(val).replace("'", "''")
+
+
+def region_for(cur, city, region):
+    """Регион, который можно записать игроку: регион его города, а для города не из списка —
+    присланный регион, если он известен; иначе пустая строка"""
+    cur.execute(
+        "SELECT COALESCE((SELECT region FROM city_regions WHERE city = '%s'), "
+        "(SELECT region FROM city_regions WHERE region = '%s' LIMIT 1), '')" % (esc(city or ''), esc(region or ''))
+    )
+    return cur.fetchone()[0]
+
+
+def known_region(cur, region):
+    return bool(region) and region_for(cur, '', region) == region
+
+
+def notify_leaderboard(cur, entries):
+    """Событие lb_rating: [user_id, рейтинг, имя, город, аватар, регион]; уходит при COMMIT"""
+    event = json.dumps({'type': 'lb_rating', 'users': entries})
+    cur.execute("SELECT pg_notify('game_events', '%s')" % esc(event))
+
+
+def _histogram(cur, bucket, deltas):
+    if deltas:
+        cur.execute(HISTOGRAM_SQL % ', '.join(
+            "('%s', '%s', %d, %d)" % (scope, esc(name), bucket, delta)
+            for (scope, name), delta in sorted(deltas.items())))
+
+
+def add_player(cur, user_id, username, city, region, rating):
+    """Новый игрок уже вставлен в users этой транзакцией: корзины страны, города и региона и lb_rating"""
+    deltas = {('country', ''): 1}
+    if city:
+        deltas[('city', city)] = 1
+    if region:
+        deltas[('region', region)] = 1
+    _histogram(cur, rating // HISTOGRAM_BUCKET * HISTOGRAM_BUCKET, deltas)
+    notify_leaderboard(cur, [[user_id, rating, username, city, '', region or None]])
+
+
+def relocate(cur, user_id, city=None, region=None):
+    """Меняет город и/или регион игрока (None — оставить прежний). Возвращает (город, регион) после
+    изменения или None, если игрока нет. Коммит — за вызывающим"""
+    cur.execute(
+        "SELECT rating, username, COALESCE(city, ''), COALESCE(region, ''), "
+        "CASE WHEN LENGTH(COALESCE(avatar, '')) <= %d THEN COALESCE(avatar, '') END "
+        "FROM users WHERE id = '%s' FOR UPDATE" % (AVATAR_INLINE_MAX, esc(user_id))
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    rating, username, old_city, old_region, avatar = row
+    new_city = old_city if city is None else city
+    new_region = old_region if region is None else region
+    if (new_city, new_region) == (old_city, old_region):
+        return new_city, new_region
+    cur.execute(
+        "UPDATE users SET city = '%s', region = NULLIF('%s', ''), updated_at = NOW() WHERE id = '%s'"
+        % (esc(new_city), esc(new_region), esc(user_id))
+    )
+    # Рейтинг не меняется — игрок переходит в ту же корзину других таблиц города и региона
+    deltas = {}
+    for scope, old, new in (('city', old_city, new_city), ('region', old_region, new_region)):
+        if old != new:
+            if old:
+                deltas[(scope, old)] = -1
+            if new:
+                deltas[(scope, new)] = 1
+    _histogram(cur, rating // HISTOGRAM_BUCKET * HISTOGRAM_BUCKET, deltas)
+    notify_leaderboard(cur, [[user_id, rating, username, new_city, avatar, new_region or None]])
+    return new_city, new_region
@@ -3,6 +3,27 @@ import os
 import psycopg2
 import random
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+try:
+    import maintenance
+except ImportError:
+    maintenance = None
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
 
 def esc(val):
     return str(val).replace("'", "''")
@@ -22,6 +43,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -61,7 +85,7 @@ def handler(event: dict, context) -> dict:
         return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
 
     headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_conn()
     cur = conn.cursor()
 
     client_ip = get_client_ip(event)
@@ -81,14 +105,17 @@ def handler(event: dict, context) -> dict:
                 return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id required'})}
 
             if action == 'poll':
-                cur.execute(
-                    "DELETE FROM game_invites WHERE status = 'pending' AND created_at < NOW() - INTERVAL '2 minutes'"
-                )
-                conn.commit()
+                # В шлюзе просроченные приглашения удаляет фоновое обслуживание (deploy/backend/maintenance.py)
+                if maintenance is None:
+                    cur.execute(
+                        "DELETE FROM game_invites WHERE status = 'pending' AND created_at < NOW() - INTERVAL '2 minutes'"
+                    )
+                    conn.commit()
 
                 cur.execute(
                     "SELECT id, from_user_id, from_username, from_avatar, from_rating, time_control, color_choice, created_at "
                     "FROM game_invites WHERE to_user_id = '%s' AND status = 'pending' "
+                    "AND created_at > NOW() - INTERVAL '2 minutes' "
                     "ORDER BY created_at DESC LIMIT 1" % esc(user_id)
                 )
                 row = cur.fetchone()
@@ -216,11 +243,11 @@ def handler(event: dict, context) -> dict:
                     b_uid, b_name, b_avatar, b_rating = from_uid, from_name, from_avatar, from_rating
 
             cur.execute(
-                """INSERT INTO online_games (white_user_id, white_username, white_avatar, white_rating, black_user_id, black_username, black_avatar, black_rating, time_control, opponent_type, is_bot_game, white_time, black_time)
-                VALUES ('%s', '%s', '%s', %d, '%s', '%s', '%s', %d, '%s', 'friend', FALSE, %d, %d) RETURNING id"""
+                """INSERT INTO online_games (white_user_id, white_username, white_avatar, white_rating, black_user_id, black_username, black_avatar, black_rating, time_control, opponent_type, is_bot_game, white_time, black_time, white_clock_ms, black_clock_ms)
+                VALUES ('%s', '%s', '%s', %d, '%s', '%s', '%s', %d, '%s', 'friend', FALSE, %d, %d, %d, %d) RETURNING id"""
                 % (esc(w_uid), esc(w_name), esc(w_avatar), w_rating,
                    esc(b_uid), esc(b_name), esc(b_avatar), b_rating,
-                   esc(time_control), initial_time, initial_time)
+                   esc(time_control), initial_time, initial_time, initial_time * 1000, initial_time * 1000)
             )
             game_id = cur.fetchone()[0]
 
@@ -1,10 +1,221 @@
 import json
 import os
+import threading
+import time
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import leaderboard_index
+except ImportError:
+    leaderboard_index = None
+
+try:
+    import scheduler
+except ImportError:
+    scheduler = None
+
+import rating_histogram
+
+TOP_LIMIT = 50
+AROUND_MAX = 25
+SCOPES = ('country', 'region', 'city')
+
+# Без индекса шлюза топы кэшируются по (город, регион, limit): свежий ответ TOP_TTL секунд,
+# затем до TOP_STALE секунд отдаётся прежний, пока новый считается в фоне
+TOP_TTL = int(os.environ.get('LEADERBOARD_TTL', '30'))
+TOP_STALE = int(os.environ.get('LEADERBOARD_STALE', '300'))
+TOP_CACHE_MAX = 1000
+_top_cache = {}
+_refreshing = set()
+_cache_lock = threading.Lock()
+
+# Топы страны, региона и города одним запросом; пустой город или регион не выбирает строк
+TOPS_SQL = """
+(SELECT 'country', username, rating, city, avatar FROM {s}.users ORDER BY rating DESC LIMIT {n})
+UNION ALL
+(SELECT 'region', username, rating, city, avatar FROM {s}.users WHERE region = '{region}' AND '{region}' <> '' ORDER BY rating DESC LIMIT {n})
+UNION ALL
+(SELECT 'city', username, rating, city, avatar FROM {s}.users WHERE city = '{city}' AND '{city}' <> '' ORDER BY rating DESC LIMIT {n})
+"""
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+def esc(val):
+    return str(val).replace("'", "''")
+
+
+def default_avatar(name):
+    return 'https://api.dicebear.com/7.x/avataaars/svg?seed=%s' % name.replace(' ', '')
+
+
+def format_row(rank, name, rating, city, avatar):
+    return {
+        'rank': rank,
+        'name': name,
+        'rating': rating,
+        'city': city or '',
+        'avatar': avatar or default_avatar(name)
+    }
+
+
+def query_tops(cur, schema, city, region, limit):
+    cur.execute(TOPS_SQL.format(s=schema, n=limit, city=esc(city), region=esc(region)))
+    grouped = {'country': [], 'region': [], 'city': []}
+    for scope, name, rating, row_city, avatar in cur.fetchall():
+        grouped[scope].append((name, rating, row_city, avatar))
+    result = {}
+    for scope, rows in grouped.items():
+        rows.sort(key=lambda row: -row[1])
+        result[scope] = [format_row(i + 1, *row) for i, row in enumerate(rows)]
+    return result
+
+
+def refresh_tops(schema, key):
+    try:
+        conn = get_conn()
+        try:
+            cur = conn.cursor()
+            tops = query_tops(cur, schema, *key)
+            cur.close()
+        finally:
+            conn.close()
+        with _cache_lock:
+            _top_cache[key] = (time.time(), tops)
+            if len(_top_cache) > TOP_CACHE_MAX:
+                oldest = min(_top_cache, key=lambda k: _top_cache[k][0])
+                del _top_cache[oldest]
+        return tops
+    finally:
+        with _cache_lock:
+            _refreshing.discard(key)
+
+
+def refresh_in_background(schema, key):
+    try:
+        refresh_tops(schema, key)
+    except Exception as e:
+        print('[WARN] leaderboard refresh: {}'.format(e))
+
+
+def cached_tops(schema, city, region, limit):
+    key = (city, region, limit)
+    entry = _top_cache.get(key)
+    age = time.time() - entry[0] if entry else None
+    if entry and age < TOP_TTL:
+        return entry[1]
+    if entry and age < TOP_STALE:
+        with _cache_lock:
+            start = key not in _refreshing
+            _refreshing.add(key)
+        if start:
+            threading.Thread(target=refresh_in_background, args=(schema, key), daemon=True).start()
+        return entry[1]
+    return refresh_tops(schema, key)
+
+
+def query_standing(cur, schema, user_id):
+    """Место игрока без индекса шлюза: COUNT по users для страны, его города и региона"""
+    cur.execute("SELECT rating, city, region FROM {s}.users WHERE id = '%s'".format(s=schema) % esc(user_id))
+    row = cur.fetchone()
+    if not row:
+        return None
+    rating, city, region = row
+    scopes = [('country', '', '')]
+    if city:
+        scopes.append(('city', "city = '%s'" % esc(city), city))
+    if region:
+        scopes.append(('region', "region = '%s'" % esc(region), region))
+    result = {}
+    for scope, where_clause, name in scopes:
+        cond = (' AND ' + where_clause) if where_clause else ''
+        cur.execute(
+            "SELECT COUNT(*) FILTER (WHERE rating > %d), COUNT(*) FROM {s}.users WHERE TRUE{c}".format(s=schema, c=cond)
+            % rating
+        )
+        above, total = cur.fetchone()
+        result[scope] = {'rank': above + 1, 'rating': rating, 'total': total}
+        if name:
+            result[scope]['name'] = name
+    return result
+
+
+def fill_avatars(cur, schema, rows):
+    """Длинные аватары индекс шлюза не хранит — дочитываем их одним запросом по id"""
+    missing = {row['user_id'] for row in rows if row['avatar'] is None}
+    if missing:
+        cur.execute(
+            "SELECT id, avatar FROM {s}.users WHERE id IN ({ids})".format(
+                s=schema, ids=', '.join("'%s'" % esc(uid) for uid in missing))
+        )
+        avatars = dict(cur.fetchall())
+        for row in rows:
+            if row['avatar'] is None:
+                row['avatar'] = avatars.get(row['user_id'])
+    return [format_row(row['rank'], row['name'], row['rating'], row['city'], row['avatar']) for row in rows]
+
+
+def rating_stats(cur, schema, action, qs):
+    """Распределение рейтинга по корзинам rating_histogram: (код ответа, тело)"""
+    scope = qs.get('scope', 'country')
+    name = qs.get('name', '') if scope != 'country' else ''
+    if scope not in SCOPES:
+        return 400, {'error': 'scope must be one of country, region, city'}
+
+    if action == 'distribution':
+        buckets = rating_histogram.load(cur, schema, [(scope, name)])[(scope, name)]
+        return 200, dict(rating_histogram.distribution(buckets), scope=scope, name=name)
+
+    if action == 'distribution_history':
+        days = int(qs.get('days', '30'))
+        return 200, {'scope': scope, 'name': name, 'snapshots': rating_histogram.history(cur, schema, scope, name, days)}
+
+    # percentile: по рейтингу, городу и региону игрока или по переданным rating/city/region
+    user_id = qs.get('user_id', '')
+    if user_id:
+        cur.execute(
+            "SELECT rating, COALESCE(city, ''), COALESCE(region, '') FROM {s}.users WHERE id = '%s'".format(s=schema)
+            % esc(user_id)
+        )
+        row = cur.fetchone()
+        if not row:
+            return 404, {'error': 'User not found'}
+        rating, city, region = row
+    else:
+        rating = int(qs.get('rating', '0'))
+        city = qs.get('city', '')
+        region = qs.get('region', '')
+    scopes = [('country', '')] + ([('region', region)] if region else []) + ([('city', city)] if city else [])
+    histograms = rating_histogram.load(cur, schema, scopes)
+    result = {'rating': rating}
+    for scope, name in scopes:
+        item = rating_histogram.percentile(histograms[(scope, name)], rating)
+        if item and name:
+            item['name'] = name
+        result[scope] = item
+    return 200, result
+
+
+def scheduled_histogram():
+    """Задача планировщика шлюза: пересчёт корзин и срез распределения за день"""
+    conn = get_conn()
+    try:
+        return rating_histogram.rebuild(conn, os.environ.get('MAIN_DB_SCHEMA', 'public'))
+    finally:
+        conn.close()
+
 
 def handler(event, context):
-    """Рейтинг игроков: топ по стране, региону и городу"""
+    """Рейтинг игроков: топ по стране, региону и городу; с user_id — место игрока и соседи по таблице"""
     if event.get('httpMethod') == 'OPTIONS':
         return {
             'statusCode': 200,
@@ -18,58 +229,69 @@ def handler(event, context):
         }
 
     headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
-    dsn = os.environ['DATABASE_URL']
     schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
 
     qs = event.get('queryStringParameters') or {}
     city = qs.get('city', '')
     region = qs.get('region', '')
-    limit = min(int(qs.get('limit', '10')), 50)
-
-    def fetch_top(where_clause=''):
-        sql = "SELECT username, rating, city, avatar FROM {s}.users".format(s=schema)
-        if where_clause:
-            sql += " WHERE " + where_clause
-        sql += " ORDER BY rating DESC LIMIT %d" % limit
-        cur.execute(sql)
-        rows = cur.fetchall()
-        result = []
-        for i, row in enumerate(rows):
-            avatar = row[3] or ''
-            if not avatar:
-                seed = row[0].replace(' ', '')
-                avatar = 'https://api.dicebear.com/7.x/avataaars/svg?seed=%s' % seed
-            result.append({
-                'rank': i + 1,
-                'name': row[0],
-                'rating': row[1],
-                'city': row[2] or '',
-                'avatar': avatar
-            })
-        return result
-
-    top_country = fetch_top()
-
-    top_region = []
-    if region:
-        top_region = fetch_top("city IS NOT NULL")
+    user_id = qs.get('user_id', '')
+    limit = min(int(qs.get('limit', '10')), TOP_LIMIT)
+    around = min(int(qs.get('around', '0')), AROUND_MAX)
+    action = qs.get('action', '')
 
-    top_city = []
-    if city:
-        safe_city = city.replace("'", "''")
-        top_city = fetch_top("city = '%s'" % safe_city)
+    if action in ('distribution', 'distribution_history', 'percentile'):
+        conn = get_conn()
+        cur = conn.cursor()
+        try:
+            status, result = rating_stats(cur, schema, action, qs)
+        finally:
+            cur.close()
+            conn.close()
+        return {'statusCode': status, 'headers': headers, 'body': json.dumps(result)}
+
+    conn = None
+    cur = None
+    if leaderboard_index and leaderboard_index.is_ready():
+        # Индекс в памяти шлюза; в БД идём только за длинными аватарами
+        index = leaderboard_index.index
+        raw = {
+            'country': index.top('country', '', limit),
+            'region': index.top('region', region, limit) if region else [],
+            'city': index.top('city', city, limit) if city else [],
+        }
+        standing = index.standing(user_id, around) if user_id else None
+        rows = raw['country'] + raw['region'] + raw['city']
+        for item in (standing or {}).values():
+            rows += item.get('around', [])
+        if any(row['avatar'] is None for row in rows):
+            conn = get_conn()
+            cur = conn.cursor()
+        tops = {scope: fill_avatars(cur, schema, items) for scope, items in raw.items()}
+        for item in (standing or {}).values():
+            if 'around' in item:
+                item['around'] = fill_avatars(cur, schema, item['around'])
+    else:
+        tops = cached_tops(schema, city, region, limit)
+        standing = None
+        if user_id:
+            conn = get_conn()
+            cur = conn.cursor()
+            standing = query_standing(cur, schema, user_id)
 
-    cur.close()
-    conn.close()
+    if conn is not None:
+        cur.close()
+        conn.close()
 
+    result = dict(tops)
+    if user_id:
+        result['me'] = standing
     return {
         'statusCode': 200,
         'headers': headers,
-        'body': json.dumps({
-            'country': top_country,
-            'region': top_region,
-            'city': top_city
-        })
-    }
\ No newline at end of file
+        'body': json.dumps(result)
+    }
+
+
+if scheduler:
+    # После ежедневного снижения рейтинга в 00:00
+    scheduler.register('rating-histogram', '30 0 * * *', scheduled_histogram, jitter=60)
@@ -0,0 +1,109 @@
+"""
+Распределение рейтинга: число игроков по корзинам шириной HISTOGRAM_BUCKET для страны,
+каждого города и региона (таблица rating_histogram). Корзины ведут finish-game, apply-daily-decay
+и verify-otp при каждом изменении рейтинга, поэтому процентиль и оценка места считаются по
+нескольким десяткам строк корзин, а не COUNT по users. Ночная задача rating-histogram
+пересчитывает корзины из users (правки рейтинга в обход хендлеров, смена города) и сохраняет
+срез дня в rating_histogram_snapshots для графика распределения.
+"""
+from datetime import datetime, timedelta, timezone
+
+# Ширина корзины; такая же в finish-game, apply-daily-decay и verify-otp
+HISTOGRAM_BUCKET = 50
+HISTORY_MAX_DAYS = 365
+MSK = timezone(timedelta(hours=3))
+
+REBUILD_SQL = (
+    # Пока идёт пересчёт, хендлеры ждут с изменением корзин, а не теряют его
+    "LOCK TABLE {s}.rating_histogram IN EXCLUSIVE MODE",
+    "DELETE FROM {s}.rating_histogram",
+    """INSERT INTO {s}.rating_histogram (scope, name, bucket, players)
+SELECT 'country', '', rating / {w} * {w}, COUNT(*) FROM {s}.users GROUP BY 3
+UNION ALL
+SELECT 'city', city, rating / {w} * {w}, COUNT(*) FROM {s}.users WHERE city <> '' GROUP BY 2, 3
+UNION ALL
+SELECT 'region', region, rating / {w} * {w}, COUNT(*) FROM {s}.users WHERE region <> '' GROUP BY 2, 3""",
+)
+
+SNAPSHOT_SQL = """INSERT INTO {s}.rating_histogram_snapshots (taken_on, scope, name, bucket_width, buckets, players)
+SELECT '{day}', scope, name, {w}, jsonb_object_agg(bucket, players), SUM(players)
+FROM {s}.rating_histogram WHERE players > 0 GROUP BY scope, name
+ON CONFLICT (scope, name, taken_on) DO UPDATE SET
+    bucket_width = EXCLUDED.bucket_width, buckets = EXCLUDED.buckets, players = EXCLUDED.players"""
+
+
+def esc(val):
+    return str(val).replace("'", "''")
+
+
+def load(cur, schema, scopes):
+    """{(scope, name): [(корзина, игроков), ...]} для нескольких таблиц одним запросом"""
+    cond = ' OR '.join("(scope = '%s' AND name = '%s')" % (esc(scope), esc(name)) for scope, name in scopes)
+    cur.execute(
+        "SELECT scope, name, bucket, players FROM {s}.rating_histogram WHERE players > 0 AND ({c}) "
+        "ORDER BY scope, name, bucket".format(s=schema, c=cond)
+    )
+    result = {key: [] for key in scopes}
+    for scope, name, bucket, players in cur.fetchall():
+        result.setdefault((scope, name), []).append((bucket, players))
+    return result
+
+
+def distribution(buckets):
+    return {
+        'bucket_width': HISTOGRAM_BUCKET,
+        'total': sum(players for _, players in buckets),
+        'buckets': [{'from': bucket, 'to': bucket + HISTOGRAM_BUCKET - 1, 'players': players}
+                    for bucket, players in buckets],
+    }
+
+
+def percentile(buckets, rating):
+    """Доля игроков с рейтингом ниже rating (внутри корзины — линейно) и оценка места; O(корзин)"""
+    total = sum(players for _, players in buckets)
+    if not total:
+        return None
+    below = 0.0
+    for bucket, players in buckets:
+        if bucket + HISTOGRAM_BUCKET <= rating:
+            below += players
+        elif bucket <= rating:
+            below += players * (rating - bucket) / float(HISTOGRAM_BUCKET)
+    return {
+        'percentile': round(100.0 * below / total, 1),
+        'rank_estimate': max(1, int(round(total - below))),
+        'total': total,
+    }
+
+
+def history(cur, schema, scope, name, days):
+    """Срезы распределения за последние days дней для графика"""
+    since = (datetime.now(MSK) - timedelta(days=min(days, HISTORY_MAX_DAYS))).strftime('%Y-%m-%d')
+    cur.execute(
+        "SELECT taken_on, bucket_width, buckets, players FROM {s}.rating_histogram_snapshots "
+        "WHERE scope = '{scope}' AND name = '{name}' AND taken_on >= '{since}' ORDER BY taken_on".format(
+            s=schema, scope=esc(scope), name=esc(name), since=since)
+    )
+    return [{
+        'date': taken_on.isoformat(),
+        'bucket_width': width,
+        'total': players,
+        'buckets': sorted(([int(bucket), count] for bucket, count in buckets.items())),
+    } for taken_on, width, buckets, players in cur.fetchall()]
+
+
+def rebuild(conn, schema):
+    """Пересчёт корзин из users и срез дня; задача планировщика rating-histogram"""
+    cur = conn.cursor()
+    try:
+        for sql in REBUILD_SQL:
+            cur.execute(sql.format(s=schema, w=HISTOGRAM_BUCKET))
+        cur.execute(SNAPSHOT_SQL.format(s=schema, w=HISTOGRAM_BUCKET, day=datetime.now(MSK).strftime('%Y-%m-%d')))
+        snapshots = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {'snapshots': snapshots}
@@ -3,11 +3,42 @@ import os
 import psycopg2
 import random
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+try:
+    import game_cache
+except ImportError:
+    game_cache = None
+
+try:
+    import matchmaker
+except ImportError:
+    matchmaker = None
+
+GAME_FIELDS = ('id', 'white_user_id', 'white_username', 'white_avatar', 'white_rating',
+               'black_user_id', 'black_username', 'black_avatar', 'black_rating',
+               'time_control', 'status', 'is_bot_game', 'current_player',
+               'white_time', 'black_time', 'board_state', 'winner', 'end_reason')
+
 BOT_NAMES = [
     'Бот Каспаров', 'Бот Карлсен', 'Бот Фишер', 'Бот Таль',
     'Бот Капабланка', 'Бот Алехин', 'Бот Корчной', 'Бот Петросян'
 ]
 
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
 def get_initial_time(time_control):
     if '+' in time_control:
         parts = time_control.split('+')
@@ -20,6 +51,58 @@ def esc(val):
     return str(val).replace("'", "''")
 
 
+SEARCH_STAGES = ('city', 'region', 'rating', 'any')
+
+# Ближайших по рейтингу кандидатов с каждой стороны в каждой ступени: запас на строки, занятые другими поисками
+CANDIDATES_PER_SIDE = 4
+
+CANDIDATE_SQL = """SELECT id, %d AS stage FROM matchmaking_queue
+    WHERE user_id != '%s' AND last_heartbeat > NOW() - INTERVAL '%d seconds' %s"""
+
+
+def cascade_sql(user_id, user_rating, time_control, city, region, search_stage, rating_range, heartbeat_timeout,
+                skip_locked=True):
+    """Один запрос на весь каскад: кандидаты ступеней город → регион → рейтинг → любой,
+    отсортированные по ступени и разнице рейтингов. Каждая ступень берёт ближайших снизу и сверху
+    по индексам (time_control, city|region|—, rating); выбранная строка блокируется FOR UPDATE SKIP LOCKED,
+    поэтому параллельные поиски не забирают одного соперника.
+    skip_locked=False — кандидат без блокировки, для повтора с упорядоченной блокировкой (lock_pair).
+    Ступень «любой», как и раньше, не ограничена контролем времени: партия идёт по контролю ищущего."""
+    same_tc = "AND time_control = '%s' " % esc(time_control)
+    branches = []
+    if search_stage == 'city' and city:
+        branches.append((0, same_tc + "AND city = '%s'" % esc(city)))
+    if search_stage in ('city', 'region') and region:
+        branches.append((1, same_tc + "AND region = '%s'" % esc(region)))
+    branches.append((2, same_tc + "AND rating BETWEEN %d AND %d" % (user_rating - rating_range, user_rating + rating_range)))
+    if search_stage == 'any':
+        branches.append((3, ''))
+
+    parts = []
+    for stage, cond in branches:
+        where = CANDIDATE_SQL % (stage, esc(user_id), heartbeat_timeout, cond)
+        parts.append("(%s AND rating >= %d ORDER BY rating LIMIT %d)" % (where, user_rating, CANDIDATES_PER_SIDE))
+        parts.append("(%s AND rating < %d ORDER BY rating DESC LIMIT %d)" % (where, user_rating, CANDIDATES_PER_SIDE))
+    return """SELECT q.user_id, q.username, q.avatar, q.rating, c.stage
+        FROM (%s) c JOIN matchmaking_queue q ON q.id = c.id
+        ORDER BY c.stage, ABS(q.rating - %d) LIMIT 1%s""" % ('\n        UNION ALL '.join(parts), user_rating,
+                                                             '\n        FOR UPDATE OF q SKIP LOCKED' if skip_locked else '')
+
+
+def lock_pair(cur, conn, user_id, opponent_id, heartbeat_timeout):
+    """Блокирует свою строку очереди и строку соперника в порядке user_id — два встречных поиска
+    ждут друг друга, а не пропускают через SKIP LOCKED и не попадают во взаимную блокировку.
+    Возвращает (своя строка есть, соперник жив)."""
+    # Откатываем блокировку своей строки, взятую вне порядка
+    conn.rollback()
+    cur.execute(
+        "SELECT user_id, last_heartbeat > NOW() - INTERVAL '%d seconds' FROM matchmaking_queue "
+        "WHERE user_id IN ('%s', '%s') ORDER BY user_id FOR UPDATE"
+        % (heartbeat_timeout, esc(user_id), esc(opponent_id)))
+    rows = {r[0]: r[1] for r in cur.fetchall()}
+    return user_id in rows, bool(rows.get(opponent_id))
+
+
 def get_client_ip(event):
     hdrs = event.get('headers') or {}
     ip = hdrs.get('X-Forwarded-For', hdrs.get('x-forwarded-for', ''))
@@ -34,6 +117,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -59,27 +145,29 @@ def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
         return False
 
 
+def insert_game(cur, white, black, time_control, opponent_type, is_bot=False):
+    """Создаёт партию без COMMIT; white/black — словари user_id, username, avatar, rating"""
+    initial_time = get_initial_time(time_control)
+    cur.execute(
+        """INSERT INTO online_games (white_user_id, white_username, white_avatar, white_rating, black_user_id, black_username, black_avatar, black_rating, time_control, opponent_type, is_bot_game, white_time, black_time, white_clock_ms, black_clock_ms)
+        VALUES ('%s', '%s', '%s', %d, '%s', '%s', '%s', %d, '%s', '%s', %s, %d, %d, %d, %d) RETURNING id"""
+        % (esc(white['user_id']), esc(white['username']), esc(white['avatar'] or ''), white['rating'],
+           esc(black['user_id']), esc(black['username']), esc(black['avatar'] or ''), black['rating'],
+           esc(time_control), esc(opponent_type), 'TRUE' if is_bot else 'FALSE', initial_time, initial_time,
+           initial_time * 1000, initial_time * 1000)
+    )
+    return cur.fetchone()[0]
+
+
 def create_game(cur, conn, headers, user_id, username, avatar, user_rating, matched, time_control, opponent_type, is_bot=False):
     matched_uid, matched_name, matched_avatar, matched_rating = matched
 
     assign_white = random.random() < 0.5
-    initial_time = get_initial_time(time_control)
-
-    if assign_white:
-        w_uid, w_name, w_avatar, w_rating = user_id, username, avatar, user_rating
-        b_uid, b_name, b_avatar, b_rating = matched_uid, matched_name, matched_avatar or '', matched_rating
-    else:
-        w_uid, w_name, w_avatar, w_rating = matched_uid, matched_name, matched_avatar or '', matched_rating
-        b_uid, b_name, b_avatar, b_rating = user_id, username, avatar, user_rating
+    me = {'user_id': user_id, 'username': username, 'avatar': avatar, 'rating': user_rating}
+    opponent = {'user_id': matched_uid, 'username': matched_name, 'avatar': matched_avatar, 'rating': matched_rating}
+    white, black = (me, opponent) if assign_white else (opponent, me)
 
-    cur.execute(
-        """INSERT INTO online_games (white_user_id, white_username, white_avatar, white_rating, black_user_id, black_username, black_avatar, black_rating, time_control, opponent_type, is_bot_game, white_time, black_time)
-        VALUES ('%s', '%s', '%s', %d, '%s', '%s', '%s', %d, '%s', '%s', %s, %d, %d) RETURNING id"""
-        % (esc(w_uid), esc(w_name), esc(w_avatar), w_rating,
-           esc(b_uid), esc(b_name), esc(b_avatar), b_rating,
-           esc(time_control), esc(opponent_type), 'TRUE' if is_bot else 'FALSE', initial_time, initial_time)
-    )
-    game_id = cur.fetchone()[0]
+    game_id = insert_game(cur, white, black, time_control, opponent_type, is_bot)
     conn.commit()
 
     player_color = 'white' if assign_white else 'black'
@@ -98,6 +186,46 @@ def create_game(cur, conn, headers, user_id, username, avatar, user_rating, matc
     }
 
 
+# В шлюзе пары составляет matchmaker по всей очереди сразу; партии он создаёт этой функцией
+if matchmaker:
+    matchmaker.set_game_factory(insert_game)
+
+
+def mm_notify(cur, event):
+    cur.execute("SELECT pg_notify('game_events', '%s')" % esc(json.dumps(event)))
+
+
+def engine_search(cur, conn, headers, user_id, username, avatar, user_rating, opponent_type, time_control, city, region, search_stage):
+    """Поиск через matchmaker шлюза: игрок встаёт в очередь, пару найдёт ближайший тик"""
+    found = matchmaker.result_for(user_id, pop=True)
+    if found:
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(found)}
+
+    if matchmaker.in_queue(user_id):
+        event = {'type': 'mm_seen', 'user_id': user_id, 'stage': search_stage}
+    else:
+        cur.execute(
+            "INSERT INTO matchmaking_queue (user_id, username, avatar, rating, opponent_type, time_control, city, region, last_heartbeat) VALUES ('%s', '%s', '%s', %d, '%s', '%s', '%s', '%s', NOW()) ON CONFLICT (user_id) DO UPDATE SET rating = %d, opponent_type = '%s', time_control = '%s', city = '%s', region = '%s', created_at = NOW(), last_heartbeat = NOW()"
+            % (esc(user_id), esc(username), esc(avatar), user_rating,
+               esc(opponent_type), esc(time_control), esc(city), esc(region),
+               user_rating, esc(opponent_type), esc(time_control), esc(city), esc(region))
+        )
+        event = {'type': 'mm_join', 'user_id': user_id, 'username': username, 'rating': user_rating,
+                 'opponent_type': opponent_type, 'time_control': time_control,
+                 'city': city, 'region': region, 'stage': search_stage}
+    mm_notify(cur, event)
+    conn.commit()
+    matchmaker.apply_event(event)
+
+    # long_poll: дальше клиент ждёт пару через GET /api/matchmaking/wait, а не повторными POST
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+        'status': 'searching',
+        'search_stage': search_stage,
+        'queue_count': matchmaker.queue_count(time_control),
+        'long_poll': True
+    })}
+
+
 def handler(event: dict, context) -> dict:
     """Матчмейкинг с каскадным поиском: город → регион → рейтинг ±50 → любой онлайн"""
     if event.get('httpMethod') == 'OPTIONS':
@@ -107,24 +235,26 @@ def handler(event: dict, context) -> dict:
 
     client_ip = get_client_ip(event)
     if event.get('httpMethod') == 'POST':
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_conn()
         cur = conn.cursor()
         if check_rate_limit(cur, conn, client_ip, 'matchmaking', 20, 60):
             cur.close()
             conn.close()
             return {'statusCode': 429, 'headers': headers, 'body': json.dumps({'error': 'Too many requests'})}
-        cur.close()
-        conn.close()
 
     if event.get('httpMethod') == 'DELETE':
         body = json.loads(event.get('body', '{}'))
         user_id = body.get('user_id', '')
         if not user_id:
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id required'})}
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_conn()
         cur = conn.cursor()
         cur.execute("DELETE FROM matchmaking_queue WHERE user_id = '%s'" % esc(user_id))
+        if matchmaker and matchmaker.is_live():
+            mm_notify(cur, {'type': 'mm_leave', 'user_id': user_id})
         conn.commit()
+        if matchmaker and matchmaker.is_live():
+            matchmaker.apply_event({'type': 'mm_leave', 'user_id': user_id})
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'removed'})}
@@ -134,9 +264,15 @@ def handler(event: dict, context) -> dict:
         game_id = qs.get('game_id', '')
         user_id = qs.get('user_id', '')
         if game_id:
-            conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            # Активную партию online-move уже держит в кэше шлюза
+            cached = game_cache.get(int(game_id)) if game_cache else None
+            if cached:
+                game = {key: cached[key] for key in GAME_FIELDS}
+                game['move_history'] = ','.join(cached['moves'])
+                return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'game': game})}
+            conn = get_conn()
             cur = conn.cursor()
-            cur.execute("SELECT id, white_user_id, white_username, white_avatar, white_rating, black_user_id, black_username, black_avatar, black_rating, time_control, status, is_bot_game, current_player, white_time, black_time, move_history, board_state, winner, end_reason FROM online_games WHERE id = %d" % int(game_id))
+            cur.execute("SELECT id, white_user_id, white_username, white_avatar, white_rating, black_user_id, black_username, black_avatar, black_rating, time_control, status, is_bot_game, current_player, white_time, black_time, COALESCE(NULLIF(move_history, ''), (SELECT string_agg(m.uci, ',' ORDER BY m.ply) FROM online_game_moves m WHERE m.game_id = online_games.id), ''), board_state, winner, end_reason FROM online_games WHERE id = %d" % int(game_id))
             row = cur.fetchone()
             cur.close()
             conn.close()
@@ -151,8 +287,22 @@ def handler(event: dict, context) -> dict:
                     'winner': row[17], 'end_reason': row[18]
                 }
             })}
+        if user_id and matchmaker and matchmaker.is_live():
+            result = {'in_queue': matchmaker.in_queue(user_id)}
+            found = matchmaker.result_for(user_id)
+            if found:
+                result['active_game'] = {
+                    'game_id': found['game_id'],
+                    'player_color': found['player_color'],
+                    'opponent_name': found['opponent_name'],
+                    'opponent_rating': found['opponent_rating'],
+                    'opponent_avatar': found['opponent_avatar'],
+                    'time_control': found['time_control'],
+                    'is_bot_game': False
+                }
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps(result)}
         if user_id:
-            conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            conn = get_conn()
             cur = conn.cursor()
             cur.execute("SELECT id FROM matchmaking_queue WHERE user_id = '%s'" % esc(user_id))
             in_queue = cur.fetchone()
@@ -200,81 +350,89 @@ def handler(event: dict, context) -> dict:
     search_stage = body.get('search_stage', 'city')
 
     if not user_id:
+        cur.close()
+        conn.close()
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id required'})}
 
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
-    cur = conn.cursor()
-
-    # Читаем настройки матчмейкинга из БД
-    cur.execute("SELECT key, value FROM site_settings WHERE key LIKE 'mm_%'")
-    mm_rows = cur.fetchall()
-    mm_cfg = {r[0]: r[1] for r in mm_rows}
-    HEARTBEAT_TIMEOUT = int(mm_cfg.get('mm_heartbeat_timeout', '10'))
-    DEAD_RECORD_TTL = int(mm_cfg.get('mm_dead_record_ttl', '15'))
-    RATING_RANGE = int(mm_cfg.get('mm_rating_range', '50'))
+    engine = matchmaker is not None and matchmaker.is_live()
 
     if action == 'play_bot':
         cur.execute("DELETE FROM matchmaking_queue WHERE user_id = '%s'" % esc(user_id))
+        if engine:
+            mm_notify(cur, {'type': 'mm_leave', 'user_id': user_id})
         bot_name = random.choice(BOT_NAMES)
         bot_rating = user_rating + random.randint(-30, 30)
         result = create_game(cur, conn, headers, user_id, username, avatar, user_rating,
                              ('bot', bot_name, '', bot_rating), time_control, opponent_type, is_bot=True)
+        if engine:
+            matchmaker.apply_event({'type': 'mm_leave', 'user_id': user_id})
         cur.close()
         conn.close()
         return result
 
-    cur.execute("SELECT id FROM matchmaking_queue WHERE user_id = '%s'" % esc(user_id))
-    already_in = cur.fetchone()
-
-    match = None
-    matched_stage = None
-
-    HEARTBEAT_FILTER = "AND last_heartbeat > NOW() - INTERVAL '%d seconds'" % HEARTBEAT_TIMEOUT
+    if engine:
+        result = engine_search(cur, conn, headers, user_id, username, avatar, user_rating, opponent_type,
+                               time_control, city, region, search_stage)
+        cur.close()
+        conn.close()
+        return result
 
-    if search_stage == 'city' and city:
-        cur.execute(
-            "SELECT user_id, username, avatar, rating, time_control FROM matchmaking_queue WHERE user_id != '%s' AND time_control = '%s' AND city = '%s' %s ORDER BY ABS(rating - %d) LIMIT 1"
-            % (esc(user_id), esc(time_control), esc(city), HEARTBEAT_FILTER, user_rating)
-        )
-        match = cur.fetchone()
-        if match:
-            matched_stage = 'city'
+    # Читаем настройки матчмейкинга из БД
+    cur.execute("SELECT key, value FROM site_settings WHERE key LIKE 'mm_%'")
+    mm_rows = cur.fetchall()
+    mm_cfg = {r[0]: r[1] for r in mm_rows}
+    HEARTBEAT_TIMEOUT = int(mm_cfg.get('mm_heartbeat_timeout', '10'))
+    DEAD_RECORD_TTL = int(mm_cfg.get('mm_dead_record_ttl', '15'))
+    RATING_RANGE = int(mm_cfg.get('mm_rating_range', '50'))
 
-    if not match and search_stage in ('city', 'region') and region:
-        cur.execute(
-            "SELECT user_id, username, avatar, rating, time_control FROM matchmaking_queue WHERE user_id != '%s' AND time_control = '%s' AND region = '%s' %s ORDER BY ABS(rating - %d) LIMIT 1"
-            % (esc(user_id), esc(time_control), esc(region), HEARTBEAT_FILTER, user_rating)
-        )
-        match = cur.fetchone()
-        if match:
-            matched_stage = 'region'
+    # Чистим «мертвые» записи до поиска: COMMIT ниже не должен снимать блокировку с выбранного соперника
+    cur.execute("DELETE FROM matchmaking_queue WHERE time_control = '%s' AND last_heartbeat < NOW() - INTERVAL '%d seconds'"
+                % (esc(time_control), DEAD_RECORD_TTL))
+    conn.commit()
 
-    if not match and search_stage in ('city', 'region', 'rating', 'any'):
-        rating_min = user_rating - RATING_RANGE
-        rating_max = user_rating + RATING_RANGE
-        cur.execute(
-            "SELECT user_id, username, avatar, rating, time_control FROM matchmaking_queue WHERE user_id != '%s' AND time_control = '%s' AND rating >= %d AND rating <= %d %s ORDER BY ABS(rating - %d) LIMIT 1"
-            % (esc(user_id), esc(time_control), rating_min, rating_max, HEARTBEAT_FILTER, user_rating)
-        )
-        match = cur.fetchone()
-        if match:
-            matched_stage = 'rating'
+    cur.execute("SELECT id FROM matchmaking_queue WHERE user_id = '%s' FOR UPDATE SKIP LOCKED" % esc(user_id))
+    already_in = cur.fetchone()
+    if not already_in:
+        cur.execute("SELECT 1 FROM matchmaking_queue WHERE user_id = '%s'" % esc(user_id))
+        if cur.fetchone():
+            # Нашу строку держит соперник, который прямо сейчас создаёт с нами партию — её отдаст GET ?user_id=
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+                'status': 'searching',
+                'search_stage': search_stage,
+                'queue_count': 0
+            })}
 
-    if not match and search_stage == 'any':
-        cur.execute(
-            "SELECT user_id, username, avatar, rating, time_control FROM matchmaking_queue WHERE user_id != '%s' %s ORDER BY ABS(rating - %d) LIMIT 1"
-            % (esc(user_id), HEARTBEAT_FILTER, user_rating)
-        )
+    cur.execute(cascade_sql(user_id, user_rating, time_control, city, region, search_stage,
+                            RATING_RANGE, HEARTBEAT_TIMEOUT))
+    match = cur.fetchone()
+    if not match:
+        # Два одновременных поиска держат каждый свою строку и пропускают друг друга через SKIP LOCKED.
+        # Один повтор: кандидат без блокировки, затем обе строки блокируются по порядку user_id
+        cur.execute(cascade_sql(user_id, user_rating, time_control, city, region, search_stage,
+                                RATING_RANGE, HEARTBEAT_TIMEOUT, skip_locked=False))
         match = cur.fetchone()
         if match:
-            matched_stage = 'any'
-
-    # Чистим «мертвые» записи
-    cur.execute("DELETE FROM matchmaking_queue WHERE last_heartbeat < NOW() - INTERVAL '%d seconds'" % DEAD_RECORD_TTL)
-    conn.commit()
+            self_in, opponent_alive = lock_pair(cur, conn, user_id, match[0], HEARTBEAT_TIMEOUT)
+            if already_in and not self_in:
+                # Пока мы ждали блокировку, соперник создал партию с нами — её отдаст GET ?user_id=
+                conn.rollback()
+                cur.close()
+                conn.close()
+                return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+                    'status': 'searching',
+                    'search_stage': search_stage,
+                    'queue_count': 0
+                })}
+            already_in = already_in and self_in
+            if not opponent_alive:
+                match = None
+    matched_stage = SEARCH_STAGES[match[4]] if match else None
 
     if match:
-        matched_uid, matched_name, matched_avatar, matched_rating, matched_tc = match
+        matched_uid, matched_name, matched_avatar, matched_rating, _ = match
 
         cur.execute("DELETE FROM matchmaking_queue WHERE user_id IN ('%s', '%s')" % (esc(user_id), esc(matched_uid)))
 
@@ -300,7 +458,8 @@ def handler(event: dict, context) -> dict:
         cur.execute("UPDATE matchmaking_queue SET last_heartbeat = NOW() WHERE user_id = '%s'" % esc(user_id))
         conn.commit()
 
-    cur.execute("SELECT COUNT(*) FROM matchmaking_queue WHERE time_control = '%s'" % esc(time_control))
+    cur.execute("SELECT COUNT(*) FROM matchmaking_queue WHERE time_control = '%s' AND last_heartbeat > NOW() - INTERVAL '%d seconds'"
+                % (esc(time_control), HEARTBEAT_TIMEOUT))
     queue_count = cur.fetchone()[0]
 
     cur.close()
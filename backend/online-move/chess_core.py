@@ -0,0 +1,456 @@
+"""
+Шахматное ядро online-move: позиция на битбордах (int на 64 бита) и хэш Зобриста.
+Сервер сам проверяет легальность хода, определяет мат, пат, троекратное повторение,
+правило 50 ходов и пишет FEN в board_state — клиенту больше не нужно верить на слово.
+Клетки нумеруются от a1 = 0 до h8 = 63.
+"""
+import random
+import re
+
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+
+FULL = (1 << 64) - 1
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+RANK_3 = 0xFF << 16
+RANK_6 = 0xFF << 40
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+PIECE_CHARS = 'PNBRQKpnbrqk'
+PROMO_CHARS = {'n': KNIGHT, 'b': BISHOP, 'r': ROOK, 'q': QUEEN}
+
+# Ход с фронтенда: "e2-e4", без фигуры превращения (по умолчанию ферзь); принимаем и UCI "e7e8q"
+MOVE_RE = re.compile(r'^([a-h][1-8])-?([a-h][1-8])=?([nbrqNBRQ])?$')
+
+
+def _square(name):
+    return (ord(name[1]) - 49) * 8 + ord(name[0]) - 97
+
+
+def _square_name(sq):
+    return chr(97 + (sq & 7)) + chr(49 + (sq >> 3))
+
+
+def _leaper_attacks(offsets):
+    table = []
+    for sq in range(64):
+        rank, file = sq >> 3, sq & 7
+        bb = 0
+        for dr, df in offsets:
+            r, f = rank + dr, file + df
+            if 0 <= r < 8 and 0 <= f < 8:
+                bb |= 1 << (r * 8 + f)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_attacks([(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)])
+KING_ATTACKS = _leaper_attacks([(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)])
+PAWN_ATTACKS = (_leaper_attacks([(1, -1), (1, 1)]), _leaper_attacks([(-1, -1), (-1, 1)]))
+
+# Лучи скользящих фигур: у «положительных» направлений ближайший блокер — младший бит, у остальных — старший
+_DIRECTIONS = {'n': (1, 0), 'e': (0, 1), 'ne': (1, 1), 'nw': (1, -1),
+               's': (-1, 0), 'w': (0, -1), 'se': (-1, 1), 'sw': (-1, -1)}
+RAYS = {}
+for _name, (_dr, _df) in _DIRECTIONS.items():
+    _table = []
+    for _sq in range(64):
+        _bb = 0
+        _r, _f = (_sq >> 3) + _dr, (_sq & 7) + _df
+        while 0 <= _r < 8 and 0 <= _f < 8:
+            _bb |= 1 << (_r * 8 + _f)
+            _r, _f = _r + _dr, _f + _df
+        _table.append(_bb)
+    RAYS[_name] = _table
+
+RAY_N, RAY_E, RAY_NE, RAY_NW = RAYS['n'], RAYS['e'], RAYS['ne'], RAYS['nw']
+RAY_S, RAY_W, RAY_SE, RAY_SW = RAYS['s'], RAYS['w'], RAYS['se'], RAYS['sw']
+
+
+def _slide(sq, occ, pos_rays, neg_rays):
+    attacks = 0
+    for rays in pos_rays:
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in neg_rays:
+        ray = rays[sq]
+        blockers = ray & occ
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(sq, occ):
+    return _slide(sq, occ, (RAY_N, RAY_E), (RAY_S, RAY_W))
+
+
+def bishop_attacks(sq, occ):
+    return _slide(sq, occ, (RAY_NE, RAY_NW), (RAY_SE, RAY_SW))
+
+
+# Ключи Зобриста по 63 бита: хэш помещается в BIGINT PostgreSQL без перевода в знаковое
+_rng = random.Random(0x5EED_C4E55)
+PIECE_KEYS = [[_rng.getrandbits(63) for _ in range(64)] for _ in range(12)]
+CASTLE_KEYS = [_rng.getrandbits(63) for _ in range(16)]
+EP_KEYS = [_rng.getrandbits(63) for _ in range(8)]
+SIDE_KEY = _rng.getrandbits(63)
+
+# Права на рокировку: K=1, Q=2, k=4, q=8; маска снимает права, когда с клетки уходит или на неё встаёт фигура
+CASTLE_MASK = [15] * 64
+CASTLE_MASK[4], CASTLE_MASK[7], CASTLE_MASK[0] = 12, 14, 13
+CASTLE_MASK[60], CASTLE_MASK[63], CASTLE_MASK[56] = 3, 11, 7
+
+# Король с e1/e8 на две клетки: (клетка короля, откуда ладья, куда ладья, право, клетки между, клетки под боем)
+CASTLES = (
+    ((4, 6, 7, 5, 1, (1 << 5) | (1 << 6), (5, 6)), (4, 2, 0, 3, 2, (1 << 1) | (1 << 2) | (1 << 3), (3, 2))),
+    ((60, 62, 63, 61, 4, (1 << 61) | (1 << 62), (61, 62)), (60, 58, 56, 59, 8, (1 << 57) | (1 << 58) | (1 << 59), (59, 58))),
+)
+
+
+def encode_move(frm, to, promo=0):
+    return frm | (to << 6) | (promo << 12)
+
+
+def move_name(move):
+    """Ход в нотации фронтенда: e2-e4; превращение в ферзя не пишется"""
+    promo = move >> 12
+    name = _square_name(move & 63) + '-' + _square_name((move >> 6) & 63)
+    if promo and promo != QUEEN:
+        name += 'nbrq'[promo - KNIGHT]
+    return name
+
+
+class Position:
+    __slots__ = ('bb', 'occ', 'board', 'turn', 'castling', 'ep', 'halfmove', 'fullmove', 'hash')
+
+    def __init__(self):
+        self.bb = [0] * 12
+        self.occ = [0, 0]
+        self.board = [-1] * 64
+        self.turn = WHITE
+        self.castling = 0
+        self.ep = -1
+        self.halfmove = 0
+        self.fullmove = 1
+        self.hash = 0
+
+    @classmethod
+    def initial(cls):
+        return cls.from_fen(START_FEN)
+
+    @classmethod
+    def from_fen(cls, fen):
+        parts = fen.split()
+        if len(parts) < 4:
+            raise ValueError('bad FEN: %s' % fen)
+        pos = cls()
+        rank, file = 7, 0
+        for ch in parts[0]:
+            if ch == '/':
+                rank, file = rank - 1, 0
+            elif ch.isdigit():
+                file += int(ch)
+            else:
+                code = PIECE_CHARS.index(ch)
+                sq = rank * 8 + file
+                pos.board[sq] = code
+                pos.bb[code] |= 1 << sq
+                pos.occ[code // 6] |= 1 << sq
+                file += 1
+        pos.turn = WHITE if parts[1] == 'w' else BLACK
+        for ch in parts[2]:
+            pos.castling |= {'K': 1, 'Q': 2, 'k': 4, 'q': 8}.get(ch, 0)
+        if parts[3] != '-':
+            ep = _square(parts[3])
+            if PAWN_ATTACKS[pos.turn ^ 1][ep] & pos.bb[pos.turn * 6 + PAWN]:
+                pos.ep = ep
+        if len(parts) > 4:
+            pos.halfmove = int(parts[4])
+        if len(parts) > 5:
+            pos.fullmove = int(parts[5])
+        pos.hash = pos.compute_hash()
+        return pos
+
+    def compute_hash(self):
+        h = 0
+        for sq, code in enumerate(self.board):
+            if code >= 0:
+                h ^= PIECE_KEYS[code][sq]
+        h ^= CASTLE_KEYS[self.castling]
+        if self.ep >= 0:
+            h ^= EP_KEYS[self.ep & 7]
+        if self.turn == BLACK:
+            h ^= SIDE_KEY
+        return h
+
+    def fen(self):
+        rows = []
+        for rank in range(7, -1, -1):
+            row, empty = '', 0
+            for file in range(8):
+                code = self.board[rank * 8 + file]
+                if code < 0:
+                    empty += 1
+                    continue
+                if empty:
+                    row, empty = row + str(empty), 0
+                row += PIECE_CHARS[code]
+            rows.append(row + (str(empty) if empty else ''))
+        castling = ''.join(ch for bit, ch in ((1, 'K'), (2, 'Q'), (4, 'k'), (8, 'q')) if self.castling & bit) or '-'
+        ep = _square_name(self.ep) if self.ep >= 0 else '-'
+        return '%s %s %s %s %d %d' % ('/'.join(rows), 'wb'[self.turn], castling, ep, self.halfmove, self.fullmove)
+
+    def king_square(self, color):
+        return self.bb[color * 6 + KING].bit_length() - 1
+
+    def is_attacked(self, sq, by):
+        bb = self.bb
+        off = by * 6
+        if PAWN_ATTACKS[by ^ 1][sq] & bb[off + PAWN]:
+            return True
+        if KNIGHT_ATTACKS[sq] & bb[off + KNIGHT]:
+            return True
+        if KING_ATTACKS[sq] & bb[off + KING]:
+            return True
+        occ = self.occ[0] | self.occ[1]
+        rooks = bb[off + ROOK] | bb[off + QUEEN]
+        if rooks and rook_attacks(sq, occ) & rooks:
+            return True
+        bishops = bb[off + BISHOP] | bb[off + QUEEN]
+        if bishops and bishop_attacks(sq, occ) & bishops:
+            return True
+        return False
+
+    def in_check(self):
+        return self.is_attacked(self.king_square(self.turn), self.turn ^ 1)
+
+    def pseudo_moves(self):
+        us = self.turn
+        them = us ^ 1
+        bb = self.bb
+        off = us * 6
+        own = self.occ[us]
+        enemy = self.occ[them]
+        occ = own | enemy
+        empty = ~occ & FULL
+        not_own = ~own & FULL
+        moves = []
+        add = moves.append
+
+        pawns = bb[off + PAWN]
+        if us == WHITE:
+            single = (pawns << 8) & empty
+            double = ((single & RANK_3) << 8) & empty
+            left = ((pawns & ~FILE_A) << 7) & enemy
+            right = ((pawns & ~FILE_H) << 9) & enemy
+            steps = ((single, 8), (double, 16), (left, 7), (right, 9))
+            promo_from = 56
+        else:
+            single = (pawns >> 8) & empty
+            double = ((single & RANK_6) >> 8) & empty
+            left = ((pawns & ~FILE_H) >> 7) & enemy
+            right = ((pawns & ~FILE_A) >> 9) & enemy
+            steps = ((single, -8), (double, -16), (left, -7), (right, -9))
+            promo_from = 0
+        for targets, delta in steps:
+            while targets:
+                low = targets & -targets
+                to = low.bit_length() - 1
+                targets ^= low
+                frm = to - delta
+                if promo_from <= to < promo_from + 8:
+                    base = frm | (to << 6)
+                    add(base | (QUEEN << 12))
+                    add(base | (ROOK << 12))
+                    add(base | (BISHOP << 12))
+                    add(base | (KNIGHT << 12))
+                else:
+                    add(frm | (to << 6))
+        if self.ep >= 0:
+            attackers = PAWN_ATTACKS[them][self.ep] & pawns
+            while attackers:
+                low = attackers & -attackers
+                attackers ^= low
+                add((low.bit_length() - 1) | (self.ep << 6))
+
+        for piece in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            pieces = bb[off + piece]
+            while pieces:
+                low = pieces & -pieces
+                frm = low.bit_length() - 1
+                pieces ^= low
+                if piece == KNIGHT:
+                    targets = KNIGHT_ATTACKS[frm]
+                elif piece == BISHOP:
+                    targets = bishop_attacks(frm, occ)
+                elif piece == ROOK:
+                    targets = rook_attacks(frm, occ)
+                elif piece == QUEEN:
+                    targets = rook_attacks(frm, occ) | bishop_attacks(frm, occ)
+                else:
+                    targets = KING_ATTACKS[frm]
+                targets &= not_own
+                while targets:
+                    t_low = targets & -targets
+                    targets ^= t_low
+                    add(frm | ((t_low.bit_length() - 1) << 6))
+
+        if self.castling:
+            for king_from, king_to, rook_from, _, right, between, path in CASTLES[us]:
+                if (self.castling & right and not occ & between
+                        and self.board[king_from] == off + KING and self.board[rook_from] == off + ROOK):
+                    if not self.is_attacked(king_from, them) and not any(self.is_attacked(sq, them) for sq in path):
+                        add(king_from | (king_to << 6))
+        return moves
+
+    def make(self, move):
+        """Новая позиция после хода (copy-make); легальность не проверяется"""
+        frm = move & 63
+        to = (move >> 6) & 63
+        promo = move >> 12
+        us = self.turn
+        them = us ^ 1
+
+        pos = Position.__new__(Position)
+        bb = pos.bb = list(self.bb)
+        occ = pos.occ = list(self.occ)
+        board = pos.board = list(self.board)
+        h = self.hash
+
+        code = board[frm]
+        piece = code - us * 6
+        from_bit, to_bit = 1 << frm, 1 << to
+
+        captured = board[to]
+        if captured >= 0:
+            bb[captured] ^= to_bit
+            occ[them] ^= to_bit
+            h ^= PIECE_KEYS[captured][to]
+        elif piece == PAWN and to == self.ep:
+            cap_sq = to - 8 if us == WHITE else to + 8
+            cap_code = them * 6 + PAWN
+            bb[cap_code] ^= 1 << cap_sq
+            occ[them] ^= 1 << cap_sq
+            board[cap_sq] = -1
+            h ^= PIECE_KEYS[cap_code][cap_sq]
+            captured = cap_code
+
+        bb[code] ^= from_bit
+        occ[us] ^= from_bit | to_bit
+        board[frm] = -1
+        h ^= PIECE_KEYS[code][frm]
+        new_code = us * 6 + promo if promo else code
+        bb[new_code] ^= to_bit
+        board[to] = new_code
+        h ^= PIECE_KEYS[new_code][to]
+
+        if piece == KING and (to - frm == 2 or frm - to == 2):
+            for king_from, king_to, rook_from, rook_to, _, _, _ in CASTLES[us]:
+                if king_from == frm and king_to == to:
+                    rook_code = us * 6 + ROOK
+                    rook_bits = (1 << rook_from) | (1 << rook_to)
+                    bb[rook_code] ^= rook_bits
+                    occ[us] ^= rook_bits
+                    board[rook_from] = -1
+                    board[rook_to] = rook_code
+                    h ^= PIECE_KEYS[rook_code][rook_from] ^ PIECE_KEYS[rook_code][rook_to]
+
+        castling = self.castling & CASTLE_MASK[frm] & CASTLE_MASK[to]
+        if castling != self.castling:
+            h ^= CASTLE_KEYS[self.castling] ^ CASTLE_KEYS[castling]
+        pos.castling = castling
+
+        if self.ep >= 0:
+            h ^= EP_KEYS[self.ep & 7]
+        pos.ep = -1
+        if piece == PAWN and (to - frm == 16 or frm - to == 16):
+            ep = (frm + to) >> 1
+            # Поле взятия на проходе учитываем, только если его действительно можно взять
+            if PAWN_ATTACKS[us][ep] & bb[them * 6 + PAWN]:
+                pos.ep = ep
+                h ^= EP_KEYS[ep & 7]
+
+        pos.halfmove = 0 if piece == PAWN or captured >= 0 else self.halfmove + 1
+        pos.fullmove = self.fullmove + 1 if us == BLACK else self.fullmove
+        pos.turn = them
+        pos.hash = h ^ SIDE_KEY
+        return pos
+
+    def is_legal_after(self, pos):
+        """Не остался ли король стороны, сделавшей ход, под шахом"""
+        return not pos.is_attacked(pos.king_square(self.turn), pos.turn)
+
+    def legal_moves(self):
+        result = []
+        for move in self.pseudo_moves():
+            if self.is_legal_after(self.make(move)):
+                result.append(move)
+        return result
+
+    def has_legal_move(self):
+        for move in self.pseudo_moves():
+            if self.is_legal_after(self.make(move)):
+                return True
+        return False
+
+    def parse_move(self, text):
+        """Ход из строки в легальный ход позиции; None, если ход невозможен"""
+        m = MOVE_RE.match(text.strip())
+        if not m:
+            return None
+        frm, to = _square(m.group(1)), _square(m.group(2))
+        promo = 0
+        code = self.board[frm]
+        if code == self.turn * 6 + PAWN and (to >> 3) in (0, 7):
+            promo = PROMO_CHARS[m.group(3).lower()] if m.group(3) else QUEEN
+        move = encode_move(frm, to, promo)
+        if move not in self.pseudo_moves():
+            return None
+        after = self.make(move)
+        if not self.is_legal_after(after):
+            return None
+        return move
+
+    def outcome(self, history):
+        """Итог позиции: checkmate, stalemate, repetition, fifty_moves или None.
+        history — хэши позиций с последнего взятия или хода пешкой, включая текущую."""
+        if not self.has_legal_move():
+            return 'checkmate' if self.in_check() else 'stalemate'
+        if self.halfmove >= 100:
+            return 'fifty_moves'
+        if history.count(self.hash) >= 3:
+            return 'repetition'
+        return None
+
+
+def replay(moves, start_fen=START_FEN):
+    """Проигрывает список ходов; возвращает позицию и хэши с последнего необратимого хода.
+    ValueError, если какой-то ход нелегален."""
+    pos = Position.from_fen(start_fen)
+    history = [pos.hash]
+    for text in moves:
+        move = pos.parse_move(text)
+        if move is None:
+            raise ValueError('illegal move %s' % text)
+        pos = pos.make(move)
+        if pos.halfmove == 0:
+            history = []
+        history.append(pos.hash)
+    return pos, history
+
+
+def perft(pos, depth):
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in pos.pseudo_moves():
+        child = pos.make(move)
+        if pos.is_legal_after(child):
+            nodes += 1 if depth == 1 else perft(child, depth - 1)
+    return nodes
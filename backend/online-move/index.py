@@ -1,8 +1,323 @@
+import hashlib
 import json
 import os
 import psycopg2
 import time as time_module
 
+from chess_core import Position, replay
+
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+try:
+    import game_cache
+except ImportError:
+    game_cache = None
+
+try:
+    import signal_relay
+except ImportError:
+    signal_relay = None
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
+
+# Запас на сетевую задержку, когда клиент сам сообщает о падении флажка
+TIMEOUT_GRACE_MS = 500
+# Без хода дольше MOVE_INACTIVITY_MS сторона проигрывает, как по таймеру бездействия клиента (60 с);
+# запас больше, чем у флажка: клиентский счётчик стартует по seconds_since_move с точностью до секунды
+MOVE_INACTIVITY_MS = 60000
+INACTIVITY_GRACE_MS = 2000
+
+# Срок хода стороны с clock_ms на часах: кончится время или лимит бездействия, смотря что раньше.
+# По deadline_at партии находит clock_sweeper
+DEADLINE_SQL = "NOW() + LEAST(%d, " + str(MOVE_INACTIVITY_MS) + ") * INTERVAL '1 millisecond'"
+
+CLOCK_COLUMNS = """COALESCE(white_clock_ms, white_time * 1000), COALESCE(black_clock_ms, black_time * 1000),
+                  (EXTRACT(EPOCH FROM (NOW() - last_move_at)) * 1000)::bigint as ms_since_move"""
+
+STATE_COLUMNS = """id, status, current_player, white_time, black_time, winner, end_reason,
+                  EXTRACT(EPOCH FROM (NOW() - last_move_at))::int as seconds_since_move,
+                  move_number, rematch_offered_by, rematch_status, rematch_game_id, draw_offered_by,
+                  """ + CLOCK_COLUMNS
+
+
+# Ходы лежат в online_game_moves; колонка move_history заполняется только при завершении партии
+MOVE_HISTORY_SQL = """COALESCE(NULLIF(move_history, ''),
+                  (SELECT string_agg(m.uci, ',' ORDER BY m.ply) FROM online_game_moves m WHERE m.game_id = online_games.id),
+                  '')"""
+
+
+def materialize_move_history(cur, game_id):
+    """Один раз собирает move_history из online_game_moves, когда партия закончилась"""
+    cur.execute(
+        """UPDATE online_games SET move_history = COALESCE(
+               (SELECT string_agg(uci, ',' ORDER BY ply) FROM online_game_moves WHERE game_id = %d), move_history)
+        WHERE id = %d""" % (game_id, game_id)
+    )
+
+
+def running_clocks(status, current_player, white_ms, black_ms, ms_since_move):
+    """Остаток времени в мс на текущий момент: у игрока, чей ход, вычитается время с последнего хода"""
+    if status == 'playing' and ms_since_move and ms_since_move > 0:
+        if current_player == 'white':
+            white_ms = max(0, white_ms - ms_since_move)
+        else:
+            black_ms = max(0, black_ms - ms_since_move)
+    return white_ms, black_ms
+
+
+GAME_FIELDS = ('id', 'white_user_id', 'white_username', 'white_avatar', 'white_rating',
+               'black_user_id', 'black_username', 'black_avatar', 'black_rating',
+               'time_control', 'status', 'is_bot_game', 'current_player', 'board_state',
+               'winner', 'end_reason', 'move_number',
+               'rematch_offered_by', 'rematch_status', 'rematch_game_id', 'draw_offered_by')
+
+STATE_FIELDS = ('id', 'status', 'current_player', 'white_time', 'black_time', 'white_clock_ms', 'black_clock_ms',
+                'winner', 'end_reason', 'move_number', 'seconds_since_move',
+                'rematch_offered_by', 'rematch_status', 'rematch_game_id', 'draw_offered_by')
+
+
+GAME_SELECT = """SELECT id, white_user_id, white_username, white_avatar, white_rating,
+                  black_user_id, black_username, black_avatar, black_rating,
+                  time_control, status, is_bot_game, current_player,
+                  white_time, black_time, """ + MOVE_HISTORY_SQL + """, board_state,
+                  winner, end_reason,
+                  EXTRACT(EPOCH FROM (NOW() - last_move_at))::int as seconds_since_move,
+                  move_number,
+                  rematch_offered_by, rematch_status, rematch_game_id,
+                  draw_offered_by, """ + CLOCK_COLUMNS + """
+        FROM online_games"""
+
+# Сколько партий можно запросить одним GET ?game_ids= (табло турнира, зрители)
+MAX_BATCH_GAMES = 100
+
+
+def game_from_row(row):
+    return {
+        'id': row[0],
+        'white_user_id': row[1], 'white_username': row[2], 'white_avatar': row[3], 'white_rating': row[4],
+        'black_user_id': row[5], 'black_username': row[6], 'black_avatar': row[7], 'black_rating': row[8],
+        'time_control': row[9], 'status': row[10], 'is_bot_game': row[11],
+        'current_player': row[12], 'white_time': row[13], 'black_time': row[14],
+        'moves': row[15].split(',') if row[15] else [], 'board_state': row[16],
+        'winner': row[17], 'end_reason': row[18], 'seconds_since_move': row[19] or 0,
+        'move_number': row[20] or 0,
+        'rematch_offered_by': row[21], 'rematch_status': row[22], 'rematch_game_id': row[23],
+        'draw_offered_by': row[24],
+        'white_clock_ms': row[25], 'black_clock_ms': row[26], 'ms_since_move': row[27] or 0,
+    }
+
+
+def load_game(cur, game_id):
+    """Полная строка партии с ходами; этот же словарь кладётся в кэш шлюза"""
+    cur.execute("%s WHERE id = %d" % (GAME_SELECT, game_id))
+    row = cur.fetchone()
+    return game_from_row(row) if row else None
+
+
+def load_games(cur, game_ids):
+    """Несколько партий: сначала из кэша шлюза, остальные одним запросом WHERE id IN (...)"""
+    games = {}
+    missing = []
+    for gid in game_ids:
+        game = game_cache.get(gid) if game_cache else None
+        if game is None:
+            missing.append(gid)
+        else:
+            games[gid] = game
+    if missing:
+        token = game_cache.begin_load() if game_cache else None
+        cur.execute("%s WHERE id IN (%s)" % (GAME_SELECT, ','.join(str(gid) for gid in missing)))
+        for row in cur.fetchall():
+            game = game_from_row(row)
+            games[game['id']] = game
+            if game_cache:
+                game_cache.put(game, token)
+    return games
+
+
+def compact_game(game, since=None):
+    """Короткое состояние для табло: без аватаров и полной истории; с since — ходы после него"""
+    state = present_game(game)
+    compact = {key: state[key] for key in STATE_FIELDS}
+    compact.update({
+        'white_username': state['white_username'], 'white_rating': state['white_rating'],
+        'black_username': state['black_username'], 'black_rating': state['black_rating'],
+        'time_control': state['time_control'], 'board_state': state['board_state'],
+        'last_move': game['moves'][-1] if game['moves'] else None,
+        'etag': game_etag(state),
+    })
+    if since is not None and 0 <= since <= state['move_number']:
+        compact['since_move'] = since
+        compact['moves'] = game['moves'][since:]
+    return compact
+
+
+def present_game(game):
+    """Полное состояние для ответа GET из словаря load_game или кэша, часы пересчитаны на текущий момент"""
+    status, current_player = game['status'], game['current_player']
+    white_time, black_time = game['white_time'], game['black_time']
+    seconds_since_move = game['seconds_since_move']
+    if status == 'playing' and seconds_since_move > 0:
+        if current_player == 'white':
+            white_time = max(0, white_time - seconds_since_move)
+        else:
+            black_time = max(0, black_time - seconds_since_move)
+    white_ms, black_ms = running_clocks(status, current_player, game['white_clock_ms'], game['black_clock_ms'],
+                                        game['ms_since_move'])
+    state = {key: game[key] for key in GAME_FIELDS}
+    state.update({
+        'white_time': white_time, 'black_time': black_time,
+        'white_clock_ms': white_ms, 'black_clock_ms': black_ms,
+        'move_history': ','.join(game['moves']),
+        'seconds_since_move': seconds_since_move,
+    })
+    return state
+
+
+def game_state(row):
+    """Короткое состояние партии из строки STATE_COLUMNS, часы пересчитаны на текущий момент"""
+    status, current_player, white_time, black_time = row[1], row[2], row[3], row[4]
+    seconds_since_move = row[7] or 0
+    if status == 'playing' and seconds_since_move > 0:
+        if current_player == 'white':
+            white_time = max(0, white_time - seconds_since_move)
+        else:
+            black_time = max(0, black_time - seconds_since_move)
+    white_ms, black_ms = running_clocks(status, current_player, row[13], row[14], row[15])
+    return {
+        'id': row[0], 'status': status, 'current_player': current_player,
+        'white_time': white_time, 'black_time': black_time,
+        'white_clock_ms': white_ms, 'black_clock_ms': black_ms,
+        'winner': row[5], 'end_reason': row[6],
+        'move_number': row[8] or 0, 'seconds_since_move': seconds_since_move,
+        'rematch_offered_by': row[9], 'rematch_status': row[10], 'rematch_game_id': row[11],
+        'draw_offered_by': row[12]
+    }
+
+
+def game_etag(state):
+    raw = '%s|%s|%s|%s|%s' % (state['id'], state['move_number'], state['status'],
+                              state['draw_offered_by'] or '', state['rematch_status'] or '')
+    return '"%s"' % hashlib.md5(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def pop_signals(cur, conn, game_id, user_id):
+    """Забирает WebRTC-сигналы и сообщения чата для игрока: из ящика шлюза, а таблицу читает только при необходимости"""
+    if signal_relay and signal_relay.is_live():
+        signals, check_db = signal_relay.pop(game_id, user_id)
+        if signals:
+            notify_game(cur, game_id, {'type': 'signal_ack', 'to': user_id, 'ids': [s['id'] for s in signals]})
+            conn.commit()
+        if check_db:
+            signals += pop_db_signals(cur, conn, game_id, user_id)
+        return signals
+    return pop_db_signals(cur, conn, game_id, user_id)
+
+
+def pop_db_signals(cur, conn, game_id, user_id):
+    """Непрочитанные сигналы из webrtc_signals, помечаются прочитанными"""
+    cur.execute(
+        "SELECT id, from_user_id, signal_type, signal_data FROM webrtc_signals WHERE game_id = %d AND to_user_id = '%s' AND consumed = FALSE ORDER BY id ASC LIMIT 20"
+        % (game_id, user_id.replace("'", "''"))
+    )
+    sig_rows = cur.fetchall()
+    if not sig_rows:
+        return []
+    sig_ids = ','.join(str(r[0]) for r in sig_rows)
+    cur.execute("UPDATE webrtc_signals SET consumed = TRUE WHERE id IN (%s)" % sig_ids)
+    conn.commit()
+    return [{'from': r[1], 'type': r[2], 'data': r[3]} for r in sig_rows]
+
+
+def send_signal(cur, conn, game_id, from_user, to_user, signal_type, signal_data):
+    """Сигнал сопернику через ретранслятор шлюза; крупные сигналы и сигналы без шлюза пишутся в webrtc_signals"""
+    if signal_relay and signal_relay.is_live():
+        event = {'type': 'signal', 'game_id': game_id, 'id': signal_relay.next_id(), 'from': from_user,
+                 'to': to_user, 'signal_type': signal_type, 'data': signal_data}
+        if len(json.dumps(event).encode('utf-8')) <= signal_relay.MAX_NOTIFY_BYTES:
+            notify_game(cur, game_id, event)
+            conn.commit()
+            signal_relay.store(event)
+            return
+    cur.execute(
+        "INSERT INTO webrtc_signals (game_id, from_user_id, to_user_id, signal_type, signal_data) VALUES (%d, '%s', '%s', '%s', '%s')"
+        % (game_id, from_user.replace("'", "''"), to_user.replace("'", "''"),
+           signal_type.replace("'", "''"), signal_data.replace("'", "''"))
+    )
+    if signal_relay:
+        notify_game(cur, game_id, {'type': 'signal_stored', 'to': to_user})
+    conn.commit()
+
+
+def finish_on_time(cur, game_id, loser_color, white_uid, black_uid, move_number):
+    """Засчитывает поражение по времени стороне loser_color, если партия ещё идёт; возвращает событие"""
+    winner = white_uid if loser_color == 'black' else black_uid
+    cur.execute(
+        """UPDATE online_games SET status = 'finished', winner = '%s', end_reason = 'timeout',
+               %s_time = 0, %s_clock_ms = 0, updated_at = NOW()
+        WHERE id = %d AND status = 'playing'"""
+        % (winner.replace("'", "''"), loser_color, loser_color, game_id)
+    )
+    if not cur.rowcount:
+        return None
+    materialize_move_history(cur, game_id)
+    return notify_game(cur, game_id, {'type': 'state', 'move_number': move_number, 'status': 'finished',
+                                      'winner': winner, 'end_reason': 'timeout',
+                                      loser_color + '_time': 0, loser_color + '_clock_ms': 0})
+
+
+def notify_game(cur, game_id, payload):
+    """Событие партии для подписчиков шлюза (LISTEN game_events); уходит только вместе с COMMIT"""
+    payload = dict(payload, game_id=game_id)
+    cur.execute("SELECT pg_notify('game_events', '%s')" % json.dumps(payload).replace("'", "''"))
+    return payload
+
+
+def cache_apply(event):
+    """Write-through: после COMMIT событие сразу применяется к кэшу своего воркера, не дожидаясь NOTIFY"""
+    if game_cache and event:
+        game_cache.apply_event(event)
+
+
+def load_position(cur, game_id, board_state, move_number):
+    """Позиция перед ходом и хэши позиций с последнего взятия или хода пешкой.
+    Обычно читается FEN из board_state; для старых партий ходы проигрываются заново.
+    (None, None), если историю партии восстановить нельзя."""
+    if board_state and '/' in board_state:
+        pos = Position.from_fen(board_state)
+        first_ply = move_number - pos.halfmove
+        cur.execute(
+            "SELECT zobrist FROM online_game_moves WHERE game_id = %d AND ply >= %d ORDER BY ply"
+            % (game_id, max(first_ply, 1))
+        )
+        history = [r[0] for r in cur.fetchall()]
+        if first_ply <= 0:
+            history.insert(0, Position.initial().hash)
+        if None not in history and len(history) == min(pos.halfmove, move_number) + 1:
+            return pos, history
+
+    cur.execute("SELECT uci FROM online_game_moves WHERE game_id = %d ORDER BY ply" % game_id)
+    moves = [r[0] for r in cur.fetchall()]
+    if len(moves) != move_number:
+        return None, None
+    try:
+        return replay(moves)
+    except ValueError:
+        return None, None
+
 
 def get_client_ip(event):
     hdrs = event.get('headers') or {}
@@ -18,6 +333,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -46,11 +364,11 @@ def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
 def handler(event: dict, context) -> dict:
     """Ходы и состояние онлайн-партии: отправка хода, получение состояния, завершение игры"""
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
+        return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, If-None-Match', 'Access-Control-Max-Age': '86400'}, 'body': ''}
 
-    headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+    headers = {'Access-Control-Allow-Origin': '*', 'Access-Control-Expose-Headers': 'ETag', 'Content-Type': 'application/json'}
 
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_conn()
     cur = conn.cursor()
 
     client_ip = get_client_ip(event)
@@ -62,97 +380,165 @@ def handler(event: dict, context) -> dict:
 
     if event.get('httpMethod') == 'GET':
         qs = event.get('queryStringParameters') or {}
+
+        # Табло нескольких партий: ?game_ids=1,2,3 или ?featured=1&limit=50, дельта — since=1:30,2:12
+        if qs.get('game_ids') or qs.get('featured') == '1':
+            if qs.get('featured') == '1':
+                limit = qs.get('limit', '')
+                limit = min(int(limit), MAX_BATCH_GAMES) if limit.isdigit() and int(limit) > 0 else 20
+                cur.execute(
+                    """SELECT id FROM online_games
+                    WHERE status = 'playing' AND is_bot_game = FALSE
+                    ORDER BY (white_rating + black_rating) DESC LIMIT %d""" % limit
+                )
+                game_ids = [r[0] for r in cur.fetchall()]
+            else:
+                game_ids = []
+                for part in qs.get('game_ids', '').split(','):
+                    part = part.strip()
+                    if part.isdigit() and int(part) not in game_ids:
+                        game_ids.append(int(part))
+                if not game_ids or len(game_ids) > MAX_BATCH_GAMES:
+                    cur.close()
+                    conn.close()
+                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'game_ids: from 1 to %d ids' % MAX_BATCH_GAMES})}
+
+            since_map = {}
+            for part in qs.get('since', '').split(','):
+                gid_str, _, move_str = part.partition(':')
+                if gid_str.strip().isdigit() and move_str.strip().isdigit():
+                    since_map[int(gid_str)] = int(move_str)
+
+            games = load_games(cur, game_ids) if game_ids else {}
+            cur.close()
+            conn.close()
+
+            result = [compact_game(games[gid], since_map.get(gid)) for gid in game_ids if gid in games]
+            etag = '"%s"' % hashlib.md5('|'.join(g['etag'] for g in result).encode('utf-8')).hexdigest()[:16]
+            hdrs = event.get('headers') or {}
+            if hdrs.get('If-None-Match', hdrs.get('if-none-match', '')) == etag:
+                return {'statusCode': 304, 'headers': dict(headers, ETag=etag), 'body': ''}
+            return {'statusCode': 200, 'headers': dict(headers, ETag=etag), 'body': json.dumps({
+                'games': result,
+                'missing': [gid for gid in game_ids if gid not in games]
+            })}
+
         game_id = qs.get('game_id', '')
         if not game_id:
             cur.close()
             conn.close()
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'game_id required'})}
 
+        req_user_id = qs.get('user_id', '')
+
         # Быстрый режим — только сигналы, без состояния игры
         if qs.get('signals_only') == '1':
-            req_user_id = qs.get('user_id', '')
-            signals = []
-            if req_user_id:
-                safe_uid = req_user_id.replace("'", "''")
-                cur.execute(
-                    "SELECT id, from_user_id, signal_type, signal_data FROM webrtc_signals WHERE game_id = %d AND to_user_id = '%s' AND consumed = FALSE ORDER BY id ASC LIMIT 20"
-                    % (int(game_id), safe_uid)
-                )
-                sig_rows = cur.fetchall()
-                if sig_rows:
-                    sig_ids = ','.join(str(r[0]) for r in sig_rows)
-                    cur.execute("UPDATE webrtc_signals SET consumed = TRUE WHERE id IN (%s)" % sig_ids)
-                    conn.commit()
-                    signals = [{'from': r[1], 'type': r[2], 'data': r[3]} for r in sig_rows]
+            signals = pop_signals(cur, conn, int(game_id), req_user_id) if req_user_id else []
             cur.close()
             conn.close()
             return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'signals': signals})}
 
-        cur.execute(
-            """SELECT id, white_user_id, white_username, white_avatar, white_rating,
-                      black_user_id, black_username, black_avatar, black_rating,
-                      time_control, status, is_bot_game, current_player,
-                      white_time, black_time, move_history, board_state,
-                      winner, end_reason,
-                      EXTRACT(EPOCH FROM (NOW() - last_move_at))::int as seconds_since_move,
-                      move_number,
-                      rematch_offered_by, rematch_status, rematch_game_id,
-                      draw_offered_by
-            FROM online_games WHERE id = %d""" % int(game_id)
-        )
-        row = cur.fetchone()
-
-        if not row:
+        hdrs = event.get('headers') or {}
+        if_none_match = hdrs.get('If-None-Match', hdrs.get('if-none-match', ''))
+        since_move = qs.get('since_move', '')
+        conditional = bool(if_none_match) or since_move.isdigit()
+        gid = int(game_id)
+        signals = None
+
+        # В шлюзе партия читается из кэша; промах — одно полное чтение из БД
+        game = None
+        if game_cache:
+            game = game_cache.get(gid)
+            if game is None:
+                token = game_cache.begin_load()
+                game = load_game(cur, gid)
+                if game is None:
+                    cur.close()
+                    conn.close()
+                    return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'game not found'})}
+                game_cache.put(game, token)
+
+        if conditional and game is not None:
+            state = present_game(game)
+            etag = game_etag(state)
+            signals = pop_signals(cur, conn, gid, req_user_id) if req_user_id else []
             cur.close()
             conn.close()
-            return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'game not found'})}
-
-        seconds_since_move = row[19] or 0
-        status = row[10]
-        current_player = row[12]
-        white_time = row[13]
-        black_time = row[14]
-        move_number = row[20] or 0
-
-        if status == 'playing' and seconds_since_move > 0:
-            if current_player == 'white':
-                white_time = max(0, white_time - seconds_since_move)
-            else:
-                black_time = max(0, black_time - seconds_since_move)
 
-        signals = []
-        req_user_id = qs.get('user_id', '')
-        if req_user_id:
-            safe_uid = req_user_id.replace("'", "''")
-            cur.execute(
-                "SELECT id, from_user_id, signal_type, signal_data FROM webrtc_signals WHERE game_id = %d AND to_user_id = '%s' AND consumed = FALSE ORDER BY id ASC LIMIT 20"
-                % (int(game_id), safe_uid)
-            )
-            sig_rows = cur.fetchall()
-            if sig_rows:
-                sig_ids = ','.join(str(r[0]) for r in sig_rows)
-                cur.execute("UPDATE webrtc_signals SET consumed = TRUE WHERE id IN (%s)" % sig_ids)
-                conn.commit()
-                signals = [{'from': r[1], 'type': r[2], 'data': r[3]} for r in sig_rows]
+            if if_none_match == etag and not signals:
+                return {'statusCode': 304, 'headers': dict(headers, ETag=etag), 'body': ''}
+
+            since = int(since_move) if since_move.isdigit() else -1
+            if 0 <= since <= state['move_number']:
+                delta = {key: state[key] for key in STATE_FIELDS}
+                delta['board_state'] = state['board_state']
+                delta['since_move'] = since
+                delta['moves'] = game['moves'][since:]
+                return {'statusCode': 200, 'headers': dict(headers, ETag=etag), 'body': json.dumps({
+                    'game': delta,
+                    'delta': True,
+                    'signals': signals
+                })}
+            return {'statusCode': 200, 'headers': dict(headers, ETag=etag), 'body': json.dumps({
+                'game': state,
+                'signals': signals
+            })}
+
+        # Условный опрос без кэша: сначала только короткие поля состояния, без move_history и board_state
+        if conditional:
+            cur.execute("SELECT %s FROM online_games WHERE id = %d" % (STATE_COLUMNS, gid))
+            st_row = cur.fetchone()
+            if not st_row:
+                cur.close()
+                conn.close()
+                return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'game not found'})}
+            state = game_state(st_row)
+            etag = game_etag(state)
+            signals = pop_signals(cur, conn, gid, req_user_id) if req_user_id else []
+
+            if if_none_match == etag and not signals:
+                cur.close()
+                conn.close()
+                return {'statusCode': 304, 'headers': dict(headers, ETag=etag), 'body': ''}
+
+            since = int(since_move) if since_move.isdigit() else -1
+            if 0 <= since <= state['move_number']:
+                cur.execute(
+                    """SELECT %s, board_state,
+                              COALESCE((SELECT string_agg(m.uci, ',' ORDER BY m.ply) FROM online_game_moves m
+                                        WHERE m.game_id = online_games.id AND m.ply > %d),
+                                       array_to_string((string_to_array(move_history, ','))[%d:], ','))
+                    FROM online_games WHERE id = %d""" % (STATE_COLUMNS, since, since + 1, gid)
+                )
+                d_row = cur.fetchone()
+                cur.close()
+                conn.close()
+                state = game_state(d_row)
+                state['board_state'] = d_row[16]
+                state['since_move'] = since
+                state['moves'] = d_row[17].split(',') if d_row[17] else []
+                return {'statusCode': 200, 'headers': dict(headers, ETag=game_etag(state)), 'body': json.dumps({
+                    'game': state,
+                    'delta': True,
+                    'signals': signals
+                })}
+
+        if game is None:
+            game = load_game(cur, gid)
+            if game is None:
+                cur.close()
+                conn.close()
+                return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'game not found'})}
+
+        if signals is None:
+            signals = pop_signals(cur, conn, gid, req_user_id) if req_user_id else []
 
         cur.close()
         conn.close()
 
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
-            'game': {
-                'id': row[0],
-                'white_user_id': row[1], 'white_username': row[2], 'white_avatar': row[3], 'white_rating': row[4],
-                'black_user_id': row[5], 'black_username': row[6], 'black_avatar': row[7], 'black_rating': row[8],
-                'time_control': row[9], 'status': status, 'is_bot_game': row[11],
-                'current_player': current_player,
-                'white_time': white_time, 'black_time': black_time,
-                'move_history': row[15], 'board_state': row[16],
-                'winner': row[17], 'end_reason': row[18],
-                'move_number': move_number,
-                'seconds_since_move': seconds_since_move,
-                'rematch_offered_by': row[21], 'rematch_status': row[22], 'rematch_game_id': row[23],
-                'draw_offered_by': row[24]
-            },
+        state = present_game(game)
+        return {'statusCode': 200, 'headers': dict(headers, ETag=game_etag(state)), 'body': json.dumps({
+            'game': state,
             'signals': signals
         })}
 
@@ -173,10 +559,10 @@ def handler(event: dict, context) -> dict:
 
     cur.execute(
         """SELECT id, white_user_id, black_user_id, current_player, status,
-                  white_time, black_time, move_history, is_bot_game, time_control,
+                  white_time, black_time, is_bot_game, time_control,
                   EXTRACT(EPOCH FROM (NOW() - last_move_at))::int as seconds_since_move,
-                  move_number
-        FROM online_games WHERE id = %d""" % int(game_id)
+                  move_number, board_state, %s
+        FROM online_games WHERE id = %d""" % (CLOCK_COLUMNS, int(game_id))
     )
     game = cur.fetchone()
 
@@ -185,7 +571,7 @@ def handler(event: dict, context) -> dict:
         conn.close()
         return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'game not found'})}
 
-    g_id, white_uid, black_uid, current_player, status, white_time, black_time, move_hist, is_bot, tc, secs_since, db_move_number = game
+    g_id, white_uid, black_uid, current_player, status, white_time, black_time, is_bot, tc, secs_since, db_move_number, db_board_state, white_ms, black_ms, ms_since = game
     db_move_number = db_move_number or 0
 
     if user_id != white_uid and user_id != black_uid:
@@ -204,12 +590,7 @@ def handler(event: dict, context) -> dict:
             cur.close(); conn.close()
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'text required'})}
         to_user = black_uid if user_id == white_uid else white_uid
-        import json as _json
-        cur.execute(
-            "INSERT INTO webrtc_signals (game_id, from_user_id, to_user_id, signal_type, signal_data) VALUES (%d, '%s', '%s', 'chat', '%s')"
-            % (g_id, esc(user_id), esc(to_user), esc(_json.dumps({'text': text})))
-        )
-        conn.commit()
+        send_signal(cur, conn, g_id, user_id, to_user, 'chat', json.dumps({'text': text}))
         cur.close(); conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'sent'})}
 
@@ -217,10 +598,26 @@ def handler(event: dict, context) -> dict:
         # Сбрасываем last_move_at только если сейчас ход соперника (не наш)
         # Это предотвращает срабатывание таймера бездействия у ожидающего
         if status == 'playing' and player_color != current_player:
-            cur.execute("UPDATE online_games SET last_move_at = NOW() WHERE id = %d" % g_id)
-            conn.commit()
+            # Потраченное ходящим время списывается с его часов до сброса last_move_at,
+            # иначе каждый reconnect возвращал бы ему полные часы
+            cur_white_ms, cur_black_ms = running_clocks(status, current_player, white_ms, black_ms, ms_since)
+            cur.execute(
+                """UPDATE online_games SET white_clock_ms = %d, black_clock_ms = %d, white_time = %d, black_time = %d,
+                       last_move_at = NOW(), deadline_at = %s
+                WHERE id = %d AND move_number = %d AND status = 'playing'"""
+                % (cur_white_ms, cur_black_ms, cur_white_ms // 1000, cur_black_ms // 1000,
+                   DEADLINE_SQL % (cur_white_ms if current_player == 'white' else cur_black_ms), g_id, db_move_number)
+            )
+            if cur.rowcount:
+                ev = notify_game(cur, g_id, {'type': 'state', 'move_number': db_move_number, 'clock_restarted': True,
+                                             'white_time': cur_white_ms // 1000, 'black_time': cur_black_ms // 1000,
+                                             'white_clock_ms': cur_white_ms, 'black_clock_ms': cur_black_ms})
+                conn.commit()
+                cache_apply(ev)
+                white_ms, black_ms = cur_white_ms, cur_black_ms
         cur.close(); conn.close()
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'ok'})}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+            'status': 'ok', 'white_clock_ms': white_ms, 'black_clock_ms': black_ms})}
 
 
     if action == 'signal':
@@ -231,11 +628,7 @@ def handler(event: dict, context) -> dict:
             conn.close()
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'signal_type and signal_data required'})}
         to_user = black_uid if user_id == white_uid else white_uid
-        cur.execute(
-            "INSERT INTO webrtc_signals (game_id, from_user_id, to_user_id, signal_type, signal_data) VALUES (%d, '%s', '%s', '%s', '%s')"
-            % (g_id, esc(user_id), esc(to_user), esc(signal_type), esc(signal_data))
-        )
-        conn.commit()
+        send_signal(cur, conn, g_id, user_id, to_user, str(signal_type), str(signal_data))
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'signal_sent'})}
@@ -245,7 +638,9 @@ def handler(event: dict, context) -> dict:
             "UPDATE online_games SET rematch_offered_by = '%s', rematch_status = 'pending', rematch_offered_at = NOW(), updated_at = NOW() WHERE id = %d"
             % (esc(user_id), g_id)
         )
+        ev = notify_game(cur, g_id, {'type': 'state', 'move_number': db_move_number, 'rematch_offered_by': user_id, 'rematch_status': 'pending'})
         conn.commit()
+        cache_apply(ev)
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'rematch_offered'})}
@@ -255,7 +650,9 @@ def handler(event: dict, context) -> dict:
         cur.execute(
             "UPDATE online_games SET rematch_status = '%s', updated_at = NOW() WHERE id = %d" % (new_rs, g_id)
         )
+        ev = notify_game(cur, g_id, {'type': 'state', 'move_number': db_move_number, 'rematch_status': new_rs})
         conn.commit()
+        cache_apply(ev)
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'rematch_' + new_rs})}
@@ -287,11 +684,11 @@ def handler(event: dict, context) -> dict:
         cur.execute(
             """INSERT INTO online_games (white_user_id, white_username, white_avatar, white_rating,
                 black_user_id, black_username, black_avatar, black_rating,
-                time_control, opponent_type, is_bot_game, white_time, black_time)
-            VALUES ('%s', '%s', '%s', %d, '%s', '%s', '%s', %d, '%s', '%s', FALSE, %d, %d) RETURNING id"""
+                time_control, opponent_type, is_bot_game, white_time, black_time, white_clock_ms, black_clock_ms)
+            VALUES ('%s', '%s', '%s', %d, '%s', '%s', '%s', %d, '%s', '%s', FALSE, %d, %d, %d, %d) RETURNING id"""
             % (esc(ob_uid), esc(ob_name), esc(ob_avatar), ob_rating,
                esc(ow_uid), esc(ow_name), esc(ow_avatar), ow_rating,
-               esc(otc), esc(oop), init_time, init_time)
+               esc(otc), esc(oop), init_time, init_time, init_time * 1000, init_time * 1000)
         )
         new_game_id = cur.fetchone()[0]
 
@@ -299,7 +696,9 @@ def handler(event: dict, context) -> dict:
             "UPDATE online_games SET rematch_status = 'accepted', rematch_game_id = %d, updated_at = NOW() WHERE id = %d"
             % (new_game_id, g_id)
         )
+        ev = notify_game(cur, g_id, {'type': 'state', 'move_number': db_move_number, 'rematch_status': 'accepted', 'rematch_game_id': new_game_id})
         conn.commit()
+        cache_apply(ev)
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
@@ -314,7 +713,11 @@ def handler(event: dict, context) -> dict:
             "UPDATE online_games SET draw_offered_by = '%s', updated_at = NOW() WHERE id = %d AND status = 'playing'"
             % (user_id.replace("'", "''"), g_id)
         )
+        ev = None
+        if cur.rowcount:
+            ev = notify_game(cur, g_id, {'type': 'state', 'move_number': db_move_number, 'draw_offered_by': user_id})
         conn.commit()
+        cache_apply(ev)
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'draw_offered'})}
@@ -323,7 +726,9 @@ def handler(event: dict, context) -> dict:
         cur.execute(
             "UPDATE online_games SET draw_offered_by = NULL, updated_at = NOW() WHERE id = %d" % g_id
         )
+        ev = notify_game(cur, g_id, {'type': 'state', 'move_number': db_move_number, 'draw_offered_by': None})
         conn.commit()
+        cache_apply(ev)
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'draw_declined'})}
@@ -334,7 +739,10 @@ def handler(event: dict, context) -> dict:
             "UPDATE online_games SET status = 'finished', winner = '%s', end_reason = 'resign', updated_at = NOW() WHERE id = %d"
             % (winner.replace("'", "''"), g_id)
         )
+        materialize_move_history(cur, g_id)
+        ev = notify_game(cur, g_id, {'type': 'state', 'move_number': db_move_number, 'status': 'finished', 'winner': winner, 'end_reason': 'resign'})
         conn.commit()
+        cache_apply(ev)
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'finished', 'winner': winner, 'end_reason': 'resign'})}
@@ -343,22 +751,40 @@ def handler(event: dict, context) -> dict:
         cur.execute(
             "UPDATE online_games SET status = 'finished', end_reason = 'draw', draw_offered_by = NULL, updated_at = NOW() WHERE id = %d" % g_id
         )
+        materialize_move_history(cur, g_id)
+        ev = notify_game(cur, g_id, {'type': 'state', 'move_number': db_move_number, 'status': 'finished', 'winner': None, 'end_reason': 'draw', 'draw_offered_by': None})
         conn.commit()
+        cache_apply(ev)
         cur.close()
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'finished', 'end_reason': 'draw'})}
 
     if action == 'timeout':
-        loser_color = body.get('loser_color', '')
-        winner = white_uid if loser_color == 'black' else black_uid
-        cur.execute(
-            "UPDATE online_games SET status = 'finished', winner = '%s', end_reason = 'timeout', updated_at = NOW() WHERE id = %d"
-            % (winner.replace("'", "''"), g_id)
-        )
+        # Флажок проверяет сервер: проиграть по времени может только сторона, чей сейчас ход
+        if status != 'playing':
+            cur.close()
+            conn.close()
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': status})}
+        cur_white_ms, cur_black_ms = running_clocks(status, current_player, white_ms, black_ms, ms_since)
+        remaining_ms = cur_white_ms if current_player == 'white' else cur_black_ms
+        inactive = (ms_since or 0) >= MOVE_INACTIVITY_MS - INACTIVITY_GRACE_MS
+        if remaining_ms > TIMEOUT_GRACE_MS and not inactive:
+            cur.close()
+            conn.close()
+            return {'statusCode': 409, 'headers': headers, 'body': json.dumps({
+                'error': 'clock not expired',
+                'current_player': current_player,
+                'white_clock_ms': cur_white_ms,
+                'black_clock_ms': cur_black_ms
+            })}
+        ev = finish_on_time(cur, g_id, current_player, white_uid, black_uid, db_move_number)
         conn.commit()
+        cache_apply(ev)
         cur.close()
         conn.close()
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'finished', 'winner': winner, 'end_reason': 'timeout'})}
+        if ev is None:
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'finished'})}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'status': 'finished', 'winner': ev['winner'], 'end_reason': 'timeout'})}
 
     if status != 'playing':
         cur.close()
@@ -381,11 +807,43 @@ def handler(event: dict, context) -> dict:
         conn.close()
         return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'move required'})}
 
+    if len(move) > 10:
+        cur.close()
+        conn.close()
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'invalid move'})}
+
     if client_move_number >= 0 and client_move_number != db_move_number:
         cur.close()
         conn.close()
         return {'statusCode': 409, 'headers': headers, 'body': json.dumps({'error': 'move_number mismatch', 'expected': db_move_number, 'got': client_move_number})}
 
+    # Легальность хода и итог партии определяет сервер. В партиях с ботом ходы бота
+    # на сервер не приходят, поэтому там по-прежнему принимается состояние от клиента.
+    # game_status и winner_id из тела запроса в партиях двух игроков не используются никогда.
+    zobrist = None
+    if not is_bot:
+        position, history = load_position(cur, g_id, db_board_state, db_move_number)
+        if position is not None:
+            chess_move = position.parse_move(move)
+            if chess_move is None:
+                cur.close()
+                conn.close()
+                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'illegal move'})}
+            position = position.make(chess_move)
+            if position.halfmove == 0:
+                history = []
+            history.append(position.hash)
+            result = position.outcome(history)
+            board_state = position.fen()
+            zobrist = position.hash
+            game_status = result or 'playing'
+            winner_id = user_id if result == 'checkmate' else ''
+        else:
+            # Историю партии восстановить нельзя: ход принимаем, чтобы партия не встала, но итог
+            # от клиента не берём — закончить её можно сдачей, ничьей или по времени
+            game_status = 'playing'
+            winner_id = ''
+
     increment = 0
     if '+' in tc:
         parts = tc.split('+')
@@ -397,57 +855,95 @@ def handler(event: dict, context) -> dict:
     elif tc == 'classic':
         increment = 10
 
-    elapsed = secs_since if secs_since and secs_since > 0 else 0
+    elapsed_ms = ms_since if ms_since and ms_since > 0 else 0
+    mover_ms = (white_ms if current_player == 'white' else black_ms) - elapsed_ms
 
+    if mover_ms <= 0 or elapsed_ms > MOVE_INACTIVITY_MS + INACTIVITY_GRACE_MS:
+        ev = finish_on_time(cur, g_id, current_player, white_uid, black_uid, db_move_number)
+        conn.commit()
+        cache_apply(ev)
+        cur.close()
+        conn.close()
+        return {'statusCode': 409, 'headers': headers, 'body': json.dumps({
+            'error': 'time is up', 'status': 'finished', 'winner': ev['winner'] if ev else None, 'end_reason': 'timeout'
+        })}
+
+    mover_ms += increment * 1000
     if current_player == 'white':
-        white_time = max(0, white_time - elapsed + increment)
-        new_white_time = white_time
-        new_black_time = black_time
+        new_white_ms, new_black_ms = mover_ms, black_ms
     else:
-        black_time = max(0, black_time - elapsed + increment)
-        new_white_time = white_time
-        new_black_time = black_time
+        new_white_ms, new_black_ms = white_ms, mover_ms
+    new_white_time = new_white_ms // 1000
+    new_black_time = new_black_ms // 1000
 
-    new_move_hist = (move_hist + ',' + move) if move_hist else move
     next_player = 'black' if current_player == 'white' else 'white'
     new_move_number = db_move_number + 1
 
     new_status = 'playing'
-    winner_val = 'NULL'
-    end_reason_val = 'NULL'
+    new_winner = None
+    new_end_reason = None
 
-    if game_status in ('checkmate', 'stalemate', 'finished'):
+    if game_status in ('checkmate', 'stalemate', 'repetition', 'fifty_moves', 'finished'):
         new_status = 'finished'
         if game_status == 'checkmate' and winner_id:
-            winner_val = "'%s'" % winner_id.replace("'", "''")
-            end_reason_val = "'checkmate'"
+            new_winner = winner_id
+            new_end_reason = 'checkmate'
         elif game_status == 'stalemate':
-            end_reason_val = "'stalemate'"
+            new_end_reason = 'stalemate'
         else:
-            end_reason_val = "'%s'" % game_status.replace("'", "''")
+            new_end_reason = game_status
+
+    winner_val = "'%s'" % new_winner.replace("'", "''") if new_winner else 'NULL'
+    end_reason_val = "'%s'" % new_end_reason.replace("'", "''") if new_end_reason else 'NULL'
 
     cur.execute(
         """UPDATE online_games SET
             current_player = '%s',
             white_time = %d,
             black_time = %d,
-            move_history = '%s',
+            white_clock_ms = %d,
+            black_clock_ms = %d,
             board_state = '%s',
             status = '%s',
             winner = %s,
             end_reason = %s,
             move_number = %d,
             last_move_at = NOW(),
+            deadline_at = %s,
             updated_at = NOW()
         WHERE id = %d AND move_number = %d"""
-        % (next_player, new_white_time, new_black_time,
-           new_move_hist.replace("'", "''"),
+        % (next_player, new_white_time, new_black_time, new_white_ms, new_black_ms,
            board_state.replace("'", "''") if board_state else 'initial',
-           new_status, winner_val, end_reason_val, new_move_number, g_id, db_move_number)
+           new_status, winner_val, end_reason_val, new_move_number,
+           DEADLINE_SQL % (new_black_ms if next_player == 'black' else new_white_ms), g_id, db_move_number)
     )
 
     rows_updated = cur.rowcount
+    ev = None
+    if rows_updated:
+        # Одна короткая вставка на ход вместо перезаписи всей move_history
+        cur.execute(
+            "INSERT INTO online_game_moves (game_id, ply, uci, clock_ms, zobrist) VALUES (%d, %d, '%s', %d, %s)"
+            % (g_id, new_move_number, esc(move), mover_ms, zobrist if zobrist is not None else 'NULL')
+        )
+        if new_status == 'finished':
+            materialize_move_history(cur, g_id)
+        ev = notify_game(cur, g_id, {
+            'type': 'move',
+            'move': move,
+            'move_number': new_move_number,
+            'current_player': next_player,
+            'board_state': board_state or 'initial',
+            'white_time': new_white_time,
+            'black_time': new_black_time,
+            'white_clock_ms': new_white_ms,
+            'black_clock_ms': new_black_ms,
+            'status': new_status,
+            'winner': new_winner,
+            'end_reason': new_end_reason
+        })
     conn.commit()
+    cache_apply(ev)
     cur.close()
     conn.close()
 
@@ -459,5 +955,7 @@ def handler(event: dict, context) -> dict:
         'current_player': next_player,
         'move_number': new_move_number,
         'white_time': new_white_time,
-        'black_time': new_black_time
+        'black_time': new_black_time,
+        'white_clock_ms': new_white_ms,
+        'black_clock_ms': new_black_ms
     })}
\ No newline at end of file
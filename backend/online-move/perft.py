@@ -0,0 +1,65 @@
+"""
+Perft-проверка и замер скорости chess_core.
+Запуск: python perft.py [глубина]. Количество узлов сверяется с эталонными значениями,
+затем печатается скорость генерации и время проверки одного хода в online-move.
+"""
+import sys
+import time
+
+from chess_core import Position, perft, replay
+
+# (FEN, {глубина: узлов}) — стандартные позиции с chessprogramming.org
+SUITE = [
+    ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', {1: 20, 2: 400, 3: 8902, 4: 197281}),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', {1: 48, 2: 2039, 3: 97862}),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', {1: 14, 2: 191, 3: 2812, 4: 43238}),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', {1: 6, 2: 264, 3: 9467}),
+    ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', {1: 44, 2: 1486, 3: 62379}),
+    ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10', {1: 46, 2: 2079, 3: 89890}),
+]
+
+# Партия для замера полного цикла хода: разбор, проверка легальности, итог позиции, FEN
+GAME = ['e2-e4', 'e7-e5', 'g1-f3', 'b8-c6', 'f1-b5', 'a7-a6', 'b5-a4', 'g8-f6', 'e1-g1', 'f8-e7',
+        'f1-e1', 'b7-b5', 'a4-b3', 'd7-d6', 'c2-c3', 'e8-g8', 'h2-h3', 'c6-b8', 'd2-d4', 'b8-d7']
+
+
+def run_suite(max_depth):
+    total_nodes, total_time = 0, 0.0
+    for fen, expected in SUITE:
+        pos = Position.from_fen(fen)
+        for depth, nodes in sorted(expected.items()):
+            if depth > max_depth:
+                continue
+            started = time.perf_counter()
+            got = perft(pos, depth)
+            elapsed = time.perf_counter() - started
+            total_nodes += got
+            total_time += elapsed
+            status = 'ok' if got == nodes else 'FAIL (expected %d)' % nodes
+            print('%-72s d%d %9d %7.3fs %s' % (fen[:72], depth, got, elapsed, status))
+            if got != nodes:
+                return False
+    print('perft: %d nodes, %.0f nodes/s' % (total_nodes, total_nodes / total_time if total_time else 0))
+    return True
+
+
+def bench_move_validation(rounds=200):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        pos, history = replay([])
+        for text in GAME:
+            move = pos.parse_move(text)
+            pos = pos.make(move)
+            history = [] if pos.halfmove == 0 else history
+            history.append(pos.hash)
+            pos.outcome(history)
+            pos.fen()
+    per_move = (time.perf_counter() - started) / (rounds * len(GAME))
+    print('move validation: %.3f ms per move' % (per_move * 1000))
+
+
+if __name__ == '__main__':
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    ok = run_suite(depth)
+    bench_move_validation()
+    sys.exit(0 if ok else 1)
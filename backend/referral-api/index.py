@@ -7,9 +7,16 @@ from email.utils import formataddr, formatdate, make_msgid
 import psycopg2
 import psycopg2.extras
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def send_partner_email(to_email: str, accepted_at_str: str):
@@ -7,6 +7,11 @@ import os
 import psycopg2
 from engine import simulate_variant, build_recommendation
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
@@ -20,6 +25,8 @@ MAX_VARIANTS = 3
 
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 
@@ -3,6 +3,11 @@ import os
 import psycopg2
 from datetime import datetime, timedelta
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 HEARTBEAT_TIMEOUT_SEC = 90
 
@@ -13,6 +18,8 @@ PLANS = {
 }
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def handler(event: dict, context) -> dict:
@@ -5,6 +5,29 @@ import string
 from datetime import datetime
 import psycopg2
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import rate_limiter
+except ImportError:
+    rate_limiter = None
+
+# Модуль geo-detect; в шлюзе copy_functions.sh кладёт его рядом. Без него (функция развёрнута отдельно)
+# город и регион меняет только geo-detect, а корзины распределения выравнивает задача rating-histogram
+try:
+    import player_location
+except ImportError:
+    player_location = None
+
+
+def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
+    return psycopg2.connect(os.environ['DATABASE_URL'])
+
 
 def get_client_ip(event):
     hdrs = event.get('headers') or {}
@@ -20,6 +43,9 @@ def get_client_ip(event):
 
 
 def check_rate_limit(cur, conn, ip, endpoint, max_requests, window_seconds):
+    # В шлюзе лимиты считаются в памяти (deploy/backend/rate_limiter.py), без записи в rate_limits
+    if rate_limiter:
+        return rate_limiter.is_limited(endpoint, ip, max_requests, window_seconds)
     try:
         cur.execute(
             "SELECT id, request_count FROM rate_limits WHERE ip_address = '%s' AND endpoint = '%s' AND window_start > NOW() - INTERVAL '%d seconds' LIMIT 1"
@@ -69,8 +95,7 @@ def handler(event, context):
     if event.get('httpMethod') != 'POST':
         return {'statusCode': 405, 'headers': headers, 'body': json.dumps({'error': 'Method not allowed'})}
 
-    dsn = os.environ['DATABASE_URL']
-    conn = psycopg2.connect(dsn)
+    conn = get_conn()
     cur = conn.cursor()
 
     client_ip = get_client_ip(event)
@@ -85,6 +110,8 @@ def handler(event, context):
     code = body.get('code', '').strip()
     name = body.get('name', '').strip()
     city = body.get('city', '').strip()
+    # Регион только из известных и совпадающий с городом: его читают таблицы рейтинга
+    region = player_location.region_for(cur, city, body.get('region', '').strip()) if player_location else ''
     mode = body.get('mode', 'register')
     device_token = body.get('device_token', '').strip()
 
@@ -124,7 +151,7 @@ def handler(event, context):
     user_id = 'u_' + email.replace("'", "''")
 
     cur.execute(
-        "SELECT id, username, rating, city, games_played, wins, losses, draws, user_code FROM {schema}.users WHERE id = '{uid}'".format(
+        "SELECT id, username, rating, city, games_played, wins, losses, draws, user_code, region FROM {schema}.users WHERE id = '{uid}'".format(
             schema=schema, uid=user_id.replace("'", "''")
         )
     )
@@ -164,6 +191,7 @@ def handler(event, context):
             'losses': existing[6],
             'draws': existing[7],
             'user_code': existing[8] or '',
+            'region': existing[9] or '',
             'is_new': False
         }
     elif existing:
@@ -173,12 +201,8 @@ def handler(event, context):
                     schema=schema, name=name.replace("'", "''"), uid=user_id.replace("'", "''")
                 )
             )
-            if city:
-                cur.execute(
-                    "UPDATE {schema}.users SET city = '{city}' WHERE id = '{uid}'".format(
-                        schema=schema, city=city.replace("'", "''"), uid=user_id.replace("'", "''")
-                    )
-                )
+        # Смена города переносит игрока между таблицами рейтинга и корзинами распределения
+        moved = player_location.relocate(cur, user_id, city=city, region=region) if name and city and player_location else None
         if device_token:
             cur.execute(
                 "UPDATE {schema}.users SET active_device_token = '{dt}', session_expires_at = NOW() + INTERVAL '30 days' WHERE id = '{uid}'".format(
@@ -191,12 +215,13 @@ def handler(event, context):
             'id': existing[0],
             'username': name if name else existing[1],
             'rating': existing[2],
-            'city': city if city else existing[3],
+            'city': moved[0] if moved else existing[3],
             'games_played': existing[4],
             'wins': existing[5],
             'losses': existing[6],
             'draws': existing[7],
             'user_code': existing[8] or '',
+            'region': (moved[1] if moved else existing[9]) or '',
             'is_new': False
         }
     else:
@@ -214,16 +239,20 @@ def handler(event, context):
 
         dt_val = device_token.replace("'", "''")[:64] if device_token else ''
         cur.execute(
-            "INSERT INTO {schema}.users (id, username, email, city, rating, games_played, wins, losses, draws, user_code, active_device_token, session_expires_at) VALUES ('{uid}', '{name}', '{email}', '{city}', 500, 0, 0, 0, 0, '{code}', '{dt}', NOW() + INTERVAL '30 days')".format(
+            "INSERT INTO {schema}.users (id, username, email, city, region, rating, games_played, wins, losses, draws, user_code, active_device_token, session_expires_at) VALUES ('{uid}', '{name}', '{email}', '{city}', {region}, 500, 0, 0, 0, 0, '{code}', '{dt}', NOW() + INTERVAL '30 days')".format(
                 schema=schema,
                 uid=user_id.replace("'", "''"),
                 name=name.replace("'", "''"),
                 email=email.replace("'", "''"),
                 city=city.replace("'", "''"),
+                region="'%s'" % region.replace("'", "''") if region else 'NULL',
                 code=new_code.replace("'", "''"),
                 dt=dt_val
             )
         )
+        # Новый игрок сразу учитывается в распределении рейтинга и таблице рейтинга шлюза
+        if player_location:
+            player_location.add_player(cur, user_id, name, city, region, 500)
         conn.commit()
 
         user_data = {
@@ -231,6 +260,7 @@ def handler(event, context):
             'username': name,
             'rating': 500,
             'city': city,
+            'region': region,
             'games_played': 0,
             'wins': 0,
             'losses': 0,
@@ -6,6 +6,11 @@ from datetime import timezone
 from email.utils import format_datetime
 from datetime import datetime
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 SITE_URL = 'https://podelam.su'
 SITE_TITLE = 'ПоДелам — найди своё дело'
@@ -20,6 +25,8 @@ CORS = {
 
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 
@@ -6,8 +6,19 @@ import urllib.request
 import urllib.error
 import base64
 
+try:
+    from db_pool import get_connection as get_pooled_connection
+except ImportError:
+    get_pooled_connection = None
+
+try:
+    import scheduler
+except ImportError:
+    scheduler = None
+
 SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
 YOOKASSA_API = 'https://api.yookassa.ru/v3/payments'
+RECONCILE_BATCH = 50
 
 CORS = {
     'Access-Control-Allow-Origin': '*',
@@ -17,6 +28,8 @@ CORS = {
 }
 
 def get_conn():
+    if get_pooled_connection:
+        return get_pooled_connection()
     return psycopg2.connect(os.environ['DATABASE_URL'])
 
 def yookassa_request(method, url, data=None):
@@ -251,29 +264,7 @@ def handle_status(event, body):
         user_id = row[4]
 
         if db_status == 'pending' and yookassa_id:
-            yk_resp = yookassa_request('GET', f'{YOOKASSA_API}/{yookassa_id}')
-            yk_status = yk_resp.get('status', '')
-
-            if yk_status == 'succeeded':
-                cur.execute(
-                    f"UPDATE \"{S}\".payments SET status = 'paid' WHERE id = %s AND status = 'pending'",
-                    (payment_id,)
-                )
-                if cur.rowcount > 0 and user_id:
-                    cur.execute(
-                        f'UPDATE "{S}".users SET balance = balance + %s WHERE id = %s',
-                        (amount, user_id)
-                    )
-                conn.commit()
-                db_status = 'paid'
-
-            elif yk_status == 'canceled':
-                cur.execute(
-                    f"UPDATE \"{S}\".payments SET status = 'failed' WHERE id = %s",
-                    (payment_id,)
-                )
-                conn.commit()
-                db_status = 'failed'
+            db_status = sync_payment(cur, conn, payment_id, yookassa_id, amount, user_id)
 
         return respond(200, {
             'payment_id': row[0],
@@ -282,3 +273,61 @@ def handle_status(event, body):
         })
     finally:
         conn.close()
+
+
+def sync_payment(cur, conn, payment_id, yookassa_id, amount, user_id):
+    """Запрашивает статус платежа в ЮКассе и применяет его; возвращает новый статус в БД"""
+    S = SCHEMA
+    yk_resp = yookassa_request('GET', f'{YOOKASSA_API}/{yookassa_id}')
+    yk_status = yk_resp.get('status', '')
+
+    if yk_status == 'succeeded':
+        cur.execute(
+            f"UPDATE \"{S}\".payments SET status = 'paid' WHERE id = %s AND status = 'pending'",
+            (payment_id,)
+        )
+        if cur.rowcount > 0 and user_id:
+            cur.execute(
+                f'UPDATE "{S}".users SET balance = balance + %s WHERE id = %s',
+                (amount, user_id)
+            )
+        conn.commit()
+        return 'paid'
+
+    if yk_status == 'canceled':
+        cur.execute(
+            f"UPDATE \"{S}\".payments SET status = 'failed' WHERE id = %s",
+            (payment_id,)
+        )
+        conn.commit()
+        return 'failed'
+
+    return 'pending'
+
+
+def reconcile_pending():
+    """Задача планировщика шлюза: сверяет с ЮКассой платежи, по которым не пришёл вебхук"""
+    conn = get_conn()
+    result = {'checked': 0, 'paid': 0, 'failed': 0}
+    try:
+        cur = conn.cursor()
+        S = SCHEMA
+        cur.execute(
+            f"""SELECT id, yookassa_id, amount, user_id FROM "{S}".payments
+                WHERE status = 'pending' AND yookassa_id IS NOT NULL
+                  AND created_at < NOW() - INTERVAL '10 minutes' AND created_at > NOW() - INTERVAL '3 days'
+                ORDER BY id LIMIT %s""",
+            (RECONCILE_BATCH,)
+        )
+        for payment_id, yookassa_id, amount, user_id in cur.fetchall():
+            status = sync_payment(cur, conn, payment_id, yookassa_id, amount, user_id)
+            result['checked'] += 1
+            if status in ('paid', 'failed'):
+                result[status] += 1
+        return result
+    finally:
+        conn.close()
+
+
+if scheduler and os.environ.get('YOOKASSA_SHOP_ID'):
+    scheduler.register('payment-reconcile', '*/15 * * * *', reconcile_pending, jitter=60)
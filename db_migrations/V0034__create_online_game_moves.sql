@@ -0,0 +1,17 @@
+CREATE TABLE IF NOT EXISTS online_game_moves (
+    game_id INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    uci VARCHAR(10) NOT NULL,
+    clock_ms INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (game_id, ply)
+);
+
+INSERT INTO online_game_moves (game_id, ply, uci)
+SELECT g.id, m.ply::int, m.uci
+FROM online_games g,
+     unnest(string_to_array(g.move_history, ',')) WITH ORDINALITY AS m(uci, ply)
+WHERE g.status = 'playing' AND g.move_history <> ''
+ON CONFLICT DO NOTHING;
+
+UPDATE online_games SET move_history = '' WHERE status = 'playing' AND move_history <> '';
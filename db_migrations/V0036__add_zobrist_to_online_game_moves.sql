@@ -0,0 +1 @@
+ALTER TABLE online_game_moves ADD COLUMN IF NOT EXISTS zobrist BIGINT;
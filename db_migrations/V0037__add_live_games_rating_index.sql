@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_online_games_live_rating ON online_games ((white_rating + black_rating) DESC) WHERE status = 'playing' AND is_bot_game = FALSE;
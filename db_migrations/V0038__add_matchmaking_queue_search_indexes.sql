@@ -0,0 +1,3 @@
+CREATE INDEX IF NOT EXISTS idx_matchmaking_queue_tc_city_rating ON matchmaking_queue (time_control, city, rating);
+CREATE INDEX IF NOT EXISTS idx_matchmaking_queue_tc_region_rating ON matchmaking_queue (time_control, region, rating);
+CREATE INDEX IF NOT EXISTS idx_matchmaking_queue_tc_heartbeat ON matchmaking_queue (time_control, last_heartbeat);
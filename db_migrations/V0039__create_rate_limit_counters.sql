@@ -0,0 +1,9 @@
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+    endpoint VARCHAR(100) NOT NULL,
+    ip_address VARCHAR(64) NOT NULL,
+    window_start BIGINT NOT NULL,
+    request_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (endpoint, ip_address, window_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_counters_window ON rate_limit_counters (window_start);
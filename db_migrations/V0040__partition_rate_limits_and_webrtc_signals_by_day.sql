@@ -0,0 +1,53 @@
+ALTER TABLE rate_limits RENAME TO rate_limits_old;
+ALTER TABLE rate_limits_old RENAME CONSTRAINT rate_limits_pkey TO rate_limits_old_pkey;
+ALTER SEQUENCE rate_limits_id_seq OWNED BY NONE;
+
+CREATE TABLE rate_limits (
+    id INTEGER NOT NULL DEFAULT nextval('rate_limits_id_seq'),
+    ip_address VARCHAR(64) NOT NULL,
+    endpoint VARCHAR(100) NOT NULL,
+    request_count INT NOT NULL DEFAULT 1,
+    window_start TIMESTAMP NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, window_start)
+) PARTITION BY RANGE (window_start);
+
+CREATE TABLE rate_limits_default PARTITION OF rate_limits DEFAULT;
+
+INSERT INTO rate_limits (id, ip_address, endpoint, request_count, window_start, created_at)
+SELECT id, ip_address, endpoint, request_count, window_start, created_at FROM rate_limits_old
+WHERE window_start > NOW() - INTERVAL '1 day';
+
+DROP TABLE rate_limits_old;
+ALTER SEQUENCE rate_limits_id_seq OWNED BY rate_limits.id;
+
+CREATE INDEX idx_rate_limits_ip_endpoint ON rate_limits (ip_address, endpoint);
+CREATE INDEX idx_rate_limits_window ON rate_limits (window_start);
+
+ALTER TABLE webrtc_signals RENAME TO webrtc_signals_old;
+ALTER TABLE webrtc_signals_old RENAME CONSTRAINT webrtc_signals_pkey TO webrtc_signals_old_pkey;
+ALTER SEQUENCE webrtc_signals_id_seq OWNED BY NONE;
+
+CREATE TABLE webrtc_signals (
+    id INTEGER NOT NULL DEFAULT nextval('webrtc_signals_id_seq'),
+    game_id INTEGER NOT NULL,
+    from_user_id VARCHAR(64) NOT NULL,
+    to_user_id VARCHAR(64) NOT NULL,
+    signal_type VARCHAR(20) NOT NULL,
+    signal_data TEXT NOT NULL,
+    consumed BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE webrtc_signals_default PARTITION OF webrtc_signals DEFAULT;
+
+INSERT INTO webrtc_signals (id, game_id, from_user_id, to_user_id, signal_type, signal_data, consumed, created_at)
+SELECT id, game_id, from_user_id, to_user_id, signal_type, signal_data, consumed, created_at FROM webrtc_signals_old
+WHERE consumed = FALSE AND created_at > NOW() - INTERVAL '1 hour';
+
+DROP TABLE webrtc_signals_old;
+ALTER SEQUENCE webrtc_signals_id_seq OWNED BY webrtc_signals.id;
+
+CREATE INDEX idx_webrtc_signals_game_to ON webrtc_signals (game_id, to_user_id, consumed);
+CREATE INDEX idx_webrtc_signals_created ON webrtc_signals (created_at);
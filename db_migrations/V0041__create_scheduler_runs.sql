@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS scheduler_runs (
+    id BIGSERIAL PRIMARY KEY,
+    job VARCHAR(100) NOT NULL,
+    scheduled_for TIMESTAMPTZ NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMPTZ,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    result TEXT,
+    worker VARCHAR(100),
+    UNIQUE (job, scheduled_for)
+);
+
+CREATE INDEX IF NOT EXISTS idx_scheduler_runs_started ON scheduler_runs (started_at);
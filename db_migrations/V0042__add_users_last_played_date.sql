@@ -0,0 +1,9 @@
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_played_date DATE;
+
+UPDATE users u SET last_played_date = h.last_played
+FROM (SELECT user_id, MAX(created_at)::date AS last_played FROM game_history GROUP BY user_id) h
+WHERE h.user_id = u.id;
+
+INSERT INTO rating_settings (key, value, description)
+SELECT 'decay_cursor', '', 'Незавершённое снижение рейтинга: с|по|последний обработанный id (служебное)'
+WHERE NOT EXISTS (SELECT 1 FROM rating_settings WHERE key = 'decay_cursor');
@@ -0,0 +1,19 @@
+ALTER TABLE users ADD COLUMN IF NOT EXISTS rating_deviation REAL NOT NULL DEFAULT 350;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS rating_volatility REAL NOT NULL DEFAULT 0.06;
+
+ALTER TABLE online_games ADD COLUMN IF NOT EXISTS rated BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE online_games ADD COLUMN IF NOT EXISTS white_rating_change INTEGER;
+ALTER TABLE online_games ADD COLUMN IF NOT EXISTS black_rating_change INTEGER;
+
+ALTER TABLE game_history ADD COLUMN IF NOT EXISTS online_game_id INTEGER;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_game_history_online_game_user ON game_history (online_game_id, user_id) WHERE online_game_id IS NOT NULL;
+
+INSERT INTO rating_settings (key, value, description)
+SELECT v.key, v.value, v.description FROM (VALUES
+    ('rating_system', 'elo', 'Система рейтинга: points (фиксированные баллы), elo или glicko2'),
+    ('elo_k', '32', 'Коэффициент K Эло'),
+    ('elo_k_provisional', '40', 'Коэффициент K Эло для первых 30 партий'),
+    ('glicko_tau', '0.5', 'Параметр tau Глико-2 (скорость изменения волатильности)'),
+    ('glicko_period_days', '1', 'Дней без игры на один рейтинговый период Глико-2 (рост RD)')
+) AS v(key, value, description)
+WHERE NOT EXISTS (SELECT 1 FROM rating_settings s WHERE s.key = v.key);
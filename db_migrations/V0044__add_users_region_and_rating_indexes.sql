@@ -0,0 +1,9 @@
+ALTER TABLE users ADD COLUMN IF NOT EXISTS region VARCHAR(200);
+
+UPDATE users u SET region = q.region
+FROM matchmaking_queue q
+WHERE q.user_id = u.id AND u.region IS NULL AND q.region <> '';
+
+CREATE INDEX IF NOT EXISTS idx_users_rating ON users (rating DESC);
+CREATE INDEX IF NOT EXISTS idx_users_city_rating ON users (city, rating DESC) WHERE city IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_users_region_rating ON users (region, rating DESC) WHERE region IS NOT NULL;
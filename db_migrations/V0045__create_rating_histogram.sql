@@ -0,0 +1,26 @@
+CREATE TABLE IF NOT EXISTS rating_histogram (
+    scope VARCHAR(10) NOT NULL,
+    name VARCHAR(200) NOT NULL DEFAULT '',
+    bucket INTEGER NOT NULL,
+    players INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, name, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS rating_histogram_snapshots (
+    id SERIAL PRIMARY KEY,
+    taken_on DATE NOT NULL,
+    scope VARCHAR(10) NOT NULL,
+    name VARCHAR(200) NOT NULL DEFAULT '',
+    bucket_width INTEGER NOT NULL,
+    buckets JSONB NOT NULL,
+    players INTEGER NOT NULL,
+    UNIQUE (scope, name, taken_on)
+);
+
+INSERT INTO rating_histogram (scope, name, bucket, players)
+SELECT 'country', '', rating / 50 * 50, COUNT(*) FROM users GROUP BY 3
+UNION ALL
+SELECT 'city', city, rating / 50 * 50, COUNT(*) FROM users WHERE city <> '' GROUP BY 2, 3
+UNION ALL
+SELECT 'region', region, rating / 50 * 50, COUNT(*) FROM users WHERE region <> '' GROUP BY 2, 3
+ON CONFLICT DO NOTHING;
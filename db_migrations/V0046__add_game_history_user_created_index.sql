@@ -0,0 +1,6 @@
+-- Страницы истории партий по курсору (created_at, id): WHERE user_id = ... AND (created_at, id) < (...)
+-- ORDER BY created_at DESC, id DESC читает ровно одну страницу индекса
+CREATE INDEX IF NOT EXISTS idx_game_history_user_created ON game_history (user_id, created_at DESC, id DESC);
+
+-- Покрывается новым индексом
+DROP INDEX IF EXISTS idx_game_history_user_id;
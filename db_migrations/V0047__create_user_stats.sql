@@ -0,0 +1,18 @@
+-- Сводная статистика игрока для профиля; ведёт finish-game, пересчитывает задача user-stats-rebuild.
+-- Строка игрока без статистики собирается из game_history при его следующей партии
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id VARCHAR(64) PRIMARY KEY REFERENCES users(id),
+    by_color JSONB NOT NULL DEFAULT '{}',
+    by_time_control JSONB NOT NULL DEFAULT '{}',
+    by_opponent JSONB NOT NULL DEFAULT '{}',
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    games INTEGER NOT NULL DEFAULT 0,
+    total_moves BIGINT NOT NULL DEFAULT 0,
+    timed_games INTEGER NOT NULL DEFAULT 0,
+    total_duration BIGINT NOT NULL DEFAULT 0,
+    rating_peak INTEGER,
+    rating_low INTEGER,
+    activity JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT NOW()
+);
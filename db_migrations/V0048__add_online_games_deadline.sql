@@ -0,0 +1,11 @@
+-- Срок хода стороны, чей ход: конец её времени или лимит бездействия 60 с, смотря что раньше.
+-- Пишет online-move при каждом ходе; новая партия получает 60 с по умолчанию (контроли не короче 1+0)
+ALTER TABLE online_games ADD COLUMN IF NOT EXISTS deadline_at TIMESTAMP DEFAULT (NOW() + INTERVAL '60 seconds');
+
+UPDATE online_games SET deadline_at = last_move_at + LEAST(
+    CASE WHEN current_player = 'white' THEN COALESCE(white_clock_ms, white_time * 1000)
+         ELSE COALESCE(black_clock_ms, black_time * 1000) END, 60000) * INTERVAL '1 millisecond'
+WHERE status = 'playing';
+
+CREATE INDEX IF NOT EXISTS idx_online_games_playing_deadline ON online_games (deadline_at)
+WHERE status = 'playing' AND is_bot_game = FALSE;
@@ -0,0 +1,312 @@
+-- Город → регион для таблиц рейтинга: те же пары, что cityRegions во фронтенде
+-- (src/components/chess/data/cities.ts). По ним geo-detect и verify-otp проверяют регион игрока
+CREATE TABLE IF NOT EXISTS city_regions (
+    city VARCHAR(200) PRIMARY KEY,
+    region VARCHAR(200) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_city_regions_region ON city_regions (region);
+
+INSERT INTO city_regions (city, region) VALUES
+    ('Абакан', 'Республика Хакасия'),
+    ('Альметьевск', 'Республика Татарстан'),
+    ('Анапа', 'Краснодарский край'),
+    ('Ангарск', 'Иркутская область'),
+    ('Арзамас', 'Нижегородская область'),
+    ('Армавир', 'Краснодарский край'),
+    ('Артём', 'Приморский край'),
+    ('Архангельск', 'Архангельская область'),
+    ('Асбест', 'Свердловская область'),
+    ('Астрахань', 'Астраханская область'),
+    ('Ачинск', 'Красноярский край'),
+    ('Балаково', 'Саратовская область'),
+    ('Барнаул', 'Алтайский край'),
+    ('Батайск', 'Ростовская область'),
+    ('Белгород', 'Белгородская область'),
+    ('Белово', 'Кемеровская область'),
+    ('Белорецк', 'Республика Башкортостан'),
+    ('Березники', 'Пермский край'),
+    ('Бийск', 'Алтайский край'),
+    ('Биробиджан', 'Еврейская автономная область'),
+    ('Благовещенск', 'Амурская область'),
+    ('Братск', 'Иркутская область'),
+    ('Брянск', 'Брянская область'),
+    ('Бугульма', 'Республика Татарстан'),
+    ('Буденновск', 'Ставропольский край'),
+    ('Великий Новгород', 'Новгородская область'),
+    ('Верхняя Пышма', 'Свердловская область'),
+    ('Видное', 'Московская область'),
+    ('Владивосток', 'Приморский край'),
+    ('Владикавказ', 'Республика Северная Осетия'),
+    ('Владимир', 'Владимирская область'),
+    ('Волгоград', 'Волгоградская область'),
+    ('Волжский', 'Волгоградская область'),
+    ('Вологда', 'Вологодская область'),
+    ('Волхов', 'Ленинградская область'),
+    ('Воронеж', 'Воронежская область'),
+    ('Воскресенск', 'Московская область'),
+    ('Воткинск', 'Удмуртская Республика'),
+    ('Всеволожск', 'Ленинградская область'),
+    ('Выборг', 'Ленинградская область'),
+    ('Выкса', 'Нижегородская область'),
+    ('Гатчина', 'Ленинградская область'),
+    ('Геленджик', 'Краснодарский край'),
+    ('Георгиевск', 'Ставропольский край'),
+    ('Глазов', 'Удмуртская Республика'),
+    ('Горно-Алтайск', 'Республика Алтай'),
+    ('Грозный', 'Чеченская Республика'),
+    ('Дербент', 'Республика Дагестан'),
+    ('Дзержинск', 'Нижегородская область'),
+    ('Димитровград', 'Ульяновская область'),
+    ('Дмитров', 'Московская область'),
+    ('Долгопрудный', 'Московская область'),
+    ('Домодедово', 'Московская область'),
+    ('Донецк', 'Ростовская область'),
+    ('Дубна', 'Московская область'),
+    ('Евпатория', 'Республика Крым'),
+    ('Егорьевск', 'Московская область'),
+    ('Ейск', 'Краснодарский край'),
+    ('Екатеринбург', 'Свердловская область'),
+    ('Елабуга', 'Республика Татарстан'),
+    ('Елец', 'Липецкая область'),
+    ('Ессентуки', 'Ставропольский край'),
+    ('Железногорск', 'Курская область'),
+    ('Железнодорожный', 'Московская область'),
+    ('Жуковский', 'Московская область'),
+    ('Заречный', 'Пензенская область'),
+    ('Звенигород', 'Московская область'),
+    ('Зеленогорск', 'Красноярский край'),
+    ('Зеленоград', 'Москва'),
+    ('Зеленодольск', 'Республика Татарстан'),
+    ('Зима', 'Иркутская область'),
+    ('Златоуст', 'Челябинская область'),
+    ('Иваново', 'Ивановская область'),
+    ('Ивантеевка', 'Московская область'),
+    ('Ижевск', 'Удмуртская Республика'),
+    ('Инта', 'Республика Коми'),
+    ('Иркутск', 'Иркутская область'),
+    ('Искитим', 'Новосибирская область'),
+    ('Ишим', 'Тюменская область'),
+    ('Йошкар-Ола', 'Республика Марий Эл'),
+    ('Казань', 'Республика Татарстан'),
+    ('Калининград', 'Калининградская область'),
+    ('Калуга', 'Калужская область'),
+    ('Каменск-Уральский', 'Свердловская область'),
+    ('Камышин', 'Волгоградская область'),
+    ('Канск', 'Красноярский край'),
+    ('Каспийск', 'Республика Дагестан'),
+    ('Кемерово', 'Кемеровская область'),
+    ('Керчь', 'Республика Крым'),
+    ('Кинешма', 'Ивановская область'),
+    ('Кириши', 'Ленинградская область'),
+    ('Киров', 'Кировская область'),
+    ('Кирово-Чепецк', 'Кировская область'),
+    ('Киселёвск', 'Кемеровская область'),
+    ('Кисловодск', 'Ставропольский край'),
+    ('Клин', 'Московская область'),
+    ('Клинцы', 'Брянская область'),
+    ('Ковров', 'Владимирская область'),
+    ('Когалым', 'Ханты-Мансийский АО'),
+    ('Коломна', 'Московская область'),
+    ('Комсомольск-на-Амуре', 'Хабаровский край'),
+    ('Конаково', 'Тверская область'),
+    ('Копейск', 'Челябинская область'),
+    ('Королёв', 'Московская область'),
+    ('Кострома', 'Костромская область'),
+    ('Котлас', 'Архангельская область'),
+    ('Красногорск', 'Московская область'),
+    ('Краснодар', 'Краснодарский край'),
+    ('Краснокамск', 'Пермский край'),
+    ('Красноярск', 'Красноярский край'),
+    ('Кстово', 'Нижегородская область'),
+    ('Кузнецк', 'Пензенская область'),
+    ('Курган', 'Курганская область'),
+    ('Курск', 'Курская область'),
+    ('Кызыл', 'Республика Тыва'),
+    ('Лабинск', 'Краснодарский край'),
+    ('Липецк', 'Липецкая область'),
+    ('Лобня', 'Московская область'),
+    ('Луга', 'Ленинградская область'),
+    ('Лысьва', 'Пермский край'),
+    ('Люберцы', 'Московская область'),
+    ('Магадан', 'Магаданская область'),
+    ('Магнитогорск', 'Челябинская область'),
+    ('Майкоп', 'Республика Адыгея'),
+    ('Махачкала', 'Республика Дагестан'),
+    ('Междуреченск', 'Кемеровская область'),
+    ('Миасс', 'Челябинская область'),
+    ('Минеральные Воды', 'Ставропольский край'),
+    ('Мичуринск', 'Тамбовская область'),
+    ('Можайск', 'Московская область'),
+    ('Москва', 'Москва'),
+    ('Мурманск', 'Мурманская область'),
+    ('Муром', 'Владимирская область'),
+    ('Мытищи', 'Московская область'),
+    ('Набережные Челны', 'Республика Татарстан'),
+    ('Надым', 'Ямало-Ненецкий АО'),
+    ('Назрань', 'Республика Ингушетия'),
+    ('Нальчик', 'Кабардино-Балкарская Республика'),
+    ('Наро-Фоминск', 'Московская область'),
+    ('Нарьян-Мар', 'Ненецкий АО'),
+    ('Находка', 'Приморский край'),
+    ('Невинномысск', 'Ставропольский край'),
+    ('Нерюнгри', 'Республика Саха (Якутия)'),
+    ('Нефтекамск', 'Республика Башкортостан'),
+    ('Нефтеюганск', 'Ханты-Мансийский АО'),
+    ('Нижневартовск', 'Ханты-Мансийский АО'),
+    ('Нижнекамск', 'Республика Татарстан'),
+    ('Нижний Новгород', 'Нижегородская область'),
+    ('Нижний Тагил', 'Свердловская область'),
+    ('Николаевск-на-Амуре', 'Хабаровский край'),
+    ('Новоалтайск', 'Алтайский край'),
+    ('Новодвинск', 'Архангельская область'),
+    ('Новокузнецк', 'Кемеровская область'),
+    ('Новокуйбышевск', 'Самарская область'),
+    ('Новомосковск', 'Тульская область'),
+    ('Новороссийск', 'Краснодарский край'),
+    ('Новосибирск', 'Новосибирская область'),
+    ('Новотроицк', 'Оренбургская область'),
+    ('Новоуральск', 'Свердловская область'),
+    ('Новочебоксарск', 'Чувашская Республика'),
+    ('Новочеркасск', 'Ростовская область'),
+    ('Новошахтинск', 'Ростовская область'),
+    ('Новый Уренгой', 'Ямало-Ненецкий АО'),
+    ('Ногинск', 'Московская область'),
+    ('Норильск', 'Красноярский край'),
+    ('Ноябрьск', 'Ямало-Ненецкий АО'),
+    ('Нягань', 'Ханты-Мансийский АО'),
+    ('Обнинск', 'Калужская область'),
+    ('Обь', 'Новосибирская область'),
+    ('Одинцово', 'Московская область'),
+    ('Озёрск', 'Челябинская область'),
+    ('Октябрьский', 'Республика Башкортостан'),
+    ('Омск', 'Омская область'),
+    ('Оренбург', 'Оренбургская область'),
+    ('Орехово-Зуево', 'Московская область'),
+    ('Орск', 'Оренбургская область'),
+    ('Орёл', 'Орловская область'),
+    ('Павлово', 'Нижегородская область'),
+    ('Павловский Посад', 'Московская область'),
+    ('Пенза', 'Пензенская область'),
+    ('Первоуральск', 'Свердловская область'),
+    ('Пермь', 'Пермский край'),
+    ('Петрозаводск', 'Республика Карелия'),
+    ('Петропавловск-Камчатский', 'Камчатский край'),
+    ('Печора', 'Республика Коми'),
+    ('Подольск', 'Московская область'),
+    ('Полевской', 'Свердловская область'),
+    ('Прокопьевск', 'Кемеровская область'),
+    ('Псков', 'Псковская область'),
+    ('Пушкино', 'Московская область'),
+    ('Пятигорск', 'Ставропольский край'),
+    ('Раменское', 'Московская область'),
+    ('Ревда', 'Свердловская область'),
+    ('Реутов', 'Московская область'),
+    ('Ржев', 'Тверская область'),
+    ('Россошь', 'Воронежская область'),
+    ('Ростов', 'Ярославская область'),
+    ('Ростов-на-Дону', 'Ростовская область'),
+    ('Рубцовск', 'Алтайский край'),
+    ('Рыбинск', 'Ярославская область'),
+    ('Рязань', 'Рязанская область'),
+    ('Салават', 'Республика Башкортостан'),
+    ('Самара', 'Самарская область'),
+    ('Санкт-Петербург', 'Санкт-Петербург'),
+    ('Саранск', 'Республика Мордовия'),
+    ('Сарапул', 'Удмуртская Республика'),
+    ('Саратов', 'Саратовская область'),
+    ('Саров', 'Нижегородская область'),
+    ('Севастополь', 'Севастополь'),
+    ('Северодвинск', 'Архангельская область'),
+    ('Североморск', 'Мурманская область'),
+    ('Североуральск', 'Свердловская область'),
+    ('Северск', 'Томская область'),
+    ('Сергиев Посад', 'Московская область'),
+    ('Серов', 'Свердловская область'),
+    ('Серпухов', 'Московская область'),
+    ('Сибай', 'Республика Башкортостан'),
+    ('Симферополь', 'Республика Крым'),
+    ('Смоленск', 'Смоленская область'),
+    ('Советск', 'Калининградская область'),
+    ('Советская Гавань', 'Хабаровский край'),
+    ('Сокол', 'Вологодская область'),
+    ('Соликамск', 'Пермский край'),
+    ('Солнечногорск', 'Московская область'),
+    ('Сосновый Бор', 'Ленинградская область'),
+    ('Сочи', 'Краснодарский край'),
+    ('Ставрополь', 'Ставропольский край'),
+    ('Старый Оскол', 'Белгородская область'),
+    ('Стерлитамак', 'Республика Башкортостан'),
+    ('Ступино', 'Московская область'),
+    ('Сургут', 'Ханты-Мансийский АО'),
+    ('Сухой Лог', 'Свердловская область'),
+    ('Сызрань', 'Самарская область'),
+    ('Сыктывкар', 'Республика Коми'),
+    ('Сысерть', 'Свердловская область'),
+    ('Таганрог', 'Ростовская область'),
+    ('Тайшет', 'Иркутская область'),
+    ('Тамбов', 'Тамбовская область'),
+    ('Тверь', 'Тверская область'),
+    ('Тихвин', 'Ленинградская область'),
+    ('Тихорецк', 'Краснодарский край'),
+    ('Тобольск', 'Тюменская область'),
+    ('Тольятти', 'Самарская область'),
+    ('Томск', 'Томская область'),
+    ('Торжок', 'Тверская область'),
+    ('Троицк', 'Московская область'),
+    ('Туапсе', 'Краснодарский край'),
+    ('Туймазы', 'Республика Башкортостан'),
+    ('Тула', 'Тульская область'),
+    ('Тулун', 'Иркутская область'),
+    ('Тутаев', 'Ярославская область'),
+    ('Тюмень', 'Тюменская область'),
+    ('Углич', 'Ярославская область'),
+    ('Узловая', 'Тульская область'),
+    ('Улан-Удэ', 'Республика Бурятия'),
+    ('Ульяновск', 'Ульяновская область'),
+    ('Урюпинск', 'Волгоградская область'),
+    ('Усинск', 'Республика Коми'),
+    ('Усолье-Сибирское', 'Иркутская область'),
+    ('Уссурийск', 'Приморский край'),
+    ('Усть-Илимск', 'Иркутская область'),
+    ('Усть-Кут', 'Иркутская область'),
+    ('Уфа', 'Республика Башкортостан'),
+    ('Ухта', 'Республика Коми'),
+    ('Учалы', 'Республика Башкортостан'),
+    ('Феодосия', 'Республика Крым'),
+    ('Фрязино', 'Московская область'),
+    ('Хабаровск', 'Хабаровский край'),
+    ('Ханты-Мансийск', 'Ханты-Мансийский АО'),
+    ('Хасавюрт', 'Республика Дагестан'),
+    ('Химки', 'Московская область'),
+    ('Холмск', 'Сахалинская область'),
+    ('Хотьково', 'Московская область'),
+    ('Чайковский', 'Пермский край'),
+    ('Чапаевск', 'Самарская область'),
+    ('Чебоксары', 'Чувашская Республика'),
+    ('Челябинск', 'Челябинская область'),
+    ('Черемхово', 'Иркутская область'),
+    ('Череповец', 'Вологодская область'),
+    ('Черкесск', 'Карачаево-Черкесская Республика'),
+    ('Черногорск', 'Республика Хакасия'),
+    ('Чехов', 'Московская область'),
+    ('Чистополь', 'Республика Татарстан'),
+    ('Чита', 'Забайкальский край'),
+    ('Шадринск', 'Курганская область'),
+    ('Шахты', 'Ростовская область'),
+    ('Шуя', 'Ивановская область'),
+    ('Щёлкино', 'Республика Крым'),
+    ('Щёлково', 'Московская область'),
+    ('Электрогорск', 'Московская область'),
+    ('Электросталь', 'Московская область'),
+    ('Электроугли', 'Московская область'),
+    ('Элиста', 'Республика Калмыкия'),
+    ('Энгельс', 'Саратовская область'),
+    ('Югорск', 'Ханты-Мансийский АО'),
+    ('Южно-Сахалинск', 'Сахалинская область'),
+    ('Юрга', 'Кемеровская область'),
+    ('Якутск', 'Республика Саха (Якутия)'),
+    ('Ялта', 'Республика Крым'),
+    ('Ялуторовск', 'Тюменская область'),
+    ('Ярославль', 'Ярославская область')
+ON CONFLICT (city) DO UPDATE SET region = EXCLUDED.region;
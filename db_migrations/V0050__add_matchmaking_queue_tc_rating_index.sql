@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_matchmaking_queue_tc_rating ON matchmaking_queue (time_control, rating);
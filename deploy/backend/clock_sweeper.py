@@ -0,0 +1,125 @@
+"""
+Фоновая проверка часов онлайн-партий.
+Раз в CLOCK_SWEEP_INTERVAL секунд одним запросом по частичному индексу deadline_at находит партии,
+где у стороны, чей ход, кончилось время или она не ходит дольше лимита бездействия (срок хода
+пишет online-move в deadline_at), и завершает их поражением по времени.
+Брошенные партии с ботом, где ходы на сервер не приходят, закрываются как abandoned без победителя.
+Партии людей сюда не попадают: у них всегда есть deadline_at, и их завершает поражение по времени.
+"""
+import os
+import threading
+
+import db_pool
+
+SWEEP_INTERVAL = float(os.environ.get('CLOCK_SWEEP_INTERVAL', '1'))
+SWEEP_BATCH = int(os.environ.get('CLOCK_SWEEP_BATCH', '500'))
+ABANDON_HOURS = int(os.environ.get('ABANDON_GAME_HOURS', '3'))
+
+# Ключ pg_try_advisory_xact_lock: из нескольких воркеров проверку выполняет один
+SWEEP_LOCK_KEY = 720001
+
+FLAGGED_SQL = """
+WITH flagged AS (
+    SELECT id FROM online_games
+    WHERE status = 'playing' AND is_bot_game = FALSE
+      AND deadline_at <= NOW()
+    ORDER BY deadline_at
+    LIMIT %d
+    FOR UPDATE SKIP LOCKED
+), finished AS (
+    UPDATE online_games g SET
+        status = 'finished',
+        end_reason = 'timeout',
+        winner = CASE WHEN g.current_player = 'white' THEN g.black_user_id ELSE g.white_user_id END,
+        white_time = CASE WHEN g.current_player = 'white' THEN 0 ELSE g.white_time END,
+        black_time = CASE WHEN g.current_player = 'black' THEN 0 ELSE g.black_time END,
+        white_clock_ms = CASE WHEN g.current_player = 'white' THEN 0 ELSE g.white_clock_ms END,
+        black_clock_ms = CASE WHEN g.current_player = 'black' THEN 0 ELSE g.black_clock_ms END,
+        move_history = COALESCE((SELECT string_agg(m.uci, ',' ORDER BY m.ply) FROM online_game_moves m WHERE m.game_id = g.id), g.move_history),
+        updated_at = NOW()
+    FROM flagged f
+    WHERE g.id = f.id
+    RETURNING g.id, g.move_number, g.winner, g.white_time, g.black_time, g.white_clock_ms, g.black_clock_ms
+)
+SELECT id, pg_notify('game_events', json_build_object(
+    'type', 'state', 'game_id', id, 'move_number', move_number, 'status', 'finished', 'winner', winner, 'end_reason', 'timeout',
+    'white_time', white_time, 'black_time', black_time,
+    'white_clock_ms', white_clock_ms, 'black_clock_ms', black_clock_ms)::text)
+FROM finished
+"""
+
+ABANDONED_SQL = """
+WITH stale AS (
+    SELECT id FROM online_games
+    WHERE status = 'playing' AND is_bot_game = TRUE
+      AND last_move_at < NOW() - INTERVAL '%d hours'
+    ORDER BY last_move_at
+    LIMIT %d
+    FOR UPDATE SKIP LOCKED
+), finished AS (
+    UPDATE online_games g SET
+        status = 'finished',
+        end_reason = 'abandoned',
+        move_history = COALESCE((SELECT string_agg(m.uci, ',' ORDER BY m.ply) FROM online_game_moves m WHERE m.game_id = g.id), g.move_history),
+        updated_at = NOW()
+    FROM stale s
+    WHERE g.id = s.id
+    RETURNING g.id, g.move_number
+)
+SELECT id, pg_notify('game_events', json_build_object(
+    'type', 'state', 'game_id', id, 'move_number', move_number, 'status', 'finished', 'winner', NULL, 'end_reason', 'abandoned')::text)
+FROM finished
+"""
+
+
+class ClockSweeper:
+    def __init__(self, interval=SWEEP_INTERVAL, batch=SWEEP_BATCH):
+        self.interval = interval
+        self.batch = batch
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'runs': 0, 'skipped': 0, 'flagged': 0, 'abandoned': 0, 'errors': 0, 'last_error': None}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='clock-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def sweep_once(self):
+        conn = db_pool.get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_xact_lock(%d)" % SWEEP_LOCK_KEY)
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                self.stats['skipped'] += 1
+                return 0, 0
+            cur.execute(FLAGGED_SQL % self.batch)
+            flagged = len(cur.fetchall())
+            cur.execute(ABANDONED_SQL % (ABANDON_HOURS, self.batch))
+            abandoned = len(cur.fetchall())
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.stats['flagged'] += flagged
+        self.stats['abandoned'] += abandoned
+        return flagged, abandoned
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep_once()
+                self.stats['runs'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+                print(f"[WARN] clock sweeper: {e}")
+
+
+sweeper = ClockSweeper()
@@ -12,6 +12,7 @@ PAIRS=(
   "game-history:game_history"
   "geo-detect:geo_detect"
   "invite-game:invite_game"
+  "leaderboard:leaderboard"
   "matchmaking:matchmaking"
   "online-move:online_move"
   "rating-settings:rating_settings"
@@ -19,6 +20,7 @@ PAIRS=(
   "site-settings:site_settings"
   "user-check:user_check"
   "verify-otp:verify_otp"
+  "yookassa-pay:yookassa_pay"
 )
 
 mkdir -p deploy/backend/functions
@@ -29,6 +31,12 @@ for pair in "${PAIRS[@]}"; do
   if [ -f "backend/${SRC}/index.py" ]; then
     cp "backend/${SRC}/index.py" "deploy/backend/functions/${DST}.py"
     echo "Copied ${SRC} -> ${DST}.py"
+    # Дополнительные модули функции (например, chess_core.py у online-move) импортируются по имени
+    for EXTRA in backend/${SRC}/*.py; do
+      [ "$(basename "$EXTRA")" = "index.py" ] && continue
+      cp "$EXTRA" "deploy/backend/functions/"
+      echo "Copied ${EXTRA} -> functions/$(basename "$EXTRA")"
+    done
   else
     echo "WARN: backend/${SRC}/index.py not found"
   fi
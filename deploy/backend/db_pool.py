@@ -0,0 +1,271 @@
+"""
+Общий пул соединений PostgreSQL для шлюза.
+Хендлеры получают соединение через get_connection(), а conn.close() возвращает его в пул.
+В serverless-среде этого модуля нет, и хендлеры подключаются напрямую через psycopg2.connect.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', '2'))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', '20'))
+CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+HEALTH_CHECK_IDLE = float(os.environ.get('DB_POOL_CHECK_IDLE', '30'))
+MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class PooledConnection:
+    """Обёртка над соединением psycopg2: close() возвращает соединение в пул, а не разрывает его"""
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+
+    def __getattr__(self, name):
+        if self._entry is None:
+            raise psycopg2.InterfaceError('connection already returned to pool')
+        return getattr(self._entry.conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_pool', '_entry'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._entry.conn, name, value)
+
+    @property
+    def closed(self):
+        return 1 if self._entry is None else self._entry.conn.closed
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool._putconn(entry, self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._entry is None:
+            return False
+        if exc_type is None:
+            self._entry.conn.commit()
+        else:
+            self._entry.conn.rollback()
+        return False
+
+
+class ConnectionPool:
+    def __init__(self, dsn, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=CHECKOUT_TIMEOUT,
+                 check_idle=HEALTH_CHECK_IDLE, max_lifetime=MAX_LIFETIME):
+        self.dsn = dsn
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.max_lifetime = max_lifetime
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.stats = {'checkouts': 0, 'created': 0, 'discarded': 0, 'timeouts': 0, 'waits': 0}
+
+    def prefill(self):
+        for _ in range(self.minconn):
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                entry = _Entry(self._connect())
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        self.stats['created'] += 1
+        return conn
+
+    def _is_healthy(self, entry):
+        conn = entry.conn
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if self.max_lifetime and now - entry.created_at > self.max_lifetime:
+            return False
+        if now - entry.last_used > self.check_idle:
+            try:
+                cur = conn.cursor()
+                cur.execute('SELECT 1')
+                cur.fetchone()
+                cur.close()
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, entry):
+        self.stats['discarded'] += 1
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.InterfaceError('connection pool is closed')
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeout('no free database connection in %.1fs' % self.timeout)
+                    self.stats['waits'] += 1
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                try:
+                    entry = _Entry(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(entry):
+                self._discard(entry)
+                continue
+
+            self.stats['checkouts'] += 1
+            pooled = PooledConnection(self, entry)
+            self._checked_out().append(pooled)
+            return pooled
+
+    def _checked_out(self):
+        items = getattr(self._local, 'items', None)
+        if items is None:
+            items = self._local.items = []
+        return items
+
+    def _putconn(self, entry, pooled):
+        items = self._checked_out()
+        if pooled in items:
+            items.remove(pooled)
+
+        conn = entry.conn
+        if conn.closed or self._closed:
+            self._discard(entry)
+            return
+        try:
+            tx_status = conn.get_transaction_status()
+            if tx_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(entry)
+                return
+            if tx_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except Exception:
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def release_thread_connections(self):
+        items = self._checked_out()
+        leaked = len(items)
+        for pooled in list(items):
+            pooled.close()
+        return leaked
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for entry in idle:
+            self._discard(entry)
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self.stats, size=self._size, idle=len(self._idle),
+                        in_use=self._size - len(self._idle), min=self.minconn, max=self.maxconn)
+
+
+_pool = None
+
+
+def init_pool(dsn=None, minconn=POOL_MIN, maxconn=POOL_MAX):
+    global _pool
+    if _pool is not None:
+        return _pool
+    _pool = ConnectionPool(dsn or os.environ['DATABASE_URL'], minconn, maxconn)
+    try:
+        _pool.prefill()
+    except Exception as e:
+        print(f"[WARN] DB pool prefill failed: {e}")
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+def get_connection():
+    """Соединение из пула шлюза; до инициализации пула — обычное прямое подключение"""
+    if _pool is None:
+        return psycopg2.connect(os.environ['DATABASE_URL'])
+    return _pool.getconn()
+
+
+def release_request_connections():
+    """Возвращает в пул все соединения, которые хендлер не закрыл в текущем потоке"""
+    if _pool is None:
+        return 0
+    return _pool.release_thread_connections()
+
+
+def pool_stats():
+    if _pool is None:
+        return None
+    return _pool.snapshot()
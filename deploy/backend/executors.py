@@ -0,0 +1,145 @@
+"""
+Выполнение синхронных хендлеров вне event loop.
+У каждой функции свой ограниченный пул потоков и своя очередь, поэтому медленная функция
+(SMTP в send-otp, тяжёлый SQL) не отнимает потоки у online-move.
+Размеры задаются через FN_WORKERS_<ИМЯ> и FN_QUEUE_<ИМЯ>, например FN_WORKERS_ONLINE_MOVE=16.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = int(os.environ.get('FN_WORKERS_DEFAULT', '2'))
+DEFAULT_QUEUE = int(os.environ.get('FN_QUEUE_DEFAULT', '32'))
+
+# (потоков, максимальная длина очереди) для нагруженных функций
+FUNCTION_LIMITS = {
+    'online-move': (8, 256),
+    'matchmaking': (4, 128),
+    'friends': (3, 64),
+    'chat': (3, 64),
+    'invite-game': (2, 64),
+    'send-otp': (2, 16),
+    'verify-otp': (2, 16),
+    'apply-daily-decay': (1, 2),
+}
+
+
+class Overloaded(Exception):
+    pass
+
+
+def _env_name(func_name):
+    return func_name.upper().replace('-', '_')
+
+
+class FunctionExecutor:
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fn-' + name)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_queued = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def _call(self, fn, args, enqueued_at, slot):
+        started = time.monotonic()
+        waited = started - enqueued_at
+        with self._lock:
+            if not slot['released']:
+                slot['released'] = True
+                self.queued -= 1
+            self.running += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.run_total += time.monotonic() - started
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.running + self.queued >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise Overloaded(self.name)
+            self.queued += 1
+            if self.queued > self.max_queued:
+                self.max_queued = self.queued
+        # Место в очереди освобождает тот, кто успел первым: _call при старте или await при отмене
+        # задачи до старта (и при ошибке постановки в пул), иначе queued навсегда остаётся завышенным
+        slot = {'released': False}
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, self._call, fn, args, time.monotonic(), slot)
+        finally:
+            with self._lock:
+                if not slot['released']:
+                    slot['released'] = True
+                    self.queued -= 1
+
+    def snapshot(self):
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queued': self.queued,
+                'running': self.running,
+                'max_queued': self.max_queued,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'avg_wait_ms': round(self.wait_total * 1000 / done, 2) if done else 0,
+                'max_wait_ms': round(self.wait_max * 1000, 2),
+                'avg_run_ms': round(self.run_total * 1000 / done, 2) if done else 0,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executors = {}
+
+
+def get_executor(func_name):
+    ex = _executors.get(func_name)
+    if ex is None:
+        workers, max_queue = FUNCTION_LIMITS.get(func_name, (DEFAULT_WORKERS, DEFAULT_QUEUE))
+        env = _env_name(func_name)
+        workers = int(os.environ.get('FN_WORKERS_' + env, workers))
+        max_queue = int(os.environ.get('FN_QUEUE_' + env, max_queue))
+        ex = _executors[func_name] = FunctionExecutor(func_name, workers, max_queue)
+    return ex
+
+
+async def run_handler(func_name, fn, *args):
+    return await get_executor(func_name).run(fn, *args)
+
+
+def metrics():
+    return {name: ex.snapshot() for name, ex in sorted(_executors.items())}
+
+
+def shutdown():
+    for ex in _executors.values():
+        ex.shutdown()
+    _executors.clear()
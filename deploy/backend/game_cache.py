@@ -0,0 +1,197 @@
+"""
+Кэш состояния онлайн-партий в памяти воркера шлюза.
+GET online-move и GET matchmaking?game_id= читают партию отсюда, а не из PostgreSQL.
+Запись идёт через условный UPDATE ... WHERE move_number = N в хендлере; после COMMIT хендлер
+применяет то же событие к кэшу (write-through), а события других воркеров приходят через
+LISTEN game_events. Версия записи — move_number: устаревшие события отбрасываются,
+при пропуске хода запись удаляется и перечитывается из БД.
+Чтение из БД, начатое до события по партии или до полного сброса (resync), в кэш не попадает:
+метка begin_load() хранит номер события и поколение кэша, clear() меняет поколение.
+Завершённые партии переезжают в отдельный LRU и вытесняются первыми.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ACTIVE_CAPACITY = int(os.environ.get('GAME_CACHE_ACTIVE', '10000'))
+FINISHED_CAPACITY = int(os.environ.get('GAME_CACHE_FINISHED', '2000'))
+RECENT_EVENTS = 20000
+
+# Поля, которые события game_events могут менять в записи
+PATCH_FIELDS = (
+    'status', 'current_player', 'white_time', 'black_time', 'white_clock_ms', 'black_clock_ms',
+    'board_state', 'winner', 'end_reason', 'move_number',
+    'rematch_offered_by', 'rematch_status', 'rematch_game_id', 'draw_offered_by',
+)
+
+
+class GameCache:
+    def __init__(self, active_capacity=ACTIVE_CAPACITY, finished_capacity=FINISHED_CAPACITY):
+        self.active_capacity = active_capacity
+        self.finished_capacity = finished_capacity
+        self._active = OrderedDict()
+        self._finished = OrderedDict()
+        self._recent = OrderedDict()
+        self._seq = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.is_live = lambda: False
+        self.stats = {'hits': 0, 'misses': 0, 'loads': 0, 'stale_loads': 0, 'events': 0, 'dropped': 0, 'evicted': 0}
+
+    def _find(self, game_id):
+        entry = self._active.get(game_id)
+        if entry is None:
+            entry = self._finished.get(game_id)
+        return entry
+
+    def _drop(self, game_id):
+        self._active.pop(game_id, None)
+        self._finished.pop(game_id, None)
+
+    def _touch(self, game_id):
+        # Номер последнего события по партии: put() отбрасывает чтения, начатые раньше
+        self._seq += 1
+        self._recent[game_id] = self._seq
+        self._recent.move_to_end(game_id)
+        if len(self._recent) > RECENT_EVENTS:
+            self._recent.popitem(last=False)
+
+    def _place(self, game_id, entry):
+        if entry['status'] == 'playing':
+            self._finished.pop(game_id, None)
+            self._active[game_id] = entry
+            self._active.move_to_end(game_id)
+            while len(self._active) > self.active_capacity:
+                self._active.popitem(last=False)
+                self.stats['evicted'] += 1
+        else:
+            self._active.pop(game_id, None)
+            self._finished[game_id] = entry
+            self._finished.move_to_end(game_id)
+            while len(self._finished) > self.finished_capacity:
+                self._finished.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def get(self, game_id):
+        """Копия записи с актуальным ms_since_move или None, если партии нет в кэше"""
+        if not self.is_live():
+            return None
+        with self._lock:
+            entry = self._find(game_id)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            if entry['status'] == 'playing':
+                self._active.move_to_end(game_id)
+            else:
+                self._finished.move_to_end(game_id)
+            game = dict(entry)
+            game['moves'] = list(entry['moves'])
+        game['ms_since_move'] = int((time.monotonic() - game.pop('moved_at')) * 1000)
+        game['seconds_since_move'] = game['ms_since_move'] // 1000
+        return game
+
+    def begin_load(self):
+        """Метка перед чтением партии из БД: (поколение, номер события); передаётся в put()"""
+        with self._lock:
+            return self._generation, self._seq
+
+    def put(self, game, token):
+        """Кладёт прочитанную из БД партию, если за время чтения по ней не приходило событий
+        и кэш не сбрасывался"""
+        if not self.is_live():
+            return False
+        game_id = game['id']
+        entry = dict(game)
+        entry['moves'] = list(game['moves'])
+        entry['moved_at'] = time.monotonic() - (game.get('ms_since_move') or 0) / 1000.0
+        entry.pop('ms_since_move', None)
+        entry.pop('seconds_since_move', None)
+        generation, seq = token
+        with self._lock:
+            if generation != self._generation or self._recent.get(game_id, -1) > seq:
+                self.stats['stale_loads'] += 1
+                return False
+            current = self._find(game_id)
+            if current is not None and current['move_number'] > entry['move_number']:
+                return False
+            self._place(game_id, entry)
+            self.stats['loads'] += 1
+        return True
+
+    def apply_event(self, event):
+        """Применяет событие game_events: write-through из хендлера или NOTIFY от другого воркера"""
+        etype = event.get('type')
+        game_id = event.get('game_id')
+        if etype == 'resync':
+            if game_id is None:
+                self.clear()
+            else:
+                self.invalidate(game_id)
+            return
+        if etype not in ('move', 'state') or game_id is None:
+            return
+        with self._lock:
+            self.stats['events'] += 1
+            self._touch(game_id)
+
+            entry = self._find(game_id)
+            if entry is None:
+                return
+            move_number = event.get('move_number')
+            if etype == 'move':
+                if move_number <= entry['move_number']:
+                    return
+                if move_number != entry['move_number'] + 1:
+                    self._drop(game_id)
+                    self.stats['dropped'] += 1
+                    return
+                entry['moves'].append(event['move'])
+                entry['moved_at'] = time.monotonic()
+            else:
+                if move_number is not None and move_number < entry['move_number']:
+                    return
+                if event.get('clock_restarted'):
+                    entry['moved_at'] = time.monotonic()
+            for key in PATCH_FIELDS:
+                if key in event:
+                    entry[key] = event[key]
+            self._place(game_id, entry)
+
+    def invalidate(self, game_id):
+        with self._lock:
+            self._drop(game_id)
+            # Чтение, начатое до сброса партии, не должно вернуть её в кэш
+            self._touch(game_id)
+
+    def clear(self):
+        with self._lock:
+            self._active.clear()
+            self._finished.clear()
+            self._generation += 1
+            self._recent.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, active=len(self._active), finished=len(self._finished), live=self.is_live())
+
+
+cache = GameCache()
+
+
+def get(game_id):
+    return cache.get(game_id)
+
+
+def begin_load():
+    return cache.begin_load()
+
+
+def put(game, token):
+    return cache.put(game, token)
+
+
+def apply_event(event):
+    cache.apply_event(event)
@@ -0,0 +1,206 @@
+"""
+Push-канал онлайн-партий.
+Хендлер online-move делает pg_notify('game_events', ...) в той же транзакции, что и ход.
+Фоновый поток шлюза слушает канал (LISTEN) и раздаёт события подписчикам партии
+через WebSocket или SSE, поэтому клиентам не нужно опрашивать GET online-move.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import db_pool
+
+CHANNEL = 'game_events'
+SUBSCRIBER_QUEUE = int(os.environ.get('GAME_EVENTS_QUEUE', '64'))
+KEEPALIVE_SECONDS = 20
+
+# Служебные события воркеров, подписчикам не раздаются. signal_stored уходит адресату:
+# по нему клиент забирает крупный сигнал из webrtc_signals опросом, не дожидаясь интервала
+INTERNAL_EVENTS = ('signal_ack', 'mm_join', 'mm_seen', 'mm_leave', 'mm_match', 'lb_rating')
+
+
+class Subscription:
+    def __init__(self, game_id, user_id=None):
+        self.game_id = game_id
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE)
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать — сбрасываем хвост и просим перечитать состояние
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync', 'game_id': self.game_id})
+
+    async def next_event(self, timeout=KEEPALIVE_SECONDS):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class GameEventHub:
+    def __init__(self):
+        self._subs = {}
+        self._loop = None
+        self._dsn = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._listeners = []
+        self.connected = False
+        self.stats = {'notifications': 0, 'delivered': 0, 'reconnects': 0}
+
+    def start(self, loop, dsn):
+        self._loop = loop
+        self._dsn = dsn
+        self._thread = threading.Thread(target=self._listen_forever, name='game-events', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def add_listener(self, fn):
+        """fn(event) вызывается из event loop на каждое событие канала и на resync без game_id"""
+        self._listeners.append(fn)
+
+    def _notify_listeners(self, event):
+        for fn in self._listeners:
+            try:
+                fn(event)
+            except Exception as e:
+                print(f"[WARN] game events listener callback: {e}")
+
+    def subscribe(self, game_id, user_id=None):
+        sub = Subscription(game_id, user_id)
+        self._subs.setdefault(game_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        subs = self._subs.get(sub.game_id)
+        if subs:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.game_id]
+
+    def publish(self, event):
+        """Раздаёт событие подписчикам; вызывается только из event loop.
+        События с полем to (WebRTC-сигналы, чат) получает только адресат."""
+        if event.get('type') in INTERNAL_EVENTS:
+            return
+        game_id = event.get('game_id')
+        to_user = event.get('to')
+        for sub in list(self._subs.get(game_id, ())):
+            if to_user is not None and sub.user_id != to_user:
+                continue
+            sub.push(event)
+            self.stats['delivered'] += 1
+
+    def _publish_all(self, event_type):
+        self._notify_listeners({'type': event_type})
+        for game_id, subs in list(self._subs.items()):
+            for sub in list(subs):
+                sub.push({'type': event_type, 'game_id': game_id})
+
+    def _on_payload(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        self._notify_listeners(event)
+        self.publish(event)
+
+    def _listen_forever(self):
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self._dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cur = conn.cursor()
+                cur.execute('LISTEN %s' % CHANNEL)
+                if not first:
+                    # Пока соединения не было, события могли потеряться
+                    self.stats['reconnects'] += 1
+                    self._loop.call_soon_threadsafe(self._publish_all, 'resync')
+                first = False
+                self.connected = True
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        self.stats['notifications'] += 1
+                        self._loop.call_soon_threadsafe(self._on_payload, note.payload)
+            except Exception as e:
+                print(f"[WARN] game events listener: {e}")
+                if self.connected:
+                    self.connected = False
+                    self._loop.call_soon_threadsafe(self._notify_listeners, {'type': 'resync'})
+                time.sleep(2)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def snapshot(self):
+        return dict(self.stats, connected=self.connected, games=len(self._subs),
+                    subscribers=sum(len(s) for s in self._subs.values()))
+
+
+hub = GameEventHub()
+
+
+def fetch_game_state(game_id):
+    """Компактное состояние партии без move_history — первое сообщение подписчику"""
+    conn = db_pool.get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """SELECT id, move_number, current_player, white_time, black_time, status, winner, end_reason,
+                      draw_offered_by, rematch_status, rematch_game_id,
+                      EXTRACT(EPOCH FROM (NOW() - last_move_at))::int,
+                      COALESCE((SELECT m.uci FROM online_game_moves m WHERE m.game_id = online_games.id ORDER BY m.ply DESC LIMIT 1),
+                               NULLIF(regexp_replace(move_history, '^.*,', ''), '')),
+                      COALESCE(white_clock_ms, white_time * 1000), COALESCE(black_clock_ms, black_time * 1000),
+                      (EXTRACT(EPOCH FROM (NOW() - last_move_at)) * 1000)::bigint
+            FROM online_games WHERE id = %d""" % int(game_id)
+        )
+        row = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    status, current_player = row[5], row[2]
+    white_time, black_time = row[3], row[4]
+    seconds_since_move = row[11] or 0
+    white_ms, black_ms, ms_since_move = row[13], row[14], row[15] or 0
+    if status == 'playing' and seconds_since_move > 0:
+        if current_player == 'white':
+            white_time = max(0, white_time - seconds_since_move)
+        else:
+            black_time = max(0, black_time - seconds_since_move)
+    if status == 'playing' and ms_since_move > 0:
+        if current_player == 'white':
+            white_ms = max(0, white_ms - ms_since_move)
+        else:
+            black_ms = max(0, black_ms - ms_since_move)
+    return {
+        'type': 'sync', 'game_id': row[0], 'move_number': row[1] or 0,
+        'current_player': current_player, 'white_time': white_time, 'black_time': black_time,
+        'white_clock_ms': white_ms, 'black_clock_ms': black_ms,
+        'status': status, 'winner': row[6], 'end_reason': row[7],
+        'draw_offered_by': row[8], 'rematch_status': row[9], 'rematch_game_id': row[10],
+        'last_move': row[12] or None,
+    }
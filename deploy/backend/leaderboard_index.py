@@ -0,0 +1,295 @@
+"""
+Таблица рейтинга в памяти воркера шлюза: топ, место игрока и соседи по таблице без сортировки users.
+Для страны, каждого города и региона хранится дерево Фенвика по значениям рейтинга (сколько игроков
+имеют рейтинг r), поэтому место игрока и k-й игрок сверху находятся за O(log R), R = RATING_MAX + 1.
+Игроки с одинаковым рейтингом делят одно место (как COUNT(rating > r) + 1 в SQL-пути хендлера);
+внутри корзины рейтинга игроки лежат в массиве с индексом позиции, поэтому большая корзина
+(начальный рейтинг, упор снижения в min_rating) не перебирается целиком.
+Изменения приходят событиями lb_rating канала game_events: finish-game шлёт их после партии,
+apply-daily-decay — после каждой порции снижения, в той же транзакции. Задача планировщика
+leaderboard-rebuild (LEADERBOARD_REBUILD_CRON) на каждом воркере перечитывает users и подменяет индекс;
+события, пришедшие во время перечитывания, применяются к новому индексу повторно.
+Длинные аватары (загруженные картинки) в памяти не хранятся, хендлер дочитывает их из БД.
+"""
+import os
+import threading
+import time
+from array import array
+
+import db_pool
+
+RATING_MAX = int(os.environ.get('LEADERBOARD_RATING_MAX', '4000'))
+REBUILD_CRON = os.environ.get('LEADERBOARD_REBUILD_CRON', '*/10 * * * *')
+AVATAR_INLINE_MAX = 512
+FETCH_ROWS = 20000
+
+LOAD_SQL = """SELECT id, rating, username, COALESCE(city, ''), NULLIF(region, ''),
+       CASE WHEN LENGTH(COALESCE(avatar, '')) <= %d THEN COALESCE(avatar, '') END
+FROM users""" % AVATAR_INLINE_MAX
+
+# Поля игрока в событии lb_rating после [user_id, рейтинг]; отсутствующие в конце поля не меняются
+EVENT_FIELDS = ('username', 'city', 'avatar', 'region')
+KEEP = object()
+
+
+class Fenwick:
+    """Счётчики по индексам 0..size-1: префиксная сумма и поиск k-го элемента за O(log size)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = array('i', [0]) * (size + 1)
+        self.total = 0
+        self._top = 1 << (size.bit_length() - 1)
+
+    def add(self, i, delta):
+        self.total += delta
+        i += 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """Сумма по индексам < i"""
+        s = 0
+        while i > 0:
+            s += self.tree[i]
+            i -= i & -i
+        return s
+
+    def find(self, k):
+        """(индекс, номер внутри индекса с 1), где находится k-й элемент, k >= 1"""
+        pos = 0
+        step = self._top
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] < k:
+                pos = nxt
+                k -= self.tree[nxt]
+            step >>= 1
+        return pos, k
+
+
+class Board:
+    """Одна таблица (страна, город или регион). Индекс дерева = RATING_MAX - рейтинг: выше рейтинг — раньше.
+    Корзина рейтинга — [игроки, {user_id: позиция в списке}]; удаление переносит последнего на место удалённого"""
+
+    def __init__(self):
+        self.tree = Fenwick(RATING_MAX + 1)
+        self.buckets = {}
+
+    def add(self, user_id, rating):
+        idx = RATING_MAX - rating
+        bucket = self.buckets.get(idx)
+        if bucket is None:
+            bucket = self.buckets[idx] = [[], {}]
+        if user_id in bucket[1]:
+            return
+        bucket[1][user_id] = len(bucket[0])
+        bucket[0].append(user_id)
+        self.tree.add(idx, 1)
+
+    def remove(self, user_id, rating):
+        idx = RATING_MAX - rating
+        bucket = self.buckets.get(idx)
+        if bucket is None:
+            return
+        ids, slots = bucket
+        slot = slots.pop(user_id, None)
+        if slot is None:
+            return
+        last = ids.pop()
+        if slot < len(ids):
+            ids[slot] = last
+            slots[last] = slot
+        if not ids:
+            del self.buckets[idx]
+        self.tree.add(idx, -1)
+
+    def rank(self, rating):
+        """Место с учётом равных: 1 + число игроков с рейтингом выше"""
+        return self.tree.prefix(RATING_MAX - rating) + 1
+
+    def position(self, user_id, rating):
+        """Порядковый номер строки игрока в таблице (для окна соседей); O(log R)"""
+        idx = RATING_MAX - rating
+        bucket = self.buckets.get(idx)
+        if bucket is None or user_id not in bucket[1]:
+            return None
+        return self.tree.prefix(idx) + bucket[1][user_id] + 1
+
+    def slice(self, start, count):
+        """Строки start..start+count-1 таблицы: [(место с учётом равных, user_id)]"""
+        result = []
+        position = max(start, 1)
+        while len(result) < count and position <= self.tree.total:
+            idx, offset = self.tree.find(position)
+            taken = self.buckets[idx][0][offset - 1:offset - 1 + count - len(result)]
+            rank = position - offset + 1
+            result.extend((rank, uid) for uid in taken)
+            position += len(taken)
+        return result
+
+
+def _clamp(rating):
+    return min(max(int(rating), 0), RATING_MAX)
+
+
+class LeaderboardIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # user_id → [рейтинг, имя, город, регион, аватар (None — длинный, читать из БД)]
+        self.players = {}
+        self.boards = {}
+        self.loaded = False
+        self.is_live = lambda: False
+        self._pending = None
+        self._rerun = False
+        self.stats = {'events': 0, 'updates': 0, 'rebuilds': 0, 'rebuild_errors': 0, 'last_error': None,
+                      'last_rebuild_at': None, 'last_rebuild_ms': 0}
+
+    @staticmethod
+    def _scopes(player):
+        scopes = [('country', '')]
+        if player[2]:
+            scopes.append(('city', player[2]))
+        if player[3]:
+            scopes.append(('region', player[3]))
+        return scopes
+
+    def _set(self, players, boards, user_id, rating, username=KEEP, city=KEEP, region=KEEP, avatar=KEEP):
+        player = players.get(user_id)
+        if player is None:
+            player = players[user_id] = [0, '', '', None, None]
+        else:
+            for scope in self._scopes(player):
+                boards[scope].remove(user_id, player[0])
+        player[0] = _clamp(rating)
+        for i, value in ((1, username), (2, city if city is KEEP else city or ''), (3, region), (4, avatar)):
+            if value is not KEEP:
+                player[i] = value
+        for scope in self._scopes(player):
+            board = boards.get(scope)
+            if board is None:
+                board = boards[scope] = Board()
+            board.add(user_id, player[0])
+
+    def update(self, entries):
+        """entries — списки [user_id, рейтинг, *EVENT_FIELDS] из события"""
+        with self._lock:
+            for entry in entries:
+                self._set(self.players, self.boards, *entry[:2], **dict(zip(EVENT_FIELDS, entry[2:])))
+                self.stats['updates'] += 1
+            if self._pending is not None:
+                self._pending.extend(entries)
+
+    def apply_event(self, event):
+        etype = event.get('type')
+        if etype == 'lb_rating':
+            self.stats['events'] += 1
+            self.update(event.get('users') or ())
+        elif etype == 'resync' and event.get('game_id') is None:
+            # Пока слушатель был отключён, события могли потеряться
+            threading.Thread(target=self._rebuild_quietly, name='leaderboard-rebuild', daemon=True).start()
+
+    def _rebuild_quietly(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"[WARN] leaderboard rebuild: {e}")
+
+    def rebuild(self):
+        """Перечитывает users и подменяет индекс; задача планировщика leaderboard-rebuild"""
+        with self._lock:
+            if self._pending is not None:
+                self._rerun = True
+                return None
+            self._pending = []
+        started = time.monotonic()
+        players, boards = {}, {}
+        try:
+            conn = db_pool.get_connection()
+            try:
+                cur = conn.cursor('leaderboard_index')
+                cur.itersize = FETCH_ROWS
+                cur.execute(LOAD_SQL)
+                for user_id, rating, username, city, region, avatar in cur:
+                    self._set(players, boards, user_id, rating, username, city, region, avatar)
+                cur.close()
+                conn.rollback()
+            finally:
+                conn.close()
+        except Exception as e:
+            with self._lock:
+                self._pending = None
+            self.stats['rebuild_errors'] += 1
+            self.stats['last_error'] = str(e)
+            raise
+        with self._lock:
+            for entry in self._pending:
+                self._set(players, boards, *entry[:2], **dict(zip(EVENT_FIELDS, entry[2:])))
+            self.players, self.boards = players, boards
+            self._pending = None
+            self.loaded = True
+            rerun, self._rerun = self._rerun, False
+        self.stats['rebuilds'] += 1
+        self.stats['last_rebuild_at'] = int(time.time())
+        self.stats['last_rebuild_ms'] = int((time.monotonic() - started) * 1000)
+        if rerun:
+            return self.rebuild()
+        return {'players': len(players), 'boards': len(boards)}
+
+    def ready(self):
+        return self.loaded and self.is_live()
+
+    def _row(self, rank, user_id):
+        player = self.players[user_id]
+        return {'rank': rank, 'user_id': user_id, 'name': player[1], 'rating': player[0],
+                'city': player[2], 'avatar': player[4]}
+
+    def top(self, scope, name, limit):
+        """Первые limit игроков таблицы; avatar None — аватар нужно дочитать из БД"""
+        with self._lock:
+            board = self.boards.get((scope, name or ''))
+            if board is None:
+                return []
+            return [self._row(rank, uid) for rank, uid in board.slice(1, limit)]
+
+    def standing(self, user_id, around=0):
+        """Место игрока в таблицах страны, его города и региона и до around соседей сверху и снизу"""
+        with self._lock:
+            player = self.players.get(user_id)
+            if player is None:
+                return None
+            result = {}
+            for scope in self._scopes(player):
+                board = self.boards[scope]
+                item = {'rank': board.rank(player[0]), 'rating': player[0], 'total': board.tree.total}
+                if scope[0] != 'country':
+                    item['name'] = scope[1]
+                if around:
+                    position = board.position(user_id, player[0])
+                    item['around'] = [self._row(rank, uid)
+                                      for rank, uid in board.slice(position - around, 2 * around + 1)]
+                result[scope[0]] = item
+            return result
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, players=len(self.players), boards=len(self.boards),
+                        loaded=self.loaded, live=self.is_live(), cron=REBUILD_CRON)
+
+
+index = LeaderboardIndex()
+
+
+def apply_event(event):
+    index.apply_event(event)
+
+
+def is_ready():
+    return index.ready()
+
+
+def start():
+    """Первая загрузка индекса в фоне при старте воркера"""
+    threading.Thread(target=index._rebuild_quietly, name='leaderboard-rebuild', daemon=True).start()
@@ -1,9 +1,23 @@
+import asyncio
 import json
 import os
 import importlib
 import sys
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+
+import clock_sweeper
+import db_pool
+import executors
+import game_cache
+import game_events
+import leaderboard_index
+import matchmaker
+import maintenance
+import rate_limiter
+import scheduler
+import signal_relay
 
 app = FastAPI(title="LigaChess API")
 
@@ -15,7 +29,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Лимиты частоты проверяются middleware до разбора запроса, хендлеры их не пересчитывают
+rate_limiter.limiter.gateway_enforced = True
+
+
+def _client_ip(request: Request) -> str:
+    """Тот же порядок, что в get_client_ip хендлеров: X-Forwarded-For, X-Real-Ip, адрес сокета"""
+    ip = request.headers.get("x-forwarded-for", "")
+    if ip:
+        ip = ip.split(",")[0].strip()
+    if not ip:
+        ip = request.headers.get("x-real-ip", "")
+    if not ip:
+        ip = request.client.host if request.client else "unknown"
+    return ip or "unknown"
+
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    parts = request.url.path.split("/")
+    if len(parts) > 2 and parts[1] == "api" and parts[2] != "live":
+        limited, retry_after = rate_limiter.limiter.check_request(parts[2], request.method, _client_ip(request))
+        if limited:
+            return Response(
+                content=json.dumps({"error": "Too many requests"}),
+                status_code=429,
+                headers={"Content-Type": "application/json", "Access-Control-Allow-Origin": "*",
+                         "Retry-After": str(retry_after)},
+            )
+    return await call_next(request)
+
+
 sys.path.insert(0, os.path.dirname(__file__))
+# Вспомогательные модули функций (chess_core.py и т.п.) копируются рядом с ними в functions/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "functions"))
 
 FUNCTION_MODULES = {
     "admin-auth": "functions.admin_auth",
@@ -27,6 +74,7 @@ FUNCTION_MODULES = {
     "game-history": "functions.game_history",
     "geo-detect": "functions.geo_detect",
     "invite-game": "functions.invite_game",
+    "leaderboard": "functions.leaderboard",
     "matchmaking": "functions.matchmaking",
     "online-move": "functions.online_move",
     "rating-settings": "functions.rating_settings",
@@ -34,6 +82,7 @@ FUNCTION_MODULES = {
     "site-settings": "functions.site_settings",
     "user-check": "functions.user_check",
     "verify-otp": "functions.verify_otp",
+    "yookassa-pay": "functions.yookassa_pay",
 }
 
 _loaded = {}
@@ -44,6 +93,44 @@ for name, module_path in FUNCTION_MODULES.items():
         print(f"[WARN] Failed to load {name}: {e}")
 
 
+@app.on_event("startup")
+async def _init_db_pool():
+    if os.environ.get("DATABASE_URL"):
+        db_pool.init_pool()
+        # Кэш партий работает, только пока слушатель game_events на связи
+        game_cache.cache.is_live = lambda: game_events.hub.connected
+        game_events.hub.add_listener(game_cache.apply_event)
+        signal_relay.relay.is_live = lambda: game_events.hub.connected
+        game_events.hub.add_listener(signal_relay.relay.apply_event)
+        matchmaker.matchmaker.is_live = lambda: game_events.hub.connected
+        game_events.hub.add_listener(matchmaker.apply_event)
+        leaderboard_index.index.is_live = lambda: game_events.hub.connected
+        game_events.hub.add_listener(leaderboard_index.apply_event)
+        matchmaker.matchmaker.start(os.environ["DATABASE_URL"])
+        rate_limiter.limiter.start()
+        scheduler.register("maintenance", maintenance.CRON, maintenance.maintenance.run_once)
+        scheduler.register("leaderboard-rebuild", leaderboard_index.REBUILD_CRON, leaderboard_index.index.rebuild,
+                           jitter=30, every_worker=True)
+        scheduler.scheduler.start(os.environ["DATABASE_URL"])
+        game_events.hub.start(asyncio.get_running_loop(), os.environ["DATABASE_URL"])
+        clock_sweeper.sweeper.start()
+        leaderboard_index.start()
+    for name in _loaded:
+        executors.get_executor(name)
+
+
+@app.on_event("shutdown")
+def _close_db_pool():
+    clock_sweeper.sweeper.stop()
+    matchmaker.matchmaker.stop()
+    rate_limiter.limiter.stop()
+    scheduler.scheduler.stop()
+    maintenance.maintenance.stop()
+    game_events.hub.stop()
+    executors.shutdown()
+    db_pool.close_pool()
+
+
 class FakeContext:
     def __init__(self):
         self.request_id = "local"
@@ -69,6 +156,13 @@ async def _build_event(request: Request) -> dict:
     }
 
 
+def _invoke(mod, event, ctx):
+    try:
+        return mod.handler(event, ctx)
+    finally:
+        db_pool.release_request_connections()
+
+
 def _make_response(result: dict) -> Response:
     status = result.get("statusCode", 200)
     resp_headers = result.get("headers", {})
@@ -76,6 +170,91 @@ def _make_response(result: dict) -> Response:
     return Response(content=body, status_code=status, headers=resp_headers)
 
 
+def _ack_pushed(event):
+    """Отданный подписчику WebRTC-сигнал снимается с почтовых ящиков, чтобы опрос его не повторил"""
+    if event and event.get("type") == "signal" and event.get("to") and event.get("id"):
+        asyncio.get_running_loop().run_in_executor(
+            None, signal_relay.relay.pushed, event.get("game_id"), event["to"], [event["id"]])
+
+
+@app.websocket("/api/live/games/{game_id}")
+async def game_live_ws(websocket: WebSocket, game_id: int, user_id: str = ""):
+    await websocket.accept()
+    sub = game_events.hub.subscribe(game_id, user_id or None)
+    try:
+        state = await asyncio.to_thread(game_events.fetch_game_state, game_id)
+        if state is None:
+            await websocket.send_json({"type": "error", "error": "game not found"})
+            await websocket.close(code=4404)
+            return
+        await websocket.send_json(state)
+        while True:
+            event = await sub.next_event()
+            await websocket.send_json(event or {"type": "ping"})
+            _ack_pushed(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        game_events.hub.unsubscribe(sub)
+
+
+@app.get("/api/live/games/{game_id}/events")
+async def game_live_sse(game_id: int, request: Request, user_id: str = ""):
+    sub = game_events.hub.subscribe(game_id, user_id or None)
+    try:
+        state = await asyncio.to_thread(game_events.fetch_game_state, game_id)
+    except Exception:
+        game_events.hub.unsubscribe(sub)
+        raise
+    if state is None:
+        game_events.hub.unsubscribe(sub)
+        return Response(
+            content=json.dumps({"error": "game not found"}),
+            status_code=404,
+            headers={"Content-Type": "application/json", "Access-Control-Allow-Origin": "*"},
+        )
+
+    async def stream():
+        try:
+            yield "data: %s\n\n" % json.dumps(state)
+            while not await request.is_disconnected():
+                event = await sub.next_event()
+                yield "data: %s\n\n" % json.dumps(event) if event else ": ping\n\n"
+                _ack_pushed(event)
+        finally:
+            game_events.hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Access-Control-Allow-Origin": "*"},
+    )
+
+
+@app.get("/api/matchmaking/wait")
+async def matchmaking_wait(request: Request, user_id: str = "", timeout: float = 25):
+    """Long-poll поиска: держит запрос, пока matchmaker не найдёт пару или не выйдет timeout.
+    Ответ в формате GET matchmaking?user_id=, плюс long_poll=true. Без движка — обычный GET хендлера."""
+    if not user_id or not matchmaker.is_live():
+        return await proxy("matchmaking", request)
+    found = await matchmaker.wait_for_match(user_id, timeout)
+    result = {"in_queue": matchmaker.in_queue(user_id), "long_poll": True}
+    if found:
+        result["active_game"] = {
+            "game_id": found["game_id"],
+            "player_color": found["player_color"],
+            "opponent_name": found["opponent_name"],
+            "opponent_rating": found["opponent_rating"],
+            "opponent_avatar": found["opponent_avatar"],
+            "time_control": found["time_control"],
+            "is_bot_game": False,
+        }
+    return Response(
+        content=json.dumps(result),
+        headers={"Content-Type": "application/json", "Access-Control-Allow-Origin": "*", "Cache-Control": "no-store"},
+    )
+
+
 @app.api_route("/api/{func_name}", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 @app.api_route("/api/{func_name}/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 async def proxy(func_name: str, request: Request, path: str = ""):
@@ -91,7 +270,13 @@ async def proxy(func_name: str, request: Request, path: str = ""):
     ctx = FakeContext()
 
     try:
-        result = mod.handler(event, ctx)
+        result = await executors.run_handler(func_name, _invoke, mod, event, ctx)
+    except executors.Overloaded:
+        return Response(
+            content=json.dumps({"error": "Server busy, retry later"}),
+            status_code=503,
+            headers={"Content-Type": "application/json", "Access-Control-Allow-Origin": "*", "Retry-After": "1"},
+        )
     except Exception as e:
         return Response(
             content=json.dumps({"error": str(e)}),
@@ -104,4 +289,13 @@ async def proxy(func_name: str, request: Request, path: str = ""):
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "functions": list(_loaded.keys())}
+    return {"status": "ok", "functions": list(_loaded.keys()), "db_pool": db_pool.pool_stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    return {"executors": executors.metrics(), "db_pool": db_pool.pool_stats(), "game_events": game_events.hub.snapshot(),
+            "clock_sweeper": clock_sweeper.sweeper.stats, "game_cache": game_cache.cache.snapshot(),
+            "signal_relay": signal_relay.relay.snapshot(), "matchmaker": matchmaker.matchmaker.snapshot(),
+            "rate_limiter": rate_limiter.limiter.snapshot(), "maintenance": maintenance.maintenance.snapshot(),
+            "scheduler": scheduler.scheduler.snapshot(), "leaderboard": leaderboard_index.index.snapshot()}
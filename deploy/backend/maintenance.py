@@ -0,0 +1,202 @@
+"""
+Плановое обслуживание таблиц с быстрым оборотом строк.
+Задача maintenance планировщика (по MAINTENANCE_CRON, по умолчанию раз в минуту) удаляет устаревшие строки
+ограниченными пачками, фиксируя каждую пачку отдельно, чтобы не держать блокировки и длинные транзакции.
+rate_limits и webrtc_signals разбиты на секции по дням: секции на несколько дней вперёд создаются
+заранее, а секции старше срока хранения удаляются целиком через DROP TABLE, без DELETE и VACUUM.
+Строки, попавшие в секцию DEFAULT (например, пока обслуживание не работало), чистятся пачками.
+Сколько строк удалено за последний прогон и всего, видно на /metrics в разделе maintenance.
+"""
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+
+import db_pool
+
+CRON = os.environ.get('MAINTENANCE_CRON', '* * * * *')
+BATCH = int(os.environ.get('MAINTENANCE_BATCH', '5000'))
+MAX_BATCHES = int(os.environ.get('MAINTENANCE_MAX_BATCHES', '20'))
+DAYS_AHEAD = int(os.environ.get('PARTITION_DAYS_AHEAD', '3'))
+LOCK_TIMEOUT_MS = 2000
+TRAINER_SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Ключ pg_try_advisory_lock: из нескольких воркеров обслуживание выполняет один
+MAINTENANCE_LOCK_KEY = 720005
+
+# Секционированная таблица → (столбец секционирования, сколько прошлых дней хранить)
+PARTITIONED = {
+    'rate_limits': ('window_start', int(os.environ.get('RATE_LIMITS_KEEP_DAYS', '1'))),
+    'webrtc_signals': ('created_at', int(os.environ.get('WEBRTC_SIGNALS_KEEP_DAYS', '1'))),
+}
+
+# Задача → (таблица, условие устаревшей строки)
+PURGE_JOBS = (
+    ('game_invites', 'game_invites',
+     "(status = 'pending' AND created_at < NOW() - INTERVAL '2 minutes') OR created_at < NOW() - INTERVAL '1 day'"),
+    ('otp_codes', 'otp_codes', "expires_at < NOW() - INTERVAL '1 day'"),
+    ('matchmaking_queue', 'matchmaking_queue', "last_heartbeat < NOW() - INTERVAL '10 minutes'"),
+    ('scheduler_runs', 'scheduler_runs', "started_at < NOW() - INTERVAL '30 days'"),
+    ('rating_histogram_snapshots', 'rating_histogram_snapshots', "taken_on < CURRENT_DATE - 400"),
+    ('trainer_active_sessions', '"%s".trainer_active_sessions' % TRAINER_SCHEMA.replace('"', ''),
+     "last_heartbeat < NOW() - INTERVAL '1 hour'"),
+) + tuple(
+    ('%s_default' % table, '%s_default' % table, "%s < CURRENT_DATE - %d" % (column, keep_days))
+    for table, (column, keep_days) in PARTITIONED.items()
+)
+
+PURGE_SQL = "DELETE FROM %s WHERE ctid IN (SELECT ctid FROM %s WHERE %s LIMIT %d)"
+
+PARTITIONS_SQL = """
+SELECT c.relname, GREATEST(c.reltuples, 0)::bigint FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = '%s'::regclass
+"""
+
+# Секция создаётся отдельной таблицей и присоединяется к родителю; строки её дня,
+# успевшие попасть в DEFAULT, переносятся в неё, иначе ATTACH PARTITION не пройдёт
+CREATE_PARTITION_SQL = (
+    "CREATE TABLE IF NOT EXISTS %(name)s (LIKE %(table)s INCLUDING DEFAULTS)",
+    "WITH moved AS (DELETE FROM %(table)s_default WHERE %(column)s >= '%(start)s' AND %(column)s < '%(end)s' RETURNING *) "
+    "INSERT INTO %(name)s SELECT * FROM moved",
+    "ALTER TABLE %(table)s ATTACH PARTITION %(name)s FOR VALUES FROM ('%(start)s') TO ('%(end)s')",
+)
+
+
+def partition_name(table, day):
+    return '%s_p%s' % (table, day.strftime('%Y%m%d'))
+
+
+class Maintenance:
+    def __init__(self, jobs=PURGE_JOBS, partitioned=None):
+        self.jobs = jobs
+        self.partitioned = dict(PARTITIONED if partitioned is None else partitioned)
+        self._stop = threading.Event()
+        self._missing = set()
+        self.stats = {'runs': 0, 'skipped': 0, 'errors': 0, 'last_error': None, 'last_run_at': None,
+                      'last_duration_ms': 0, 'last_run': {}, 'removed': {},
+                      'partitions_created': 0, 'partitions_dropped': 0}
+
+    def stop(self):
+        self._stop.set()
+
+    def _exists(self, cur, table):
+        if table in self._missing:
+            return False
+        cur.execute("SELECT to_regclass('%s') IS NOT NULL" % table.replace("'", "''"))
+        if cur.fetchone()[0]:
+            return True
+        # Таблицы другого проекта (trainer_active_sessions) в этой БД может не быть
+        self._missing.add(table)
+        return False
+
+    def purge(self, conn, cur, table, condition):
+        """Удаляет устаревшие строки пачками по BATCH, не больше MAX_BATCHES пачек за прогон"""
+        removed = 0
+        for _ in range(MAX_BATCHES):
+            cur.execute(PURGE_SQL % (table, table, condition, BATCH))
+            count = cur.rowcount
+            conn.commit()
+            removed += count
+            if count < BATCH or self._stop.is_set():
+                break
+        return removed
+
+    def rotate_partitions(self, conn, cur, table, column, keep_days):
+        """Создаёт секции на DAYS_AHEAD дней вперёд и удаляет секции старше keep_days дней.
+        Возвращает (создано, удалено секций, строк в удалённых секциях по статистике планировщика)"""
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('%s')" % table)
+        row = cur.fetchone()
+        if not row or row[0] != 'p':
+            return 0, 0, 0
+        cur.execute("SELECT CURRENT_DATE")
+        today = cur.fetchone()[0]
+        cur.execute(PARTITIONS_SQL % table)
+        existing = dict(cur.fetchall())
+        conn.commit()
+
+        created = dropped = rows = 0
+        for offset in range(DAYS_AHEAD + 1):
+            day = today + timedelta(days=offset)
+            name = partition_name(table, day)
+            if name in existing:
+                continue
+            params = {'name': name, 'table': table, 'column': column,
+                      'start': day.isoformat(), 'end': (day + timedelta(days=1)).isoformat()}
+            cur.execute("SET LOCAL lock_timeout = %d" % LOCK_TIMEOUT_MS)
+            for sql in CREATE_PARTITION_SQL:
+                cur.execute(sql % params)
+            conn.commit()
+            created += 1
+
+        pattern = re.compile(r'^%s_p(\d{8})$' % re.escape(table))
+        cutoff = partition_name(table, today - timedelta(days=keep_days))
+        for name, estimate in sorted(existing.items()):
+            if pattern.match(name) and name < cutoff:
+                cur.execute("SET LOCAL lock_timeout = %d" % LOCK_TIMEOUT_MS)
+                cur.execute("DROP TABLE %s" % name)
+                conn.commit()
+                dropped += 1
+                rows += estimate
+        return created, dropped, rows
+
+    def run_once(self):
+        """Один прогон обслуживания: {задача: удалено строк} или None, если обслуживает другой воркер"""
+        started = time.monotonic()
+        conn = db_pool.get_connection()
+        report = {}
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_lock(%d)" % MAINTENANCE_LOCK_KEY)
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                self.stats['skipped'] += 1
+                return None
+            try:
+                for table, (column, keep_days) in self.partitioned.items():
+                    try:
+                        created, dropped, rows = self.rotate_partitions(conn, cur, table, column, keep_days)
+                    except Exception as e:
+                        conn.rollback()
+                        self._error('%s partitions: %s' % (table, e))
+                        continue
+                    self.stats['partitions_created'] += created
+                    self.stats['partitions_dropped'] += dropped
+                    if dropped:
+                        report['%s_partitions' % table] = rows
+                for name, table, condition in self.jobs:
+                    if self._stop.is_set():
+                        break
+                    try:
+                        if not self._exists(cur, table):
+                            continue
+                        report[name] = self.purge(conn, cur, table, condition)
+                    except Exception as e:
+                        conn.rollback()
+                        self._error('%s: %s' % (name, e))
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%d)" % MAINTENANCE_LOCK_KEY)
+                conn.commit()
+                cur.close()
+        finally:
+            conn.close()
+        for name, count in report.items():
+            self.stats['removed'][name] = self.stats['removed'].get(name, 0) + count
+        self.stats['runs'] += 1
+        self.stats['last_run'] = report
+        self.stats['last_run_at'] = int(time.time())
+        self.stats['last_duration_ms'] = int((time.monotonic() - started) * 1000)
+        return report
+
+    def _error(self, message):
+        self.stats['errors'] += 1
+        self.stats['last_error'] = message
+        print(f"[WARN] maintenance {message}")
+
+    def snapshot(self):
+        return dict(self.stats, last_run=dict(self.stats['last_run']), removed=dict(self.stats['removed']),
+                    cron=CRON)
+
+
+maintenance = Maintenance()
@@ -0,0 +1,695 @@
+"""
+Матчмейкинг в памяти шлюза.
+Каждый воркер держит зеркало очереди, разложенное по time_control и отсортированное по рейтингу.
+Зеркало обновляется событиями mm_join / mm_seen / mm_leave / mm_match из канала game_events.
+Один воркер (лидер по pg_try_advisory_lock) раз в MM_TICK_MS миллисекунд разбирает на пары
+сразу всю очередь: город → регион → рейтинг ±mm_rating_range → любой соперник
+(на ступени «любой» — и с другим контролем времени).
+Для каждой пары он создаёт партию и рассылает mm_match. Результат забирает POST/GET matchmaking
+на любом воркере без обращения к БД или long-poll GET /api/matchmaking/wait, который будится сразу.
+Пока long-poll открыт, воркер сам шлёт за игрока пачечный mm_seen — отдельные пульсы не нужны.
+Режим MM_PAIRING=sweep (по умолчанию) ищет пары с минимальной суммарной разницей рейтингов
+с бонусами за общий город или регион; greedy — прежний жадный подбор «кто раньше пришёл».
+Окно рейтинга расширяется со временем ожидания, а очередь контроля времени без изменений
+пересчитывается не чаще раза в секунду.
+Большая очередь разбирается срезами по рейтингу не больше MM_PASS_MAX игроков: за тик лидер тратит
+на подбор не больше MM_PAIRING_BUDGET_MS (плюс один срез), остальные срезы ждут следующего тика по кругу.
+Таблица matchmaking_queue остаётся долговременной записью очереди, через неё подтверждается,
+что оба игрока ещё ждут, и из неё очередь перечитывается при смене лидера.
+"""
+import asyncio
+import bisect
+import json
+import os
+import random
+import threading
+import time
+
+import psycopg2
+
+import db_pool
+
+TICK_SECONDS = int(os.environ.get('MM_TICK_MS', '300')) / 1000.0
+PAIRING = os.environ.get('MM_PAIRING', 'sweep')
+# Бонусы в единицах рейтинга: пара из одного города «ближе» на CITY_BONUS очков
+CITY_BONUS = int(os.environ.get('MM_CITY_BONUS', '150'))
+REGION_BONUS = int(os.environ.get('MM_REGION_BONUS', '75'))
+# Каждая секунда ожидания расширяет окно рейтинга и снижает стоимость пары с этим игроком
+RELAX_PER_SECOND = float(os.environ.get('MM_RELAX_PER_SEC', '5'))
+RELAX_MAX = int(os.environ.get('MM_RELAX_MAX', '200'))
+WAIT_WEIGHT = float(os.environ.get('MM_WAIT_WEIGHT', '2'))
+# Подбор за тик: срезы по рейтингу не больше PASS_MAX игроков, новые срезы не начинаются после бюджета.
+# Срез в 2000 игроков sweep разбирает примерно за 45 мс (matchmaker_bench.py)
+PASS_MAX = int(os.environ.get('MM_PASS_MAX', '2000'))
+PAIRING_BUDGET = int(os.environ.get('MM_PAIRING_BUDGET_MS', '100')) / 1000.0
+# Кандидаты в sweep: ближайшие по рейтингу соседи во всей очереди и внутри города/региона
+SWEEP_WINDOW = 4
+LOCAL_WINDOW = 2
+# Очередь без новых игроков пересчитывается только ради расширения окна
+RECHECK_SECONDS = 1.0
+SETTINGS_REFRESH = 30
+RESULT_TTL = 60
+# Только что сведённый игрок не попадает в новую пару, даже если запоздалый mm_join вернул его в очередь
+MATCH_GUARD = 5
+# Выбывших по таймауту пульса удаляем пачками, чтобы mm_leave уместился в pg_notify
+EVICT_BATCH = 100
+# Long-poll: предельное время ожидания и период пульса за открытые соединения (меньше mm_heartbeat_timeout)
+WAIT_MAX_SECONDS = float(os.environ.get('MM_WAIT_MAX', '30'))
+WAIT_HEARTBEAT_SECONDS = 3
+
+STAGES = ('city', 'region', 'rating', 'any')
+
+# Ключ pg_try_advisory_lock лидера: пары составляет только один воркер
+LEADER_LOCK_KEY = 720003
+
+QUEUE_SQL = """SELECT user_id, username, rating, opponent_type, time_control, city, region,
+                      EXTRACT(EPOCH FROM (NOW() - created_at))
+               FROM matchmaking_queue"""
+
+
+def stage_index(stage):
+    return STAGES.index(stage) if stage in STAGES else STAGES.index('rating')
+
+
+def pair_rank(a, b):
+    """Ступень каскада, на которой a согласен играть с b (0 — город, 3 — любой), или None.
+    a['range'] — окно рейтинга a с учётом времени ожидания"""
+    stage = a['stage_idx']
+    if stage <= 0 and a['city'] and a['city'] == b['city']:
+        return 0
+    if stage <= 1 and a['region'] and a['region'] == b['region']:
+        return 1
+    if abs(a['rating'] - b['rating']) <= a['range']:
+        return 2
+    if stage >= 3:
+        return 3
+    return None
+
+
+def mutual_rank(a, b):
+    ra = pair_rank(a, b)
+    if ra is None:
+        return None
+    rb = pair_rank(b, a)
+    if rb is None:
+        return None
+    return max(ra, rb)
+
+
+def greedy_pairs(entries):
+    """Пары по каскаду: кто ждёт дольше, выбирает первым — сначала ближайший по ступени, затем по рейтингу.
+    Соперник ищется в индексах по городу и региону, затем в окрестности по рейтингу."""
+    by_rating = sorted(entries, key=lambda e: e['rating'])
+    ratings = [e['rating'] for e in by_rating]
+    by_city, by_region = {}, {}
+    for e in entries:
+        if e['city']:
+            by_city.setdefault(e['city'], []).append(e)
+        if e['region']:
+            by_region.setdefault(e['region'], []).append(e)
+
+    paired = set()
+    pairs = []
+    for a in sorted(entries, key=lambda e: e['joined_at']):
+        if a['user_id'] in paired:
+            continue
+        best, best_key = None, None
+
+        for pool in (by_city.get(a['city'], ()) if a['city'] else (),
+                     by_region.get(a['region'], ()) if a['region'] else ()):
+            for b in pool:
+                if b is a or b['user_id'] in paired:
+                    continue
+                rank = mutual_rank(a, b)
+                if rank is None:
+                    continue
+                key = (rank, abs(a['rating'] - b['rating']))
+                if best_key is None or key < best_key:
+                    best, best_key = b, key
+            if best is not None:
+                break
+
+        if best is None:
+            # Расходимся от рейтинга a в обе стороны, пока разница не хуже найденного
+            pos = bisect.bisect_left(ratings, a['rating'])
+            lo, hi = pos - 1, pos
+            while lo >= 0 or hi < len(by_rating):
+                d_lo = a['rating'] - ratings[lo] if lo >= 0 else None
+                d_hi = ratings[hi] - a['rating'] if hi < len(by_rating) else None
+                if d_hi is None or (d_lo is not None and d_lo <= d_hi):
+                    b, diff = by_rating[lo], d_lo
+                    lo -= 1
+                else:
+                    b, diff = by_rating[hi], d_hi
+                    hi += 1
+                if best_key is not None and diff > best_key[1]:
+                    break
+                if b is a or b['user_id'] in paired:
+                    continue
+                rank = mutual_rank(a, b)
+                if rank is None:
+                    if diff > a['range'] and a['stage_idx'] < 3:
+                        break
+                    continue
+                key = (rank, diff)
+                if best_key is None or key < best_key:
+                    best, best_key = b, key
+
+        if best is not None:
+            paired.add(a['user_id'])
+            paired.add(best['user_id'])
+            pairs.append((a, best, STAGES[best_key[0]]))
+    return pairs
+
+
+def rating_slices(entries, after=None, size=PASS_MAX):
+    """Очередь в порядке рейтинга, разбитая на почти равные срезы не больше size игроков.
+    Обход начинается с первого рейтинга выше after (где остановился прошлый тик) и идёт по кругу"""
+    order = sorted(entries, key=lambda e: e['rating'])
+    n = len(order)
+    if n <= size:
+        return [order]
+    if after is not None:
+        start = bisect.bisect_right([e['rating'] for e in order], after)
+        order = order[start:] + order[:start]
+    step = -(-n // -(-n // size))
+    return [order[k:k + step] for k in range(0, n, step)]
+
+
+def sweep_pairs(entries):
+    """Пары с минимальной суммарной стоимостью: |разница рейтингов| − бонус за город/регион − бонус за ожидание.
+    Кандидаты — SWEEP_WINDOW соседей в порядке рейтинга, LOCAL_WINDOW соседей внутри города и региона
+    и соседние игроки на ступени «любой»; рёбра сортируются по стоимости и берутся, пока оба конца свободны.
+    Оставшихся без пары добирает greedy_pairs. Проверки pair_rank развёрнуты ради скорости.
+    Замер matchmaker_bench.py: 1000 игроков — ~22 мс, 5000 — ~120 мс, 10000 — ~270 мс (greedy — 7 / 90 / 390 мс),
+    поэтому тик отдаёт сюда срезы не больше PASS_MAX, а не всю очередь."""
+    order = sorted(entries, key=lambda e: e['rating'])
+    n = len(order)
+    rating = [e['rating'] for e in order]
+    stage = [e['stage_idx'] for e in order]
+    city = [e['city'] for e in order]
+    region = [e['region'] for e in order]
+    rng = [e['range'] for e in order]
+    wait = [WAIT_WEIGHT * e['wait'] for e in order]
+    max_range = max(rng)
+
+    # Кандидаты кодируются числом i * n + j (i < j), чтобы дубликаты из разных окон схлопнулись в множестве
+    candidates = set()
+    groups = {}
+    for i in range(n):
+        r, limit = rating[i], max_range if stage[i] < 3 else None
+        for j in range(i + 1, min(n, i + 1 + SWEEP_WINDOW)):
+            # Дальше окна рейтинга i согласен только на ступени «любой»; город и регион — в группах ниже
+            if limit is not None and rating[j] - r > limit:
+                break
+            candidates.add(i * n + j)
+        if city[i]:
+            groups.setdefault(('city', city[i]), []).append(i)
+        elif region[i]:
+            groups.setdefault(('region', region[i]), []).append(i)
+        if stage[i] >= 3:
+            groups.setdefault(('any',), []).append(i)
+    for members in groups.values():
+        for k in range(len(members) - 1):
+            i = members[k]
+            for j in members[k + 1:k + 1 + LOCAL_WINDOW]:
+                candidates.add(i * n + j)
+
+    edges = []
+    for key in candidates:
+        i, j = divmod(key, n)
+        diff = rating[j] - rating[i]
+        same_city = city[i] and city[i] == city[j]
+        same_region = region[i] and region[i] == region[j]
+        # Ступень, на которой согласны оба (как в mutual_rank)
+        rank = 0
+        for st, rr in ((stage[i], rng[i]), (stage[j], rng[j])):
+            if st <= 0 and same_city:
+                continue
+            if st <= 1 and same_region:
+                if rank < 1:
+                    rank = 1
+            elif diff <= rr:
+                if rank < 2:
+                    rank = 2
+            elif st >= 3:
+                rank = 3
+            else:
+                rank = None
+                break
+        if rank is None:
+            continue
+        if same_city:
+            diff -= CITY_BONUS
+        elif same_region:
+            diff -= REGION_BONUS
+        edges.append((diff - wait[i] - wait[j], i, j, rank))
+
+    edges.sort()
+    taken = [False] * n
+    pairs = []
+    for _, i, j, rank in edges:
+        if taken[i] or taken[j]:
+            continue
+        taken[i] = taken[j] = True
+        pairs.append((order[i], order[j], STAGES[rank]))
+    # Кому не хватило соседей в окнах, достаются жадному подбору — их обычно единицы процентов
+    rest = [order[i] for i in range(n) if not taken[i]]
+    if len(rest) > 1:
+        pairs.extend(greedy_pairs(rest))
+    return pairs
+
+
+class Matchmaker:
+    def __init__(self, tick=TICK_SECONDS):
+        self.tick = tick
+        self._queue = {}
+        self._results = {}
+        self._matched_at = {}
+        self._versions = {}
+        self._checked = {}
+        self._cursor = {}
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._heartbeat_thread = None
+        self._dsn = None
+        self._lock_conn = None
+        self.leader = False
+        self.game_factory = None
+        self.settings = {'mm_rating_range': 50, 'mm_heartbeat_timeout': 10}
+        self._settings_at = 0.0
+        self.is_live = lambda: False
+        self.stats = {'ticks': 0, 'pairs': 0, 'conflicts': 0, 'evicted': 0, 'errors': 0,
+                      'skipped': 0, 'last_error': None, 'last_tick_ms': 0.0, 'last_pairing_ms': 0.0,
+                      'waits': 0, 'wait_matched': 0, 'passes': 0, 'deferred': 0}
+
+    # --- зеркало очереди (все воркеры) ---
+
+    def _entry(self, data, joined_at=None):
+        now = time.monotonic()
+        stage = data.get('stage') or 'rating'
+        return {
+            'user_id': data['user_id'], 'username': data.get('username') or 'Player',
+            'rating': int(data.get('rating') or 1200), 'opponent_type': data.get('opponent_type') or 'country',
+            'time_control': data.get('time_control') or 'rapid',
+            'city': data.get('city') or '', 'region': data.get('region') or '',
+            'stage_idx': stage_index(stage), 'joined_at': joined_at if joined_at is not None else now,
+            'last_seen': now,
+        }
+
+    def _touch(self, time_control):
+        """Очередь контроля времени изменилась — на следующем тике её нужно разобрать заново"""
+        self._versions[time_control] = self._versions.get(time_control, 0) + 1
+
+    def _remove(self, user_id):
+        entry = self._queue.pop(user_id, None)
+        if entry:
+            self._touch(entry['time_control'])
+
+    def apply_event(self, event):
+        etype = event.get('type')
+        if etype not in ('mm_join', 'mm_seen', 'mm_leave', 'mm_match'):
+            return
+        now = time.monotonic()
+        with self._lock:
+            if etype == 'mm_join':
+                current = self._queue.get(event['user_id'])
+                joined_at = current['joined_at'] if current else None
+                if current:
+                    self._touch(current['time_control'])
+                entry = self._queue[event['user_id']] = self._entry(event, joined_at)
+                self._touch(entry['time_control'])
+            elif etype == 'mm_seen':
+                for uid in event.get('user_ids') or (event['user_id'],):
+                    entry = self._queue.get(uid)
+                    if entry:
+                        entry['last_seen'] = now
+                stage = stage_index(event['stage']) if event.get('stage') in STAGES else 0
+                entry = self._queue.get(event.get('user_id'))
+                if entry and stage > entry['stage_idx']:
+                    entry['stage_idx'] = stage
+                    self._touch(entry['time_control'])
+            elif etype == 'mm_leave':
+                for uid in event.get('user_ids') or (event['user_id'],):
+                    self._remove(uid)
+            else:
+                woken = []
+                for color in ('white', 'black'):
+                    player = event[color]
+                    self._remove(player['user_id'])
+                    self._results[player['user_id']] = (now + RESULT_TTL, event)
+                    self._matched_at[player['user_id']] = now
+                    woken.extend(self._waiters.get(player['user_id'], ()))
+                for loop, future in woken:
+                    loop.call_soon_threadsafe(_wake, future)
+            if len(self._results) > 1000:
+                for uid, (expires_at, _) in list(self._results.items()):
+                    if expires_at <= now:
+                        del self._results[uid]
+                for uid, matched_at in list(self._matched_at.items()):
+                    if now - matched_at >= MATCH_GUARD:
+                        del self._matched_at[uid]
+
+    def in_queue(self, user_id):
+        with self._lock:
+            return user_id in self._queue
+
+    def queue_count(self, time_control):
+        with self._lock:
+            return sum(1 for e in self._queue.values() if e['time_control'] == time_control)
+
+    def result_for(self, user_id, pop=False):
+        """Найденная пара для игрока: ответ в формате POST matchmaking (status matched) или None"""
+        with self._lock:
+            item = self._results.get(user_id)
+            if item is None or item[0] <= time.monotonic():
+                return None
+            if pop:
+                del self._results[user_id]
+        event = item[1]
+        color = 'white' if event['white']['user_id'] == user_id else 'black'
+        opponent = event['black' if color == 'white' else 'white']
+        return {
+            'status': 'matched', 'game_id': event['game_id'], 'player_color': color,
+            'opponent_name': opponent['username'], 'opponent_rating': opponent['rating'],
+            'opponent_avatar': opponent.get('avatar') or '', 'matched_stage': event['matched_stage'],
+            'time_control': event['time_control'],
+        }
+
+    async def wait_for_match(self, user_id, timeout):
+        """Ждёт пару для игрока из очереди не дольше timeout секунд; вызывается из event loop шлюза"""
+        found = self.result_for(user_id, pop=True)
+        if found or not self.in_queue(user_id):
+            return found
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            # Пара могла появиться между проверкой выше и регистрацией — тогда ждать нечего
+            if user_id in self._results:
+                waiter[1].set_result(True)
+            self._waiters.setdefault(user_id, []).append(waiter)
+            self.stats['waits'] += 1
+        try:
+            await asyncio.wait_for(waiter[1], min(timeout, WAIT_MAX_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(user_id)
+                if waiters and waiter in waiters:
+                    waiters.remove(waiter)
+                if not waiters:
+                    self._waiters.pop(user_id, None)
+        found = self.result_for(user_id, pop=True)
+        if found:
+            self.stats['wait_matched'] += 1
+        return found
+
+    def _heartbeat_forever(self):
+        """Открытый long-poll — пульс игрока: раз в WAIT_HEARTBEAT_SECONDS обновляем last_heartbeat
+        и шлём mm_seen за всех ждущих"""
+        while not self._stop.wait(WAIT_HEARTBEAT_SECONDS):
+            with self._lock:
+                waiting = [uid for uid in self._waiters if uid in self._queue]
+            if not waiting:
+                continue
+            try:
+                conn = db_pool.get_connection()
+                try:
+                    cur = conn.cursor()
+                    for i in range(0, len(waiting), EVICT_BATCH):
+                        batch = waiting[i:i + EVICT_BATCH]
+                        # Строка очереди тоже должна видеть пульс: иначе её сочтут устаревшей хендлер
+                        # matchmaking (mm_heartbeat_timeout) и чистка maintenance
+                        cur.execute("UPDATE matchmaking_queue SET last_heartbeat = NOW() WHERE user_id IN (%s)"
+                                    % ','.join("'%s'" % uid.replace("'", "''") for uid in batch))
+                        event = {'type': 'mm_seen', 'user_ids': batch}
+                        cur.execute("SELECT pg_notify('game_events', '%s')" % json.dumps(event).replace("'", "''"))
+                    conn.commit()
+                    cur.close()
+                finally:
+                    conn.close()
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+                print(f"[WARN] matchmaker heartbeat: {e}")
+                continue
+            self.apply_event({'type': 'mm_seen', 'user_ids': waiting})
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, leader=self.leader, queued=len(self._queue),
+                        results=len(self._results), waiting=len(self._waiters), live=self.is_live())
+
+    # --- лидер: составление пар ---
+
+    def start(self, dsn):
+        self._dsn = dsn
+        self._thread = threading.Thread(target=self._run, name='matchmaker', daemon=True)
+        self._thread.start()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_forever, name='matchmaker-heartbeat', daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _try_lead(self):
+        conn = psycopg2.connect(self._dsn)
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%d)" % LEADER_LOCK_KEY)
+        if not cur.fetchone()[0]:
+            conn.close()
+            return False
+        self._lock_conn = conn
+        self.leader = True
+        self._reload_queue()
+        return True
+
+    def _release_lead(self):
+        self.leader = False
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.close()
+            except Exception:
+                pass
+            self._lock_conn = None
+
+    def _reload_queue(self):
+        """Новый лидер перечитывает очередь из таблицы: события до его избрания могли пройти мимо"""
+        conn = db_pool.get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(QUEUE_SQL)
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+        now = time.monotonic()
+        with self._lock:
+            known = self._queue
+            self._queue = {}
+            for row in rows:
+                old = known.get(row[0])
+                entry = self._entry({'user_id': row[0], 'username': row[1], 'rating': row[2],
+                                     'opponent_type': row[3], 'time_control': row[4],
+                                     'city': row[5], 'region': row[6]},
+                                    joined_at=now - float(row[7] or 0))
+                if old:
+                    entry['stage_idx'] = old['stage_idx']
+                    entry['last_seen'] = old['last_seen']
+                self._queue[row[0]] = entry
+                self._touch(entry['time_control'])
+
+    def _refresh_settings(self, cur):
+        if time.monotonic() - self._settings_at < SETTINGS_REFRESH:
+            return
+        cur.execute("SELECT key, value FROM site_settings WHERE key LIKE 'mm_%'")
+        for key, value in cur.fetchall():
+            try:
+                self.settings[key] = int(value)
+            except (TypeError, ValueError):
+                pass
+        self._settings_at = time.monotonic()
+
+    def make_pairs(self, entries):
+        if PAIRING == 'greedy':
+            return greedy_pairs(entries)
+        return sweep_pairs(entries)
+
+    def tick_once(self):
+        started = time.monotonic()
+        conn = db_pool.get_connection()
+        try:
+            cur = conn.cursor()
+            self._refresh_settings(cur)
+            timeout = self.settings.get('mm_heartbeat_timeout', 10)
+            rating_range = self.settings.get('mm_rating_range', 50)
+
+            with self._lock:
+                now = time.monotonic()
+                stale = [uid for uid, e in self._queue.items() if now - e['last_seen'] > timeout]
+                for uid in stale:
+                    self._remove(uid)
+                due = set()
+                for time_control, version in self._versions.items():
+                    checked = self._checked.get(time_control)
+                    if checked is None or checked[0] != version or now - checked[1] >= RECHECK_SECONDS:
+                        due.add(time_control)
+                        self._checked[time_control] = (version, now)
+                buckets = {}
+                for entry in self._queue.values():
+                    if entry['time_control'] not in due:
+                        continue
+                    matched_at = self._matched_at.get(entry['user_id'])
+                    if matched_at is not None and now - matched_at < MATCH_GUARD:
+                        continue
+                    item = dict(entry)
+                    item['wait'] = now - entry['joined_at']
+                    item['range'] = rating_range + min(RELAX_MAX, RELAX_PER_SECOND * item['wait'])
+                    buckets.setdefault(entry['time_control'], []).append(item)
+                self.stats['skipped'] += len(self._versions) - len(due)
+
+            for i in range(0, len(stale), EVICT_BATCH):
+                batch = stale[i:i + EVICT_BATCH]
+                cur.execute("DELETE FROM matchmaking_queue WHERE user_id IN (%s)"
+                            % ','.join("'%s'" % uid.replace("'", "''") for uid in batch))
+                event = {'type': 'mm_leave', 'user_ids': batch}
+                cur.execute("SELECT pg_notify('game_events', '%s')" % json.dumps(event).replace("'", "''"))
+                conn.commit()
+                self.stats['evicted'] += len(batch)
+
+            pairing_started = time.monotonic()
+            deadline = pairing_started + PAIRING_BUDGET
+            matches, rest, passes = [], [], 0
+            for time_control, entries in buckets.items():
+                if len(entries) < 2:
+                    continue
+                slices = rating_slices(entries, self._cursor.get(time_control))
+                for k, chunk in enumerate(slices):
+                    if passes and time.monotonic() >= deadline:
+                        # Необработанные срезы — в следующий тик, с рейтинга, на котором остановились
+                        self.stats['deferred'] += len(slices) - k
+                        with self._lock:
+                            self._checked.pop(time_control, None)
+                        break
+                    passes += 1
+                    paired = set()
+                    for first, second, stage in self.make_pairs(chunk):
+                        matches.append((first, second, stage, time_control))
+                        paired.add(first['user_id'])
+                        paired.add(second['user_id'])
+                    rest.extend(e for e in chunk if e['stage_idx'] >= 3 and e['user_id'] not in paired)
+                    self._cursor[time_control] = chunk[-1]['rating']
+                else:
+                    self._cursor.pop(time_control, None)
+            # Ступень «любой» не ограничена контролем времени: оставшихся без пары сводим между очередями,
+            # партия идёт по контролю того, кто ждёт дольше; дольше всех ждущие — первыми
+            if len(rest) > 1:
+                rest.sort(key=lambda e: e['joined_at'])
+                for first, second, stage in self.make_pairs(rest[:PASS_MAX]):
+                    longer = first if first['wait'] >= second['wait'] else second
+                    matches.append((first, second, stage, longer['time_control']))
+            self.stats['passes'] += passes
+            self.stats['last_pairing_ms'] = round((time.monotonic() - pairing_started) * 1000, 2)
+            for first, second, stage, time_control in matches:
+                self._create_match(cur, conn, first, second, stage, time_control)
+            cur.close()
+        finally:
+            conn.close()
+        self.stats['ticks'] += 1
+        self.stats['last_tick_ms'] = round((time.monotonic() - started) * 1000, 2)
+
+    def _create_match(self, cur, conn, first, second, stage, time_control):
+        # Строки очереди — подтверждение: если кто-то успел выйти из поиска, пары нет
+        cur.execute(
+            "DELETE FROM matchmaking_queue WHERE user_id IN ('%s', '%s') RETURNING user_id, avatar"
+            % (first['user_id'].replace("'", "''"), second['user_id'].replace("'", "''"))
+        )
+        avatars = dict(cur.fetchall())
+        if len(avatars) != 2:
+            conn.rollback()
+            self.stats['conflicts'] += 1
+            with self._lock:
+                for entry in (first, second):
+                    if entry['user_id'] not in avatars:
+                        self._queue.pop(entry['user_id'], None)
+            return
+        white, black = (first, second) if random.random() < 0.5 else (second, first)
+        players = {}
+        for color, entry in (('white', white), ('black', black)):
+            players[color] = {'user_id': entry['user_id'], 'username': entry['username'],
+                              'rating': entry['rating'], 'avatar': avatars.get(entry['user_id']) or ''}
+        game_id = self.game_factory(cur, players['white'], players['black'], time_control, first['opponent_type'])
+        event = {'type': 'mm_match', 'game_id': game_id, 'time_control': time_control, 'matched_stage': stage,
+                 'white': dict(players['white'], avatar=''), 'black': dict(players['black'], avatar='')}
+        cur.execute("SELECT pg_notify('game_events', '%s')" % json.dumps(event).replace("'", "''"))
+        conn.commit()
+        self.stats['pairs'] += 1
+        event['white']['avatar'] = players['white']['avatar']
+        event['black']['avatar'] = players['black']['avatar']
+        self.apply_event(event)
+
+    def _run(self):
+        last_check = 0.0
+        while not self._stop.is_set():
+            try:
+                if not self.leader:
+                    if self.game_factory is None or not self._try_lead():
+                        self._stop.wait(2)
+                        continue
+                if time.monotonic() - last_check > 5:
+                    lock_cur = self._lock_conn.cursor()
+                    lock_cur.execute('SELECT 1')
+                    lock_cur.close()
+                    last_check = time.monotonic()
+                self.tick_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+                print(f"[WARN] matchmaker: {e}")
+                if self._lock_conn is None or self._lock_conn.closed:
+                    self._release_lead()
+                self._stop.wait(1)
+                continue
+            self._stop.wait(self.tick)
+        self._release_lead()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(True)
+
+
+matchmaker = Matchmaker()
+
+
+def is_live():
+    return matchmaker.is_live() and matchmaker.game_factory is not None
+
+
+def set_game_factory(fn):
+    """fn(cur, white, black, time_control, opponent_type) -> game_id; регистрирует хендлер matchmaking"""
+    matchmaker.game_factory = fn
+
+
+def apply_event(event):
+    matchmaker.apply_event(event)
+
+
+def in_queue(user_id):
+    return matchmaker.in_queue(user_id)
+
+
+def queue_count(time_control):
+    return matchmaker.queue_count(time_control)
+
+
+def result_for(user_id, pop=False):
+    return matchmaker.result_for(user_id, pop)
+
+
+async def wait_for_match(user_id, timeout):
+    return await matchmaker.wait_for_match(user_id, timeout)
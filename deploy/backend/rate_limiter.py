@@ -0,0 +1,260 @@
+"""
+Ограничение частоты запросов к функциям в памяти шлюза.
+Скользящее окно из двух счётчиков: оценка = счётчик прошлого окна × доля его перекрытия + текущий счётчик.
+Окна выровнены по часам (начало = время // длина окна), поэтому у всех воркеров они совпадают.
+Лимиты объявлены здесь, в LIMITS, и переопределяются переменными RATE_LIMIT_<ИМЯ>=запросов/секунд.
+RATE_LIMIT_BACKEND=postgres включает общий счёт для нескольких воркеров: раз в RATE_LIMIT_SYNC секунд
+приросты пачкой прибавляются к UNLOGGED-таблице rate_limit_counters, а в ответ приходят общие
+счётчики окон. Между синхронизациями каждый воркер считает сам.
+Шлюз проверяет лимиты middleware до чтения тела запроса (check_request); тогда check_rate_limit
+хендлеров уже ничего не считает. Хендлеры в serverless-среде этого модуля не видят и по-прежнему
+пишут в таблицу rate_limits.
+"""
+import os
+import threading
+import time
+
+import db_pool
+
+BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+SYNC_INTERVAL = float(os.environ.get('RATE_LIMIT_SYNC', '1'))
+SWEEP_INTERVAL = 60
+CLEANUP_INTERVAL = 300
+CLEANUP_BATCH = 5000
+
+# Ключ pg_try_advisory_xact_lock для очистки rate_limit_counters: из нескольких воркеров чистит один
+CLEANUP_LOCK_KEY = 720004
+
+# Функция → (запросов, окно в секундах)
+LIMITS = {
+    'admin-auth': (5, 60),
+    'apply-daily-decay': (5, 60),
+    'chat': (30, 60),
+    'finish-game': (10, 60),
+    'friends': (20, 60),
+    'invite-game': (20, 60),
+    'matchmaking': (20, 60),
+    'online-move': (60, 60),
+    'rating-settings': (10, 60),
+    'send-otp': (3, 300),
+    'site-settings': (10, 60),
+    'user-check': (10, 60),
+    'verify-otp': (10, 60),
+}
+
+# Методы, которые ограничивают хендлеры; функции, которых здесь нет, ограничены по всем методам
+LIMITED_METHODS = {
+    'chat': ('POST',),
+    'friends': ('POST',),
+    'invite-game': ('POST',),
+    'matchmaking': ('POST',),
+    'online-move': ('POST',),
+    'rating-settings': ('PUT',),
+    'site-settings': ('PUT',),
+    'user-check': ('POST',),
+}
+
+FLUSH_SQL = """INSERT INTO rate_limit_counters (endpoint, ip_address, window_start, request_count) VALUES %s
+ON CONFLICT (endpoint, ip_address, window_start)
+DO UPDATE SET request_count = rate_limit_counters.request_count + EXCLUDED.request_count
+RETURNING endpoint, ip_address, window_start, request_count"""
+
+# Таблицу rate_limits хендлеров чистит maintenance.py, удаляя старые дневные секции
+CLEANUP_SQL = ("DELETE FROM rate_limit_counters WHERE ctid IN (SELECT ctid FROM rate_limit_counters "
+               "WHERE window_start < %d LIMIT %d)")
+
+
+def load_limits():
+    limits = dict(LIMITS)
+    for key, value in os.environ.items():
+        if not key.startswith('RATE_LIMIT_') or '/' not in value:
+            continue
+        name = key[len('RATE_LIMIT_'):].lower().replace('_', '-')
+        try:
+            max_requests, window = value.split('/', 1)
+            limits[name] = (int(max_requests), int(window))
+        except ValueError:
+            print(f"[WARN] rate limit {key}={value}: expected <requests>/<seconds>")
+    return limits
+
+
+def _esc(val):
+    return str(val).replace("'", "''")
+
+
+class RateLimiter:
+    def __init__(self, limits=None, backend=BACKEND):
+        self.limits = limits if limits is not None else load_limits()
+        self.backend = backend
+        # (endpoint, ip) → [начало окна, общий счёт окна, ещё не отправленный прирост, итог прошлого окна]
+        self._counters = {}
+        self._dirty = set()
+        self._pending_closed = []
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+        self.gateway_enforced = False
+        self.rejected_by_endpoint = {}
+        self.stats = {'allowed': 0, 'rejected': 0, 'flushes': 0, 'flush_errors': 0, 'last_flush_error': None,
+                      'cleaned': 0}
+
+    def limit_for(self, endpoint, default=None):
+        return self.limits.get(endpoint, default)
+
+    def is_limited(self, endpoint, ip, max_requests=None, window_seconds=None):
+        """True, если запрос нужно отклонить; разрешённый запрос сразу учитывается.
+        max_requests/window_seconds — лимит хендлера на случай, если функции нет в LIMITS"""
+        limit = self.limits.get(endpoint)
+        if limit is None:
+            if max_requests is None:
+                return False
+            limit = (max_requests, window_seconds)
+        max_requests, window = limit
+        now = time.time()
+        window_start = int(now // window) * window
+        key = (endpoint, ip)
+        with self._lock:
+            if now - self._last_sweep > SWEEP_INTERVAL:
+                self._sweep(now)
+            state = self._counters.get(key)
+            if state is None:
+                state = self._counters[key] = [window_start, 0, 0, 0]
+            elif state[0] != window_start:
+                previous = state[1] + state[2] if state[0] == window_start - window else 0
+                if state[2] and self.backend == 'postgres':
+                    # Прирост закрытого окна всё равно уйдёт в общий счёт при синхронизации
+                    self._pending_closed.append((endpoint, ip, state[0], state[2]))
+                state[:] = [window_start, 0, 0, previous]
+            weight = 1.0 - (now - window_start) / window
+            if state[3] * weight + state[1] + state[2] >= max_requests:
+                self.stats['rejected'] += 1
+                self.rejected_by_endpoint[endpoint] = self.rejected_by_endpoint.get(endpoint, 0) + 1
+                return True
+            state[2] += 1
+            if self.backend == 'postgres':
+                self._dirty.add(key)
+            self.stats['allowed'] += 1
+        return False
+
+    def check_request(self, endpoint, method, ip):
+        """Проверка в middleware шлюза: (отклонить ли, Retry-After в секундах)"""
+        limit = self.limits.get(endpoint)
+        if limit is None or method == 'OPTIONS':
+            return False, 0
+        methods = LIMITED_METHODS.get(endpoint)
+        if methods is not None and method not in methods:
+            return False, 0
+        if not self.is_limited(endpoint, ip):
+            return False, 0
+        window = limit[1]
+        return True, max(1, int(window - time.time() % window))
+
+    def _sweep(self, now):
+        longest = max([window for _, window in self.limits.values()] or [60])
+        for key, state in list(self._counters.items()):
+            if state[0] < now - 2 * longest and key not in self._dirty:
+                del self._counters[key]
+        self._last_sweep = now
+
+    # --- общий счёт в PostgreSQL ---
+
+    def start(self):
+        if self.backend != 'postgres':
+            return
+        self._thread = threading.Thread(target=self._sync_forever, name='rate-limit-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def flush_once(self):
+        with self._lock:
+            rows = list(self._pending_closed)
+            self._pending_closed = []
+            for key in self._dirty:
+                state = self._counters.get(key)
+                if state and state[2]:
+                    rows.append((key[0], key[1], state[0], state[2]))
+                    state[1] += state[2]
+                    state[2] = 0
+            self._dirty.clear()
+        if not rows:
+            return 0
+        conn = db_pool.get_connection()
+        try:
+            cur = conn.cursor()
+            values = ','.join("('%s', '%s', %d, %d)" % (_esc(endpoint), _esc(ip), window_start, count)
+                              for endpoint, ip, window_start, count in rows)
+            cur.execute(FLUSH_SQL % values)
+            totals = cur.fetchall()
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            with self._lock:
+                # Не потерять приросты: вернём их в текущие окна, если те ещё не сменились
+                for endpoint, ip, window_start, count in rows:
+                    state = self._counters.get((endpoint, ip))
+                    if state and state[0] == window_start:
+                        state[1] -= count
+                        state[2] += count
+                        self._dirty.add((endpoint, ip))
+            raise
+        finally:
+            conn.close()
+        with self._lock:
+            for endpoint, ip, window_start, total in totals:
+                state = self._counters.get((endpoint, ip))
+                if state and state[0] == window_start and total > state[1]:
+                    state[1] = total
+            self.stats['flushes'] += 1
+        return len(rows)
+
+    def cleanup_once(self):
+        longest = max([window for _, window in self.limits.values()] or [60])
+        conn = db_pool.get_connection()
+        removed = 0
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_xact_lock(%d)" % CLEANUP_LOCK_KEY)
+            if cur.fetchone()[0]:
+                cur.execute(CLEANUP_SQL % (int(time.time()) - 2 * longest, CLEANUP_BATCH))
+                removed += cur.rowcount
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        self.stats['cleaned'] += removed
+        return removed
+
+    def _sync_forever(self):
+        last_cleanup = time.monotonic()
+        while not self._stop.wait(SYNC_INTERVAL):
+            try:
+                self.flush_once()
+                if time.monotonic() - last_cleanup > CLEANUP_INTERVAL:
+                    last_cleanup = time.monotonic()
+                    self.cleanup_once()
+            except Exception as e:
+                self.stats['flush_errors'] += 1
+                self.stats['last_flush_error'] = str(e)
+                print(f"[WARN] rate limit sync: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, backend=self.backend, keys=len(self._counters),
+                        gateway_enforced=self.gateway_enforced, rejected_by_endpoint=dict(self.rejected_by_endpoint))
+
+
+limiter = RateLimiter()
+
+
+def is_limited(endpoint, ip, max_requests=None, window_seconds=None):
+    """Вызов из check_rate_limit хендлера; если лимит уже проверил middleware шлюза, повторно не считаем"""
+    if limiter.gateway_enforced and endpoint in limiter.limits:
+        return False
+    return limiter.is_limited(endpoint, ip, max_requests, window_seconds)
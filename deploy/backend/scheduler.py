@@ -0,0 +1,306 @@
+"""
+Планировщик периодических задач шлюза вместо внешнего cron и служебных HTTP-вызовов.
+Задачи регистрируются с cron-выражением из пяти полей (минута час день месяц день_недели),
+время считается по SCHEDULER_TZ_HOURS (по умолчанию +3, МСК). Хендлеры регистрируют свои задачи
+при импорте (register), если модуль доступен, как matchmaking регистрирует фабрику партий.
+Задачи выполняет один воркер — лидер по pg_try_advisory_lock на отдельном соединении.
+Каждый запуск сначала записывается в scheduler_runs с уникальным (job, scheduled_for), поэтому
+смена лидера не приводит к повторному запуску. Новый лидер догоняет пропущенные запуски:
+из пропущенных выполняется только последний, если он не старше catchup секунд задачи.
+К моменту запуска добавляется случайная задержка до jitter секунд.
+Задачи с every_worker=True (прогрев кэшей в памяти) выполняет каждый воркер, без лидера и истории.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+import db_pool
+
+TZ = timezone(timedelta(hours=int(os.environ.get('SCHEDULER_TZ_HOURS', '3'))))
+TICK_SECONDS = 1.0
+DEFAULT_CATCHUP = 86400
+RESULT_MAX_CHARS = 2000
+
+# Ключ pg_try_advisory_lock лидера: задачи запускает только один воркер
+LEADER_LOCK_KEY = 720006
+
+# Поле cron → (минимум, максимум)
+FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+CLAIM_SQL = """INSERT INTO scheduler_runs (job, scheduled_for, started_at, status, worker)
+VALUES ('%s', '%s', NOW(), 'running', '%s')
+ON CONFLICT (job, scheduled_for) DO NOTHING
+RETURNING id"""
+
+FINISH_SQL = "UPDATE scheduler_runs SET finished_at = NOW(), status = '%s', result = '%s' WHERE id = %d"
+
+LAST_RUNS_SQL = "SELECT job, MAX(scheduled_for) FROM scheduler_runs GROUP BY job"
+
+
+def _esc(val):
+    return str(val).replace("'", "''")
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError('cron step must be positive: %s' % text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError('cron value out of range %d-%d: %s' % (low, high, text))
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """Разобранное cron-выражение: next_after(dt) — первая подходящая минута строго после dt"""
+
+    def __init__(self, expr):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError('cron expression needs 5 fields: %s' % expr)
+        self.expr = expr
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(part, low, high) for part, (low, high) in zip(parts, FIELDS))
+        self.weekdays = {d % 7 for d in weekdays}
+        # Как в cron: если ограничены и день месяца, и день недели, подходит любой из них
+        self.any_day = parts[2] != '*' and parts[4] != '*'
+
+    def _day_matches(self, dt):
+        day_ok = dt.day in self.days
+        weekday_ok = (dt.weekday() + 1) % 7 in self.weekdays
+        return day_ok or weekday_ok if self.any_day else day_ok and weekday_ok
+
+    def next_after(self, dt):
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 4)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError('cron expression never fires: %s' % self.expr)
+
+    def latest_until(self, start, now):
+        """Последнее срабатывание в (start, now] или None"""
+        latest = None
+        t = self.next_after(start)
+        while t <= now:
+            latest = t
+            t = self.next_after(t)
+        return latest
+
+
+class Job:
+    def __init__(self, name, cron, fn, jitter=0, catchup=DEFAULT_CATCHUP, every_worker=False):
+        self.name = name
+        self.cron = Cron(cron)
+        self.fn = fn
+        self.jitter = jitter
+        self.catchup = catchup
+        self.every_worker = every_worker
+        self.scheduled_for = None
+        self.fire_at = None
+        self.stats = {'runs': 0, 'failures': 0, 'skipped': 0, 'last_status': None, 'last_error': None,
+                      'last_scheduled_for': None, 'last_duration_ms': 0}
+
+    def plan(self, now, last_run=None):
+        """Выбирает ближайший запуск; пропущенный после last_run запуск выполняется сразу"""
+        slot = None
+        if last_run is not None:
+            missed = self.cron.latest_until(last_run, now)
+            if missed is not None and (now - missed).total_seconds() <= self.catchup:
+                slot = missed
+        if slot is None:
+            slot = self.cron.next_after(now)
+        self.scheduled_for = slot
+        self.fire_at = slot + timedelta(seconds=random.uniform(0, self.jitter)) if self.jitter else slot
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._dsn = None
+        self._lock_conn = None
+        self._worker = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.leader = False
+        self.stats = {'runs': 0, 'failures': 0, 'errors': 0, 'last_error': None}
+
+    def register(self, name, cron, fn, jitter=0, catchup=DEFAULT_CATCHUP, every_worker=False):
+        """fn() -> результат для истории (dict или None); повторная регистрация заменяет задачу"""
+        job = Job(name, cron, fn, jitter, catchup, every_worker)
+        with self._lock:
+            self.jobs[name] = job
+            if self.leader or every_worker:
+                job.plan(datetime.now(TZ))
+        return job
+
+    def start(self, dsn):
+        self._dsn = dsn
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _try_lead(self):
+        conn = psycopg2.connect(self._dsn)
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%d)" % LEADER_LOCK_KEY)
+        if not cur.fetchone()[0]:
+            conn.close()
+            return False
+        cur.execute(LAST_RUNS_SQL)
+        last_runs = {job: scheduled_for.astimezone(TZ) for job, scheduled_for in cur.fetchall() if scheduled_for}
+        cur.close()
+        self._lock_conn = conn
+        now = datetime.now(TZ)
+        with self._lock:
+            for job in self.jobs.values():
+                if not job.every_worker:
+                    job.plan(now, last_runs.get(job.name))
+            self.leader = True
+        return True
+
+    def _release_lead(self):
+        self.leader = False
+        with self._lock:
+            for job in self.jobs.values():
+                if not job.every_worker:
+                    job.fire_at = None
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.close()
+            except Exception:
+                pass
+            self._lock_conn = None
+
+    def run_local(self, job):
+        started = time.monotonic()
+        try:
+            job.fn()
+            job.stats['last_status'] = 'ok'
+        except Exception as e:
+            job.stats['last_status'] = 'failed'
+            job.stats['failures'] += 1
+            job.stats['last_error'] = str(e)[:200]
+            print(f"[WARN] scheduler job {job.name}: {e}")
+        job.stats['runs'] += 1
+        job.stats['last_duration_ms'] = int((time.monotonic() - started) * 1000)
+        job.stats['last_scheduled_for'] = job.scheduled_for.isoformat()
+
+    def run_job(self, job):
+        """Запускает задачу за её текущий слот, если этот слот ещё никто не занял"""
+        if job.every_worker:
+            self.run_local(job)
+            return
+        scheduled_for = job.scheduled_for
+        conn = db_pool.get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(CLAIM_SQL % (_esc(job.name), scheduled_for.isoformat(), _esc(self._worker)))
+            row = cur.fetchone()
+            conn.commit()
+            if not row:
+                job.stats['skipped'] += 1
+                return
+            run_id = row[0]
+            started = time.monotonic()
+            try:
+                result = job.fn()
+                status, text = 'ok', json.dumps(result, ensure_ascii=False, default=str)
+            except Exception as e:
+                status, text = 'failed', str(e)
+                print(f"[WARN] scheduler job {job.name}: {e}")
+            job.stats['last_duration_ms'] = int((time.monotonic() - started) * 1000)
+            cur.execute(FINISH_SQL % (status, _esc(text[:RESULT_MAX_CHARS]), run_id))
+            conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        job.stats['runs'] += 1
+        job.stats['last_status'] = status
+        job.stats['last_scheduled_for'] = scheduled_for.isoformat()
+        self.stats['runs'] += 1
+        if status == 'failed':
+            job.stats['failures'] += 1
+            job.stats['last_error'] = text[:200]
+            self.stats['failures'] += 1
+
+    def tick_once(self):
+        now = datetime.now(TZ)
+        with self._lock:
+            due = [job for job in self.jobs.values() if job.fire_at is not None and job.fire_at <= now]
+        for job in sorted(due, key=lambda j: j.fire_at):
+            if self._stop.is_set():
+                break
+            try:
+                self.run_job(job)
+            finally:
+                job.plan(datetime.now(TZ), job.scheduled_for)
+
+    def _run(self):
+        last_check = last_attempt = 0.0
+        while not self._stop.is_set():
+            try:
+                if not self.leader and time.monotonic() - last_attempt > 10:
+                    last_attempt = time.monotonic()
+                    self._try_lead()
+                if self.leader and time.monotonic() - last_check > 5:
+                    lock_cur = self._lock_conn.cursor()
+                    lock_cur.execute('SELECT 1')
+                    lock_cur.close()
+                    last_check = time.monotonic()
+                self.tick_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+                print(f"[WARN] scheduler: {e}")
+                if self._lock_conn is None or self._lock_conn.closed:
+                    self._release_lead()
+            self._stop.wait(TICK_SECONDS)
+        self._release_lead()
+
+    def snapshot(self):
+        with self._lock:
+            jobs = {name: dict(job.stats, cron=job.cron.expr,
+                               next_run=job.fire_at.isoformat() if job.fire_at else None)
+                    for name, job in self.jobs.items()}
+        return dict(self.stats, leader=self.leader, jobs=jobs)
+
+
+scheduler = Scheduler()
+
+
+def register(name, cron, fn, jitter=0, catchup=DEFAULT_CATCHUP, every_worker=False):
+    return scheduler.register(name, cron, fn, jitter, catchup, every_worker)
@@ -0,0 +1,176 @@
+"""
+Ретранслятор WebRTC-сигналов и чата онлайн-партий.
+online-move отправляет сигнал через pg_notify('game_events') без записи в таблицу: каждый воркер
+кладёт его в почтовый ящик получателя в памяти (ограниченная очередь с TTL), а подписчики
+WebSocket/SSE получают его сразу. Забранные опросом и отданные подписчику сигналы снимаются
+во всех воркерах событием signal_ack, поэтому клиент, который и слушает, и опрашивает, не получит сигнал дважды.
+Таблица webrtc_signals остаётся запасным путём: для слишком больших сигналов и пока LISTEN не на связи.
+Она разбита на секции по дням, старые секции удаляет maintenance.py.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import db_pool
+
+QUEUE_SIZE = int(os.environ.get('SIGNAL_QUEUE', '64'))
+TTL_SECONDS = float(os.environ.get('SIGNAL_TTL', '120'))
+
+# pg_notify ограничивает полезную нагрузку 8000 байт; крупные SDP уходят в таблицу
+MAX_NOTIFY_BYTES = 7500
+
+
+class SignalRelay:
+    def __init__(self, queue_size=QUEUE_SIZE, ttl=TTL_SECONDS):
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self._boxes = {}
+        self._db_pending = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._prefix = '%d-%d' % (os.getpid(), int(time.time()))
+        self._last_sweep = time.monotonic()
+        self.is_live = lambda: False
+        self.stats = {'relayed': 0, 'delivered': 0, 'expired': 0, 'overflow': 0, 'db_fallback': 0,
+                      'pushed': 0, 'errors': 0, 'last_error': None}
+
+    def next_id(self):
+        return '%s-%d' % (self._prefix, next(self._ids))
+
+    def _box(self, game_id, user_id):
+        key = (game_id, user_id)
+        box = self._boxes.get(key)
+        if box is None:
+            box = self._boxes[key] = OrderedDict()
+        return box
+
+    def _sweep(self, now):
+        for key, box in list(self._boxes.items()):
+            for sig_id, (expires_at, _) in list(box.items()):
+                if expires_at > now:
+                    break
+                del box[sig_id]
+                self.stats['expired'] += 1
+            if not box:
+                del self._boxes[key]
+        for key, expires_at in list(self._db_pending.items()):
+            if expires_at <= now:
+                del self._db_pending[key]
+        self._last_sweep = now
+
+    def store(self, event):
+        """Кладёт сигнал в ящик получателя; повторная доставка того же id игнорируется"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep > self.ttl / 4:
+                self._sweep(now)
+            box = self._box(event['game_id'], event['to'])
+            if event['id'] in box:
+                return
+            box[event['id']] = (now + self.ttl, {'id': event['id'], 'from': event['from'],
+                                                 'type': event['signal_type'], 'data': event['data']})
+            while len(box) > self.queue_size:
+                box.popitem(last=False)
+                self.stats['overflow'] += 1
+            self.stats['relayed'] += 1
+
+    def ack(self, game_id, user_id, ids):
+        with self._lock:
+            box = self._boxes.get((game_id, user_id))
+            if not box:
+                return
+            for sig_id in ids:
+                box.pop(sig_id, None)
+            if not box:
+                del self._boxes[(game_id, user_id)]
+
+    def pushed(self, game_id, user_id, ids):
+        """Сигналы ушли подписчику WebSocket/SSE: снимаем их здесь сразу, а в остальных воркерах —
+        событием signal_ack. Вызывается из пула потоков, после успешной отправки подписчику"""
+        self.ack(game_id, user_id, ids)
+        with self._lock:
+            self.stats['pushed'] += len(ids)
+        event = {'type': 'signal_ack', 'game_id': game_id, 'to': user_id, 'ids': list(ids)}
+        try:
+            conn = db_pool.get_connection()
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT pg_notify('game_events', '%s')" % json.dumps(event).replace("'", "''"))
+                conn.commit()
+                cur.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            # Не снятый в других воркерах сигнал всё равно истечёт через ttl
+            with self._lock:
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+            print(f"[WARN] signal relay ack: {e}")
+
+    def mark_db_pending(self, game_id, user_id):
+        with self._lock:
+            self._db_pending[(game_id, user_id)] = time.monotonic() + self.ttl
+
+    def pop(self, game_id, user_id, limit=20):
+        """Забирает сигналы получателя. Второе значение — нужно ли заглянуть в webrtc_signals"""
+        now = time.monotonic()
+        with self._lock:
+            check_db = self._db_pending.pop((game_id, user_id), None) is not None
+            box = self._boxes.get((game_id, user_id))
+            if not box:
+                return [], check_db
+            signals = []
+            for sig_id, (expires_at, signal) in list(box.items()):
+                del box[sig_id]
+                if expires_at <= now:
+                    self.stats['expired'] += 1
+                    continue
+                signals.append(signal)
+                if len(signals) >= limit:
+                    break
+            if not box:
+                del self._boxes[(game_id, user_id)]
+            self.stats['delivered'] += len(signals)
+        return signals, check_db
+
+    def apply_event(self, event):
+        """Слушатель game_events: сигналы, подтверждения и отметки о сигналах в таблице"""
+        etype = event.get('type')
+        if etype == 'signal':
+            self.store(event)
+        elif etype == 'signal_ack':
+            self.ack(event.get('game_id'), event.get('to'), event.get('ids') or ())
+        elif etype == 'signal_stored':
+            self.stats['db_fallback'] += 1
+            self.mark_db_pending(event.get('game_id'), event.get('to'))
+
+    def snapshot(self):
+        with self._lock:
+            queued = sum(len(box) for box in self._boxes.values())
+            return dict(self.stats, mailboxes=len(self._boxes), queued=queued, live=self.is_live())
+
+
+relay = SignalRelay()
+
+
+def next_id():
+    return relay.next_id()
+
+
+def is_live():
+    return relay.is_live()
+
+
+def store(event):
+    relay.store(event)
+
+
+def pop(game_id, user_id, limit=20):
+    return relay.pop(game_id, user_id, limit)
+
+
+def ack(game_id, user_id, ids):
+    relay.ack(game_id, user_id, ids)
@@ -0,0 +1,117 @@
+"""
+Таблица рейтинга в памяти: дерево Фенвика, Board и LeaderboardIndex без БД.
+"""
+import random
+import unittest
+
+import leaderboard_index
+from leaderboard_index import Board, Fenwick, LeaderboardIndex
+
+
+class FenwickTest(unittest.TestCase):
+    def test_prefix_and_find_match_brute_force(self):
+        rnd = random.Random(5)
+        size = 37
+        counts = [0] * size
+        tree = Fenwick(size)
+        for _ in range(300):
+            i = rnd.randrange(size)
+            delta = 1 if counts[i] == 0 or rnd.random() < 0.7 else -1
+            counts[i] += delta
+            tree.add(i, delta)
+        self.assertEqual(tree.total, sum(counts))
+        for i in range(size + 1):
+            self.assertEqual(tree.prefix(i), sum(counts[:i]))
+        k = 1
+        for i, count in enumerate(counts):
+            for offset in range(1, count + 1):
+                self.assertEqual(tree.find(k), (i, offset))
+                k += 1
+
+
+class BoardTest(unittest.TestCase):
+    def setUp(self):
+        self.board = Board()
+        for user_id, rating in (('a', 1800), ('b', 1500), ('c', 1500), ('d', 1200), ('e', 1500)):
+            self.board.add(user_id, rating)
+
+    def test_rank_counts_ties(self):
+        self.assertEqual(self.board.rank(1800), 1)
+        self.assertEqual(self.board.rank(1500), 2)
+        self.assertEqual(self.board.rank(1200), 5)
+        self.assertEqual(self.board.rank(1900), 1)
+
+    def test_add_is_idempotent(self):
+        self.board.add('a', 1800)
+        self.assertEqual(self.board.tree.total, 5)
+
+    def test_slice_spans_buckets(self):
+        rows = self.board.slice(1, 10)
+        self.assertEqual([rank for rank, _ in rows], [1, 2, 2, 2, 5])
+        self.assertEqual(rows[0][1], 'a')
+        self.assertEqual(sorted(uid for _, uid in rows[1:4]), ['b', 'c', 'e'])
+        self.assertEqual(rows[4][1], 'd')
+        self.assertEqual(self.board.slice(3, 2), rows[2:4])
+        self.assertEqual(self.board.slice(-2, 2), rows[:2])
+        self.assertEqual(self.board.slice(6, 3), [])
+
+    def test_position_matches_slice(self):
+        rows = self.board.slice(1, 10)
+        for position, (_, user_id) in enumerate(rows, 1):
+            rating = {'a': 1800, 'd': 1200}.get(user_id, 1500)
+            self.assertEqual(self.board.position(user_id, rating), position)
+        self.assertIsNone(self.board.position('x', 1500))
+
+    def test_remove_keeps_bucket_consistent(self):
+        self.board.remove('b', 1500)
+        self.board.remove('b', 1500)
+        self.board.remove('x', 1700)
+        self.assertEqual(self.board.tree.total, 4)
+        self.assertEqual(self.board.rank(1200), 4)
+        rows = self.board.slice(1, 10)
+        self.assertEqual(sorted(uid for _, uid in rows), ['a', 'c', 'd', 'e'])
+        for position, (_, user_id) in enumerate(rows, 1):
+            rating = {'a': 1800, 'd': 1200}.get(user_id, 1500)
+            self.assertEqual(self.board.position(user_id, rating), position)
+
+
+class LeaderboardIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = LeaderboardIndex()
+        self.index.update([
+            ['a', 1800, 'Анна', 'Казань', '', 'Татарстан'],
+            ['b', 1500, 'Борис', 'Казань', '', 'Татарстан'],
+            ['c', 1600, 'Вера', 'Пермь', '', 'Пермский край'],
+        ])
+
+    def test_top_by_scope(self):
+        self.assertEqual([row['user_id'] for row in self.index.top('country', '', 10)], ['a', 'c', 'b'])
+        self.assertEqual([row['user_id'] for row in self.index.top('city', 'Казань', 10)], ['a', 'b'])
+        self.assertEqual(self.index.top('city', 'Омск', 10), [])
+
+    def test_rating_change_moves_player(self):
+        self.index.update([['b', 1900]])
+        self.assertEqual([row['user_id'] for row in self.index.top('country', '', 10)], ['b', 'a', 'c'])
+        self.assertEqual(self.index.top('country', '', 1)[0]['name'], 'Борис')
+
+    def test_city_change_moves_between_boards(self):
+        self.index.update([['b', 1500, 'Борис', 'Пермь', '', 'Пермский край']])
+        self.assertEqual([row['user_id'] for row in self.index.top('city', 'Казань', 10)], ['a'])
+        self.assertEqual([row['user_id'] for row in self.index.top('region', 'Пермский край', 10)], ['c', 'b'])
+
+    def test_rating_is_clamped(self):
+        self.index.update([['d', leaderboard_index.RATING_MAX + 500, 'Дина']])
+        self.assertEqual(self.index.top('country', '', 1)[0]['rating'], leaderboard_index.RATING_MAX)
+
+    def test_standing_with_neighbours(self):
+        standing = self.index.standing('c', around=1)
+        self.assertEqual(standing['country']['rank'], 2)
+        self.assertEqual(standing['country']['total'], 3)
+        self.assertEqual([row['user_id'] for row in standing['country']['around']], ['a', 'c', 'b'])
+        self.assertEqual(standing['city'], {'rank': 1, 'rating': 1600, 'total': 1, 'name': 'Пермь',
+                                            'around': [self.index.top('city', 'Пермь', 1)[0]]})
+        self.assertIsNone(self.index.standing('x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
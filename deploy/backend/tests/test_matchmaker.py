@@ -0,0 +1,110 @@
+"""
+Подбор пар matchmaker: sweep_pairs, greedy_pairs и срезы rating_slices.
+Запуск: cd deploy/backend && python -m unittest discover tests
+"""
+import unittest
+
+import matchmaker
+from matchmaker_bench import synthetic_queue
+
+
+def entry(user_id, rating, city='', region='', stage='rating', wait=0.0, rating_range=50):
+    return {'user_id': user_id, 'rating': rating, 'city': city, 'region': region,
+            'stage_idx': matchmaker.stage_index(stage), 'joined_at': -wait, 'wait': wait, 'range': rating_range}
+
+
+def pair_ids(pairs):
+    return {frozenset((a['user_id'], b['user_id'])) for a, b, _ in pairs}
+
+
+class PairingTest(unittest.TestCase):
+    MODES = (matchmaker.sweep_pairs, matchmaker.greedy_pairs)
+
+    def test_same_city_beats_closer_rating(self):
+        entries = [entry('a', 1500, city='Казань', stage='city'),
+                   entry('b', 1600, city='Казань', stage='city'),
+                   entry('c', 1510, stage='city')]
+        for make_pairs in self.MODES:
+            with self.subTest(make_pairs.__name__):
+                pairs = make_pairs(entries)
+                self.assertEqual(pair_ids(pairs), {frozenset(('a', 'b'))})
+                self.assertEqual(pairs[0][2], 'city')
+
+    def test_rating_window_is_respected(self):
+        entries = [entry('a', 1500), entry('b', 1700)]
+        for make_pairs in self.MODES:
+            with self.subTest(make_pairs.__name__):
+                self.assertEqual(make_pairs(entries), [])
+
+    def test_window_is_checked_for_both_players(self):
+        entries = [entry('a', 1500, rating_range=300), entry('b', 1700)]
+        for make_pairs in self.MODES:
+            with self.subTest(make_pairs.__name__):
+                self.assertEqual(make_pairs(entries), [])
+
+    def test_any_stage_pairs_far_ratings(self):
+        entries = [entry('a', 1000, stage='any'), entry('b', 2000, stage='any')]
+        for make_pairs in self.MODES:
+            with self.subTest(make_pairs.__name__):
+                pairs = make_pairs(entries)
+                self.assertEqual(pair_ids(pairs), {frozenset(('a', 'b'))})
+                self.assertEqual(pairs[0][2], 'any')
+
+    def test_greedy_longest_wait_chooses_first(self):
+        entries = [entry('b', 1520, wait=1), entry('a', 1500, wait=10), entry('c', 1490, wait=2)]
+        self.assertEqual(pair_ids(matchmaker.greedy_pairs(entries)), {frozenset(('a', 'c'))})
+
+    def test_sweep_prefers_waiting_player(self):
+        # Без бонуса за ожидание самая дешёвая пара — a–b; c ждёт 20 с, и пара b–c становится дешевле
+        entries = [entry('a', 1500), entry('b', 1510), entry('c', 1520, wait=20, rating_range=150)]
+        self.assertEqual(pair_ids(matchmaker.sweep_pairs(entries)), {frozenset(('b', 'c'))})
+        entries[2]['wait'] = 0
+        self.assertEqual(pair_ids(matchmaker.sweep_pairs(entries)), {frozenset(('a', 'b'))})
+
+    def test_pairs_are_disjoint_and_mutual(self):
+        entries = synthetic_queue(2000, seed=7)
+        for make_pairs in self.MODES:
+            with self.subTest(make_pairs.__name__):
+                pairs = make_pairs(entries)
+                seen = set()
+                for a, b, stage in pairs:
+                    self.assertNotIn(a['user_id'], seen)
+                    self.assertNotIn(b['user_id'], seen)
+                    seen.update((a['user_id'], b['user_id']))
+                    rank = matchmaker.mutual_rank(a, b)
+                    self.assertIsNotNone(rank)
+                    self.assertGreaterEqual(matchmaker.STAGES.index(stage), rank)
+                self.assertGreater(len(pairs), len(entries) // 4)
+
+
+class RatingSlicesTest(unittest.TestCase):
+    def test_small_queue_is_one_slice(self):
+        entries = [entry('u%d' % i, 1500 - i) for i in range(10)]
+        slices = matchmaker.rating_slices(entries, size=10)
+        self.assertEqual(len(slices), 1)
+        self.assertEqual([e['rating'] for e in slices[0]], sorted(e['rating'] for e in entries))
+
+    def test_slices_are_bounded_and_cover_queue(self):
+        entries = synthetic_queue(1001, seed=3)
+        slices = matchmaker.rating_slices(entries, size=250)
+        self.assertEqual(len(slices), 5)
+        self.assertTrue(all(len(s) <= 250 for s in slices))
+        self.assertLessEqual(max(map(len, slices)) - min(map(len, slices)), 4)
+        ids = [e['user_id'] for s in slices for e in s]
+        self.assertEqual(sorted(ids), sorted(e['user_id'] for e in entries))
+
+    def test_round_robin_starts_after_cursor(self):
+        entries = [entry('u%d' % r, r) for r in range(1000, 1100)]
+        slices = matchmaker.rating_slices(entries, after=1049, size=30)
+        self.assertEqual(slices[0][0]['rating'], 1050)
+        self.assertEqual(slices[-1][-1]['rating'], 1049)
+        self.assertEqual(sum(map(len, slices)), 100)
+
+    def test_cursor_past_top_wraps_to_lowest(self):
+        entries = [entry('u%d' % r, r) for r in range(1000, 1100)]
+        slices = matchmaker.rating_slices(entries, after=5000, size=30)
+        self.assertEqual(slices[0][0]['rating'], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Скользящее окно rate_limiter в памяти; время подменяется, чтобы проверять границы окон.
+"""
+import unittest
+from unittest import mock
+
+import rate_limiter
+
+
+class FakeTime:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class SlidingWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeTime(1200.0)
+        patcher = mock.patch.object(rate_limiter, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = rate_limiter.RateLimiter(limits={'chat': (3, 60), 'matchmaking': (2, 60)},
+                                                backend='memory')
+
+    def hits(self, count, endpoint='chat', ip='1.1.1.1'):
+        return [self.limiter.is_limited(endpoint, ip) for _ in range(count)]
+
+    def test_limit_within_window(self):
+        self.assertEqual(self.hits(4), [False, False, False, True])
+        self.assertEqual(self.limiter.stats['allowed'], 3)
+        self.assertEqual(self.limiter.rejected_by_endpoint, {'chat': 1})
+
+    def test_counters_are_per_ip_and_endpoint(self):
+        self.hits(3)
+        self.assertEqual(self.hits(1, ip='2.2.2.2'), [False])
+        self.assertEqual(self.hits(1, endpoint='matchmaking'), [False])
+
+    def test_previous_window_is_weighted(self):
+        self.hits(3)
+        # Начало следующего окна: прошлое окно весит целиком
+        self.clock.now = 1260.0
+        self.assertEqual(self.hits(1), [True])
+        # Середина окна: 3 × 0,5 = 1,5, остаётся место для двух запросов
+        self.clock.now = 1290.0
+        self.assertEqual(self.hits(3), [False, False, True])
+
+    def test_old_window_is_forgotten(self):
+        self.hits(3)
+        self.clock.now = 1320.0
+        self.assertEqual(self.hits(4), [False, False, False, True])
+
+    def test_handler_default_for_unknown_endpoint(self):
+        self.assertFalse(self.limiter.is_limited('friends', '1.1.1.1'))
+        self.assertEqual([self.limiter.is_limited('friends', '1.1.1.1', 1, 60) for _ in range(2)], [False, True])
+
+    def test_check_request_methods_and_retry_after(self):
+        self.clock.now = 1215.0
+        for _ in range(5):
+            self.assertEqual(self.limiter.check_request('matchmaking', 'GET', '1.1.1.1'), (False, 0))
+        self.assertEqual(self.limiter.check_request('matchmaking', 'OPTIONS', '1.1.1.1'), (False, 0))
+        self.assertEqual(self.limiter.check_request('matchmaking', 'POST', '1.1.1.1'), (False, 0))
+        self.assertEqual(self.limiter.check_request('matchmaking', 'POST', '1.1.1.1'), (False, 0))
+        self.assertEqual(self.limiter.check_request('matchmaking', 'POST', '1.1.1.1'), (True, 45))
+        self.assertEqual(self.limiter.check_request('unknown', 'POST', '1.1.1.1'), (False, 0))
+
+    def test_sweep_drops_idle_counters(self):
+        self.hits(1)
+        self.clock.now += rate_limiter.SWEEP_INTERVAL + 200
+        self.hits(1, ip='2.2.2.2')
+        self.assertEqual(list(self.limiter._counters), [('chat', '2.2.2.2')])
+
+
+class LoadLimitsTest(unittest.TestCase):
+    def test_env_overrides(self):
+        env = {'RATE_LIMIT_ONLINE_MOVE': '120/30', 'RATE_LIMIT_BACKEND': 'postgres', 'RATE_LIMIT_CHAT': 'x/y'}
+        with mock.patch.dict(rate_limiter.os.environ, env), mock.patch('builtins.print'):
+            limits = rate_limiter.load_limits()
+        self.assertEqual(limits['online-move'], (120, 30))
+        self.assertEqual(limits['chat'], rate_limiter.LIMITS['chat'])
+        self.assertNotIn('backend', limits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Разбор cron-выражений scheduler и выбор ближайшего или пропущенного запуска задачи.
+"""
+import unittest
+from datetime import datetime, timedelta
+
+from scheduler import Cron, Job, _parse_field
+
+
+class ParseFieldTest(unittest.TestCase):
+    def test_forms(self):
+        self.assertEqual(_parse_field('*/15', 0, 59), {0, 15, 30, 45})
+        self.assertEqual(_parse_field('1-5', 1, 12), {1, 2, 3, 4, 5})
+        self.assertEqual(_parse_field('5/20', 0, 59), {5, 25, 45})
+        self.assertEqual(_parse_field('10-20/5,3', 0, 59), {3, 10, 15, 20})
+        self.assertEqual(_parse_field('*', 0, 7), set(range(8)))
+
+    def test_invalid(self):
+        for text, low, high in (('60', 0, 59), ('0', 1, 31), ('5-2', 0, 59), ('*/0', 0, 59), ('x', 0, 59)):
+            with self.subTest(text):
+                with self.assertRaises(ValueError):
+                    _parse_field(text, low, high)
+
+
+class CronTest(unittest.TestCase):
+    def test_needs_five_fields(self):
+        with self.assertRaises(ValueError):
+            Cron('* * * *')
+
+    def test_sunday_is_zero_or_seven(self):
+        self.assertEqual(Cron('0 0 * * 7').weekdays, {0})
+        self.assertEqual(Cron('0 0 * * 0').weekdays, {0})
+
+    def test_next_after_is_strict(self):
+        cron = Cron('30 4 * * *')
+        self.assertEqual(cron.next_after(datetime(2026, 1, 1, 4, 30)), datetime(2026, 1, 2, 4, 30))
+        self.assertEqual(cron.next_after(datetime(2026, 1, 1, 4, 29, 59)), datetime(2026, 1, 1, 4, 30))
+
+    def test_every_ten_minutes(self):
+        cron = Cron('*/10 * * * *')
+        self.assertEqual(cron.next_after(datetime(2026, 1, 1, 23, 55)), datetime(2026, 1, 2, 0, 0))
+
+    def test_leap_day(self):
+        self.assertEqual(Cron('0 0 29 2 *').next_after(datetime(2026, 3, 1)), datetime(2028, 2, 29))
+
+    def test_weekday(self):
+        # 1 января 2026 — четверг; 1 — понедельник
+        self.assertEqual(Cron('0 9 * * 1').next_after(datetime(2026, 1, 1)), datetime(2026, 1, 5, 9, 0))
+
+    def test_day_or_weekday(self):
+        cron = Cron('0 12 13 * 1')
+        t = datetime(2026, 1, 1)
+        fired = []
+        for _ in range(3):
+            t = cron.next_after(t)
+            fired.append(t)
+        self.assertEqual(fired, [datetime(2026, 1, 5, 12), datetime(2026, 1, 12, 12), datetime(2026, 1, 13, 12)])
+
+    def test_never_fires(self):
+        with self.assertRaises(ValueError):
+            Cron('0 0 31 2 *').next_after(datetime(2026, 1, 1))
+
+    def test_latest_until(self):
+        cron = Cron('0 * * * *')
+        start = datetime(2026, 1, 1, 10, 0)
+        self.assertEqual(cron.latest_until(start, datetime(2026, 1, 1, 13, 30)), datetime(2026, 1, 1, 13, 0))
+        self.assertIsNone(cron.latest_until(start, datetime(2026, 1, 1, 10, 59)))
+
+
+class JobPlanTest(unittest.TestCase):
+    def test_plans_next_slot(self):
+        job = Job('hourly', '0 * * * *', lambda: None)
+        job.plan(datetime(2026, 1, 1, 10, 15))
+        self.assertEqual(job.scheduled_for, datetime(2026, 1, 1, 11, 0))
+        self.assertEqual(job.fire_at, job.scheduled_for)
+
+    def test_runs_missed_slot_within_catchup(self):
+        job = Job('hourly', '0 * * * *', lambda: None, catchup=3600)
+        job.plan(datetime(2026, 1, 1, 10, 15), last_run=datetime(2026, 1, 1, 8, 0))
+        self.assertEqual(job.scheduled_for, datetime(2026, 1, 1, 10, 0))
+
+    def test_skips_missed_slot_past_catchup(self):
+        job = Job('daily', '0 3 * * *', lambda: None, catchup=600)
+        job.plan(datetime(2026, 1, 1, 10, 15), last_run=datetime(2025, 12, 31, 3, 0))
+        self.assertEqual(job.scheduled_for, datetime(2026, 1, 2, 3, 0))
+
+    def test_jitter_delays_fire_only(self):
+        job = Job('hourly', '0 * * * *', lambda: None, jitter=30)
+        job.plan(datetime(2026, 1, 1, 10, 15))
+        self.assertEqual(job.scheduled_for, datetime(2026, 1, 1, 11, 0))
+        self.assertTrue(job.scheduled_for <= job.fire_at <= job.scheduled_for + timedelta(seconds=30))
+
+
+if __name__ == '__main__':
+    unittest.main()
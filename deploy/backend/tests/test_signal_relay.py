@@ -0,0 +1,152 @@
+"""
+Ящики signal_relay: доставка, повторы, переполнение, подтверждения и срок жизни сигналов.
+"""
+import json
+import unittest
+from unittest import mock
+
+import signal_relay
+
+
+class FakeTime:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeConnection:
+    def __init__(self, sql):
+        self.sql = sql
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.sql.append(sql)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def signal(sig_id, to='b', game_id=7):
+    return {'type': 'signal', 'id': sig_id, 'game_id': game_id, 'from': 'a', 'to': to,
+            'signal_type': 'offer', 'data': {'sdp': sig_id}}
+
+
+class SignalRelayTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeTime()
+        patcher = mock.patch.object(signal_relay, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.relay = signal_relay.SignalRelay(queue_size=3, ttl=60)
+
+    def ids(self, signals):
+        return [s['id'] for s in signals]
+
+    def test_pop_returns_in_order_once(self):
+        for sig_id in ('s1', 's2'):
+            self.relay.store(signal(sig_id))
+        signals, check_db = self.relay.pop(7, 'b')
+        self.assertEqual(self.ids(signals), ['s1', 's2'])
+        self.assertFalse(check_db)
+        self.assertEqual(signals[0], {'id': 's1', 'from': 'a', 'type': 'offer', 'data': {'sdp': 's1'}})
+        self.assertEqual(self.relay.pop(7, 'b'), ([], False))
+
+    def test_mailboxes_are_per_game_and_user(self):
+        self.relay.store(signal('s1', to='b'))
+        self.relay.store(signal('s2', to='a'))
+        self.relay.store(signal('s3', game_id=8))
+        self.assertEqual(self.ids(self.relay.pop(7, 'b')[0]), ['s1'])
+        self.assertEqual(self.ids(self.relay.pop(7, 'a')[0]), ['s2'])
+        self.assertEqual(self.ids(self.relay.pop(8, 'b')[0]), ['s3'])
+
+    def test_duplicate_delivery_is_ignored(self):
+        self.relay.store(signal('s1'))
+        self.relay.apply_event(signal('s1'))
+        self.assertEqual(self.ids(self.relay.pop(7, 'b')[0]), ['s1'])
+        self.assertEqual(self.relay.stats['relayed'], 1)
+
+    def test_overflow_drops_oldest(self):
+        for i in range(5):
+            self.relay.store(signal('s%d' % i))
+        self.assertEqual(self.ids(self.relay.pop(7, 'b')[0]), ['s2', 's3', 's4'])
+        self.assertEqual(self.relay.stats['overflow'], 2)
+
+    def test_pop_limit_keeps_rest(self):
+        for i in range(3):
+            self.relay.store(signal('s%d' % i))
+        self.assertEqual(self.ids(self.relay.pop(7, 'b', limit=2)[0]), ['s0', 's1'])
+        self.assertEqual(self.ids(self.relay.pop(7, 'b')[0]), ['s2'])
+
+    def test_ack_removes_signals(self):
+        for i in range(3):
+            self.relay.store(signal('s%d' % i))
+        self.relay.apply_event({'type': 'signal_ack', 'game_id': 7, 'to': 'b', 'ids': ['s0', 's2', 'x']})
+        self.assertEqual(self.ids(self.relay.pop(7, 'b')[0]), ['s1'])
+        self.relay.ack(7, 'b', ['s1'])
+        self.assertEqual(self.relay.snapshot()['mailboxes'], 0)
+
+    def test_expired_signals_are_not_delivered(self):
+        self.relay.store(signal('old'))
+        self.clock.now += 30
+        self.relay.store(signal('new'))
+        self.clock.now += 31
+        self.assertEqual(self.ids(self.relay.pop(7, 'b')[0]), ['new'])
+        self.assertEqual(self.relay.stats['expired'], 1)
+
+    def test_sweep_clears_expired_mailboxes(self):
+        self.relay.store(signal('s1'))
+        self.relay.store(signal('s2', game_id=8))
+        self.clock.now += 61
+        self.relay.store(signal('s3', game_id=9))
+        snapshot = self.relay.snapshot()
+        self.assertEqual((snapshot['mailboxes'], snapshot['queued'], snapshot['expired']), (1, 1, 2))
+
+    def test_signal_stored_marks_db_check_once(self):
+        self.relay.apply_event({'type': 'signal_stored', 'game_id': 7, 'to': 'b'})
+        self.assertEqual(self.relay.pop(7, 'b'), ([], True))
+        self.assertEqual(self.relay.pop(7, 'b'), ([], False))
+
+    def test_db_pending_expires(self):
+        self.relay.mark_db_pending(7, 'b')
+        self.clock.now += 61
+        self.relay.store(signal('s1', game_id=8))
+        self.assertEqual(self.relay.pop(7, 'b'), ([], False))
+
+    def test_pushed_acks_locally_and_notifies(self):
+        for i in range(2):
+            self.relay.store(signal('s%d' % i))
+        sql = []
+        with mock.patch.object(signal_relay.db_pool, 'get_connection', lambda: FakeConnection(sql)):
+            self.relay.pushed(7, 'b', ['s0'])
+        self.assertEqual(self.ids(self.relay.pop(7, 'b')[0]), ['s1'])
+        self.assertEqual(self.relay.stats['pushed'], 1)
+        self.assertEqual(len(sql), 1)
+        self.assertTrue(sql[0].startswith("SELECT pg_notify('game_events', '"))
+        payload = sql[0][len("SELECT pg_notify('game_events', '"):-len("')")]
+        self.assertEqual(json.loads(payload.replace("''", "'")),
+                         {'type': 'signal_ack', 'game_id': 7, 'to': 'b', 'ids': ['s0']})
+
+    def test_pushed_survives_notify_failure(self):
+        self.relay.store(signal('s0'))
+
+        def fail():
+            raise RuntimeError('db down')
+
+        with mock.patch.object(signal_relay.db_pool, 'get_connection', fail), mock.patch('builtins.print'):
+            self.relay.pushed(7, 'b', ['s0'])
+        self.assertEqual(self.relay.pop(7, 'b'), ([], False))
+        self.assertEqual((self.relay.stats['errors'], self.relay.stats['last_error']), (1, 'db down'))
+
+
+if __name__ == '__main__':
+    unittest.main()
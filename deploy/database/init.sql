@@ -16,9 +16,17 @@ CREATE TABLE IF NOT EXISTS users (
     city VARCHAR(200),
     last_online TIMESTAMP DEFAULT NOW(),
     user_code VARCHAR(20),
-    active_device_token VARCHAR(64)
+    active_device_token VARCHAR(64),
+    last_played_date DATE,
+    rating_deviation REAL NOT NULL DEFAULT 350,
+    rating_volatility REAL NOT NULL DEFAULT 0.06,
+    region VARCHAR(200)
 );
 
+CREATE INDEX IF NOT EXISTS idx_users_rating ON users (rating DESC);
+CREATE INDEX IF NOT EXISTS idx_users_city_rating ON users (city, rating DESC) WHERE city IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_users_region_rating ON users (region, rating DESC) WHERE region IS NOT NULL;
+
 CREATE TABLE IF NOT EXISTS admins (
     id SERIAL PRIMARY KEY,
     email VARCHAR(255) NOT NULL,
@@ -52,9 +60,13 @@ CREATE TABLE IF NOT EXISTS game_history (
     duration_seconds INTEGER,
     end_reason VARCHAR(30) NOT NULL DEFAULT 'checkmate',
     created_at TIMESTAMP DEFAULT NOW(),
-    move_times TEXT
+    move_times TEXT,
+    online_game_id INTEGER
 );
 
+CREATE UNIQUE INDEX IF NOT EXISTS idx_game_history_online_game_user ON game_history (online_game_id, user_id) WHERE online_game_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_game_history_user_created ON game_history (user_id, created_at DESC, id DESC);
+
 CREATE TABLE IF NOT EXISTS online_games (
     id SERIAL PRIMARY KEY,
     white_user_id VARCHAR(64) NOT NULL,
@@ -83,7 +95,27 @@ CREATE TABLE IF NOT EXISTS online_games (
     rematch_status VARCHAR(20),
     rematch_game_id INTEGER,
     move_number INTEGER NOT NULL DEFAULT 0,
-    rematch_offered_at TIMESTAMP
+    rematch_offered_at TIMESTAMP,
+    white_clock_ms INTEGER,
+    black_clock_ms INTEGER,
+    rated BOOLEAN NOT NULL DEFAULT FALSE,
+    white_rating_change INTEGER,
+    black_rating_change INTEGER,
+    deadline_at TIMESTAMP DEFAULT (NOW() + INTERVAL '60 seconds')
+);
+
+CREATE INDEX IF NOT EXISTS idx_online_games_status_last_move ON online_games (status, last_move_at);
+CREATE INDEX IF NOT EXISTS idx_online_games_playing_deadline ON online_games (deadline_at) WHERE status = 'playing' AND is_bot_game = FALSE;
+CREATE INDEX IF NOT EXISTS idx_online_games_live_rating ON online_games ((white_rating + black_rating) DESC) WHERE status = 'playing' AND is_bot_game = FALSE;
+
+CREATE TABLE IF NOT EXISTS online_game_moves (
+    game_id INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    uci VARCHAR(10) NOT NULL,
+    clock_ms INTEGER,
+    zobrist BIGINT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (game_id, ply)
 );
 
 CREATE TABLE IF NOT EXISTS matchmaking_queue (
@@ -96,9 +128,16 @@ CREATE TABLE IF NOT EXISTS matchmaking_queue (
     time_control VARCHAR(20) NOT NULL,
     created_at TIMESTAMP DEFAULT NOW(),
     city VARCHAR(200) DEFAULT '',
-    region VARCHAR(200) DEFAULT ''
+    region VARCHAR(200) DEFAULT '',
+    last_heartbeat TIMESTAMP DEFAULT NOW(),
+    UNIQUE(user_id)
 );
 
+CREATE INDEX IF NOT EXISTS idx_matchmaking_queue_tc_city_rating ON matchmaking_queue (time_control, city, rating);
+CREATE INDEX IF NOT EXISTS idx_matchmaking_queue_tc_region_rating ON matchmaking_queue (time_control, region, rating);
+CREATE INDEX IF NOT EXISTS idx_matchmaking_queue_tc_rating ON matchmaking_queue (time_control, rating);
+CREATE INDEX IF NOT EXISTS idx_matchmaking_queue_tc_heartbeat ON matchmaking_queue (time_control, last_heartbeat);
+
 CREATE TABLE IF NOT EXISTS friends (
     id SERIAL PRIMARY KEY,
     user_id VARCHAR(64) NOT NULL,
@@ -132,15 +171,31 @@ CREATE TABLE IF NOT EXISTS game_invites (
     updated_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Секции по дням создаёт и удаляет deploy/backend/maintenance.py
 CREATE TABLE IF NOT EXISTS rate_limits (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     ip_address VARCHAR(64) NOT NULL,
     endpoint VARCHAR(100) NOT NULL,
     request_count INTEGER NOT NULL DEFAULT 1,
     window_start TIMESTAMP NOT NULL DEFAULT NOW(),
-    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, window_start)
+) PARTITION BY RANGE (window_start);
+
+CREATE TABLE IF NOT EXISTS rate_limits_default PARTITION OF rate_limits DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_rate_limits_ip_endpoint ON rate_limits (ip_address, endpoint);
+CREATE INDEX IF NOT EXISTS idx_rate_limits_window ON rate_limits (window_start);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+    endpoint VARCHAR(100) NOT NULL,
+    ip_address VARCHAR(64) NOT NULL,
+    window_start BIGINT NOT NULL,
+    request_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (endpoint, ip_address, window_start)
 );
 
+CREATE INDEX IF NOT EXISTS idx_rate_limit_counters_window ON rate_limit_counters (window_start);
+
 CREATE TABLE IF NOT EXISTS rating_settings (
     id SERIAL PRIMARY KEY,
     key VARCHAR(100) NOT NULL,
@@ -157,15 +212,385 @@ CREATE TABLE IF NOT EXISTS site_settings (
     updated_at TIMESTAMP DEFAULT NOW()
 );
 
+-- Секции по дням создаёт и удаляет deploy/backend/maintenance.py
 CREATE TABLE IF NOT EXISTS webrtc_signals (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     game_id INTEGER NOT NULL,
     from_user_id VARCHAR(64) NOT NULL,
     to_user_id VARCHAR(64) NOT NULL,
     signal_type VARCHAR(20) NOT NULL,
     signal_data TEXT NOT NULL,
     consumed BOOLEAN NOT NULL DEFAULT FALSE,
-    created_at TIMESTAMP DEFAULT NOW()
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS webrtc_signals_default PARTITION OF webrtc_signals DEFAULT;
+CREATE INDEX IF NOT EXISTS idx_webrtc_signals_game_to ON webrtc_signals (game_id, to_user_id, consumed);
+CREATE INDEX IF NOT EXISTS idx_webrtc_signals_created ON webrtc_signals (created_at);
+
+CREATE TABLE IF NOT EXISTS scheduler_runs (
+    id BIGSERIAL PRIMARY KEY,
+    job VARCHAR(100) NOT NULL,
+    scheduled_for TIMESTAMPTZ NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMPTZ,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    result TEXT,
+    worker VARCHAR(100),
+    UNIQUE (job, scheduled_for)
+);
+
+CREATE INDEX IF NOT EXISTS idx_scheduler_runs_started ON scheduler_runs (started_at);
+
+-- Число игроков по корзинам рейтинга (ширина 50) для страны, городов и регионов;
+-- ведут finish-game и apply-daily-decay, ночная задача rating-histogram пересчитывает и снимает срез
+CREATE TABLE IF NOT EXISTS rating_histogram (
+    scope VARCHAR(10) NOT NULL,
+    name VARCHAR(200) NOT NULL DEFAULT '',
+    bucket INTEGER NOT NULL,
+    players INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, name, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS rating_histogram_snapshots (
+    id SERIAL PRIMARY KEY,
+    taken_on DATE NOT NULL,
+    scope VARCHAR(10) NOT NULL,
+    name VARCHAR(200) NOT NULL DEFAULT '',
+    bucket_width INTEGER NOT NULL,
+    buckets JSONB NOT NULL,
+    players INTEGER NOT NULL,
+    UNIQUE (scope, name, taken_on)
+);
+
+-- Город → регион (как cityRegions во фронтенде); по нему geo-detect и verify-otp проверяют регион игрока
+CREATE TABLE IF NOT EXISTS city_regions (
+    city VARCHAR(200) PRIMARY KEY,
+    region VARCHAR(200) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_city_regions_region ON city_regions (region);
+
+INSERT INTO city_regions (city, region) VALUES
+    ('Абакан', 'Республика Хакасия'),
+    ('Альметьевск', 'Республика Татарстан'),
+    ('Анапа', 'Краснодарский край'),
+    ('Ангарск', 'Иркутская область'),
+    ('Арзамас', 'Нижегородская область'),
+    ('Армавир', 'Краснодарский край'),
+    ('Артём', 'Приморский край'),
+    ('Архангельск', 'Архангельская область'),
+    ('Асбест', 'Свердловская область'),
+    ('Астрахань', 'Астраханская область'),
+    ('Ачинск', 'Красноярский край'),
+    ('Балаково', 'Саратовская область'),
+    ('Барнаул', 'Алтайский край'),
+    ('Батайск', 'Ростовская область'),
+    ('Белгород', 'Белгородская область'),
+    ('Белово', 'Кемеровская область'),
+    ('Белорецк', 'Республика Башкортостан'),
+    ('Березники', 'Пермский край'),
+    ('Бийск', 'Алтайский край'),
+    ('Биробиджан', 'Еврейская автономная область'),
+    ('Благовещенск', 'Амурская область'),
+    ('Братск', 'Иркутская область'),
+    ('Брянск', 'Брянская область'),
+    ('Бугульма', 'Республика Татарстан'),
+    ('Буденновск', 'Ставропольский край'),
+    ('Великий Новгород', 'Новгородская область'),
+    ('Верхняя Пышма', 'Свердловская область'),
+    ('Видное', 'Московская область'),
+    ('Владивосток', 'Приморский край'),
+    ('Владикавказ', 'Республика Северная Осетия'),
+    ('Владимир', 'Владимирская область'),
+    ('Волгоград', 'Волгоградская область'),
+    ('Волжский', 'Волгоградская область'),
+    ('Вологда', 'Вологодская область'),
+    ('Волхов', 'Ленинградская область'),
+    ('Воронеж', 'Воронежская область'),
+    ('Воскресенск', 'Московская область'),
+    ('Воткинск', 'Удмуртская Республика'),
+    ('Всеволожск', 'Ленинградская область'),
+    ('Выборг', 'Ленинградская область'),
+    ('Выкса', 'Нижегородская область'),
+    ('Гатчина', 'Ленинградская область'),
+    ('Геленджик', 'Краснодарский край'),
+    ('Георгиевск', 'Ставропольский край'),
+    ('Глазов', 'Удмуртская Республика'),
+    ('Горно-Алтайск', 'Республика Алтай'),
+    ('Грозный', 'Чеченская Республика'),
+    ('Дербент', 'Республика Дагестан'),
+    ('Дзержинск', 'Нижегородская область'),
+    ('Димитровград', 'Ульяновская область'),
+    ('Дмитров', 'Московская область'),
+    ('Долгопрудный', 'Московская область'),
+    ('Домодедово', 'Московская область'),
+    ('Донецк', 'Ростовская область'),
+    ('Дубна', 'Московская область'),
+    ('Евпатория', 'Республика Крым'),
+    ('Егорьевск', 'Московская область'),
+    ('Ейск', 'Краснодарский край'),
+    ('Екатеринбург', 'Свердловская область'),
+    ('Елабуга', 'Республика Татарстан'),
+    ('Елец', 'Липецкая область'),
+    ('Ессентуки', 'Ставропольский край'),
+    ('Железногорск', 'Курская область'),
+    ('Железнодорожный', 'Московская область'),
+    ('Жуковский', 'Московская область'),
+    ('Заречный', 'Пензенская область'),
+    ('Звенигород', 'Московская область'),
+    ('Зеленогорск', 'Красноярский край'),
+    ('Зеленоград', 'Москва'),
+    ('Зеленодольск', 'Республика Татарстан'),
+    ('Зима', 'Иркутская область'),
+    ('Златоуст', 'Челябинская область'),
+    ('Иваново', 'Ивановская область'),
+    ('Ивантеевка', 'Московская область'),
+    ('Ижевск', 'Удмуртская Республика'),
+    ('Инта', 'Республика Коми'),
+    ('Иркутск', 'Иркутская область'),
+    ('Искитим', 'Новосибирская область'),
+    ('Ишим', 'Тюменская область'),
+    ('Йошкар-Ола', 'Республика Марий Эл'),
+    ('Казань', 'Республика Татарстан'),
+    ('Калининград', 'Калининградская область'),
+    ('Калуга', 'Калужская область'),
+    ('Каменск-Уральский', 'Свердловская область'),
+    ('Камышин', 'Волгоградская область'),
+    ('Канск', 'Красноярский край'),
+    ('Каспийск', 'Республика Дагестан'),
+    ('Кемерово', 'Кемеровская область'),
+    ('Керчь', 'Республика Крым'),
+    ('Кинешма', 'Ивановская область'),
+    ('Кириши', 'Ленинградская область'),
+    ('Киров', 'Кировская область'),
+    ('Кирово-Чепецк', 'Кировская область'),
+    ('Киселёвск', 'Кемеровская область'),
+    ('Кисловодск', 'Ставропольский край'),
+    ('Клин', 'Московская область'),
+    ('Клинцы', 'Брянская область'),
+    ('Ковров', 'Владимирская область'),
+    ('Когалым', 'Ханты-Мансийский АО'),
+    ('Коломна', 'Московская область'),
+    ('Комсомольск-на-Амуре', 'Хабаровский край'),
+    ('Конаково', 'Тверская область'),
+    ('Копейск', 'Челябинская область'),
+    ('Королёв', 'Московская область'),
+    ('Кострома', 'Костромская область'),
+    ('Котлас', 'Архангельская область'),
+    ('Красногорск', 'Московская область'),
+    ('Краснодар', 'Краснодарский край'),
+    ('Краснокамск', 'Пермский край'),
+    ('Красноярск', 'Красноярский край'),
+    ('Кстово', 'Нижегородская область'),
+    ('Кузнецк', 'Пензенская область'),
+    ('Курган', 'Курганская область'),
+    ('Курск', 'Курская область'),
+    ('Кызыл', 'Республика Тыва'),
+    ('Лабинск', 'Краснодарский край'),
+    ('Липецк', 'Липецкая область'),
+    ('Лобня', 'Московская область'),
+    ('Луга', 'Ленинградская область'),
+    ('Лысьва', 'Пермский край'),
+    ('Люберцы', 'Московская область'),
+    ('Магадан', 'Магаданская область'),
+    ('Магнитогорск', 'Челябинская область'),
+    ('Майкоп', 'Республика Адыгея'),
+    ('Махачкала', 'Республика Дагестан'),
+    ('Междуреченск', 'Кемеровская область'),
+    ('Миасс', 'Челябинская область'),
+    ('Минеральные Воды', 'Ставропольский край'),
+    ('Мичуринск', 'Тамбовская область'),
+    ('Можайск', 'Московская область'),
+    ('Москва', 'Москва'),
+    ('Мурманск', 'Мурманская область'),
+    ('Муром', 'Владимирская область'),
+    ('Мытищи', 'Московская область'),
+    ('Набережные Челны', 'Республика Татарстан'),
+    ('Надым', 'Ямало-Ненецкий АО'),
+    ('Назрань', 'Республика Ингушетия'),
+    ('Нальчик', 'Кабардино-Балкарская Республика'),
+    ('Наро-Фоминск', 'Московская область'),
+    ('Нарьян-Мар', 'Ненецкий АО'),
+    ('Находка', 'Приморский край'),
+    ('Невинномысск', 'Ставропольский край'),
+    ('Нерюнгри', 'Республика Саха (Якутия)'),
+    ('Нефтекамск', 'Республика Башкортостан'),
+    ('Нефтеюганск', 'Ханты-Мансийский АО'),
+    ('Нижневартовск', 'Ханты-Мансийский АО'),
+    ('Нижнекамск', 'Республика Татарстан'),
+    ('Нижний Новгород', 'Нижегородская область'),
+    ('Нижний Тагил', 'Свердловская область'),
+    ('Николаевск-на-Амуре', 'Хабаровский край'),
+    ('Новоалтайск', 'Алтайский край'),
+    ('Новодвинск', 'Архангельская область'),
+    ('Новокузнецк', 'Кемеровская область'),
+    ('Новокуйбышевск', 'Самарская область'),
+    ('Новомосковск', 'Тульская область'),
+    ('Новороссийск', 'Краснодарский край'),
+    ('Новосибирск', 'Новосибирская область'),
+    ('Новотроицк', 'Оренбургская область'),
+    ('Новоуральск', 'Свердловская область'),
+    ('Новочебоксарск', 'Чувашская Республика'),
+    ('Новочеркасск', 'Ростовская область'),
+    ('Новошахтинск', 'Ростовская область'),
+    ('Новый Уренгой', 'Ямало-Ненецкий АО'),
+    ('Ногинск', 'Московская область'),
+    ('Норильск', 'Красноярский край'),
+    ('Ноябрьск', 'Ямало-Ненецкий АО'),
+    ('Нягань', 'Ханты-Мансийский АО'),
+    ('Обнинск', 'Калужская область'),
+    ('Обь', 'Новосибирская область'),
+    ('Одинцово', 'Московская область'),
+    ('Озёрск', 'Челябинская область'),
+    ('Октябрьский', 'Республика Башкортостан'),
+    ('Омск', 'Омская область'),
+    ('Оренбург', 'Оренбургская область'),
+    ('Орехово-Зуево', 'Московская область'),
+    ('Орск', 'Оренбургская область'),
+    ('Орёл', 'Орловская область'),
+    ('Павлово', 'Нижегородская область'),
+    ('Павловский Посад', 'Московская область'),
+    ('Пенза', 'Пензенская область'),
+    ('Первоуральск', 'Свердловская область'),
+    ('Пермь', 'Пермский край'),
+    ('Петрозаводск', 'Республика Карелия'),
+    ('Петропавловск-Камчатский', 'Камчатский край'),
+    ('Печора', 'Республика Коми'),
+    ('Подольск', 'Московская область'),
+    ('Полевской', 'Свердловская область'),
+    ('Прокопьевск', 'Кемеровская область'),
+    ('Псков', 'Псковская область'),
+    ('Пушкино', 'Московская область'),
+    ('Пятигорск', 'Ставропольский край'),
+    ('Раменское', 'Московская область'),
+    ('Ревда', 'Свердловская область'),
+    ('Реутов', 'Московская область'),
+    ('Ржев', 'Тверская область'),
+    ('Россошь', 'Воронежская область'),
+    ('Ростов', 'Ярославская область'),
+    ('Ростов-на-Дону', 'Ростовская область'),
+    ('Рубцовск', 'Алтайский край'),
+    ('Рыбинск', 'Ярославская область'),
+    ('Рязань', 'Рязанская область'),
+    ('Салават', 'Республика Башкортостан'),
+    ('Самара', 'Самарская область'),
+    ('Санкт-Петербург', 'Санкт-Петербург'),
+    ('Саранск', 'Республика Мордовия'),
+    ('Сарапул', 'Удмуртская Республика'),
+    ('Саратов', 'Саратовская область'),
+    ('Саров', 'Нижегородская область'),
+    ('Севастополь', 'Севастополь'),
+    ('Северодвинск', 'Архангельская область'),
+    ('Североморск', 'Мурманская область'),
+    ('Североуральск', 'Свердловская область'),
+    ('Северск', 'Томская область'),
+    ('Сергиев Посад', 'Московская область'),
+    ('Серов', 'Свердловская область'),
+    ('Серпухов', 'Московская область'),
+    ('Сибай', 'Республика Башкортостан'),
+    ('Симферополь', 'Республика Крым'),
+    ('Смоленск', 'Смоленская область'),
+    ('Советск', 'Калининградская область'),
+    ('Советская Гавань', 'Хабаровский край'),
+    ('Сокол', 'Вологодская область'),
+    ('Соликамск', 'Пермский край'),
+    ('Солнечногорск', 'Московская область'),
+    ('Сосновый Бор', 'Ленинградская область'),
+    ('Сочи', 'Краснодарский край'),
+    ('Ставрополь', 'Ставропольский край'),
+    ('Старый Оскол', 'Белгородская область'),
+    ('Стерлитамак', 'Республика Башкортостан'),
+    ('Ступино', 'Московская область'),
+    ('Сургут', 'Ханты-Мансийский АО'),
+    ('Сухой Лог', 'Свердловская область'),
+    ('Сызрань', 'Самарская область'),
+    ('Сыктывкар', 'Республика Коми'),
+    ('Сысерть', 'Свердловская область'),
+    ('Таганрог', 'Ростовская область'),
+    ('Тайшет', 'Иркутская область'),
+    ('Тамбов', 'Тамбовская область'),
+    ('Тверь', 'Тверская область'),
+    ('Тихвин', 'Ленинградская область'),
+    ('Тихорецк', 'Краснодарский край'),
+    ('Тобольск', 'Тюменская область'),
+    ('Тольятти', 'Самарская область'),
+    ('Томск', 'Томская область'),
+    ('Торжок', 'Тверская область'),
+    ('Троицк', 'Московская область'),
+    ('Туапсе', 'Краснодарский край'),
+    ('Туймазы', 'Республика Башкортостан'),
+    ('Тула', 'Тульская область'),
+    ('Тулун', 'Иркутская область'),
+    ('Тутаев', 'Ярославская область'),
+    ('Тюмень', 'Тюменская область'),
+    ('Углич', 'Ярославская область'),
+    ('Узловая', 'Тульская область'),
+    ('Улан-Удэ', 'Республика Бурятия'),
+    ('Ульяновск', 'Ульяновская область'),
+    ('Урюпинск', 'Волгоградская область'),
+    ('Усинск', 'Республика Коми'),
+    ('Усолье-Сибирское', 'Иркутская область'),
+    ('Уссурийск', 'Приморский край'),
+    ('Усть-Илимск', 'Иркутская область'),
+    ('Усть-Кут', 'Иркутская область'),
+    ('Уфа', 'Республика Башкортостан'),
+    ('Ухта', 'Республика Коми'),
+    ('Учалы', 'Республика Башкортостан'),
+    ('Феодосия', 'Республика Крым'),
+    ('Фрязино', 'Московская область'),
+    ('Хабаровск', 'Хабаровский край'),
+    ('Ханты-Мансийск', 'Ханты-Мансийский АО'),
+    ('Хасавюрт', 'Республика Дагестан'),
+    ('Химки', 'Московская область'),
+    ('Холмск', 'Сахалинская область'),
+    ('Хотьково', 'Московская область'),
+    ('Чайковский', 'Пермский край'),
+    ('Чапаевск', 'Самарская область'),
+    ('Чебоксары', 'Чувашская Республика'),
+    ('Челябинск', 'Челябинская область'),
+    ('Черемхово', 'Иркутская область'),
+    ('Череповец', 'Вологодская область'),
+    ('Черкесск', 'Карачаево-Черкесская Республика'),
+    ('Черногорск', 'Республика Хакасия'),
+    ('Чехов', 'Московская область'),
+    ('Чистополь', 'Республика Татарстан'),
+    ('Чита', 'Забайкальский край'),
+    ('Шадринск', 'Курганская область'),
+    ('Шахты', 'Ростовская область'),
+    ('Шуя', 'Ивановская область'),
+    ('Щёлкино', 'Республика Крым'),
+    ('Щёлково', 'Московская область'),
+    ('Электрогорск', 'Московская область'),
+    ('Электросталь', 'Московская область'),
+    ('Электроугли', 'Московская область'),
+    ('Элиста', 'Республика Калмыкия'),
+    ('Энгельс', 'Саратовская область'),
+    ('Югорск', 'Ханты-Мансийский АО'),
+    ('Южно-Сахалинск', 'Сахалинская область'),
+    ('Юрга', 'Кемеровская область'),
+    ('Якутск', 'Республика Саха (Якутия)'),
+    ('Ялта', 'Республика Крым'),
+    ('Ялуторовск', 'Тюменская область'),
+    ('Ярославль', 'Ярославская область')
+ON CONFLICT (city) DO UPDATE SET region = EXCLUDED.region;
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id VARCHAR(64) PRIMARY KEY REFERENCES users(id),
+    by_color JSONB NOT NULL DEFAULT '{}',
+    by_time_control JSONB NOT NULL DEFAULT '{}',
+    by_opponent JSONB NOT NULL DEFAULT '{}',
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    games INTEGER NOT NULL DEFAULT 0,
+    total_moves BIGINT NOT NULL DEFAULT 0,
+    timed_games INTEGER NOT NULL DEFAULT 0,
+    total_duration BIGINT NOT NULL DEFAULT 0,
+    rating_peak INTEGER,
+    rating_low INTEGER,
+    activity JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT NOW()
 );
 
 -- Default rating settings
@@ -177,7 +602,13 @@ INSERT INTO rating_settings (key, value, description) VALUES
     ('initial_rating', '500', 'Начальный рейтинг нового игрока'),
     ('rating_principles', 'Рейтинг определяется на основе результатов партий. За победу начисляются баллы, за поражение — снимаются. Ничья дает небольшой бонус обоим игрокам.', 'Текстовое описание принципов рейтинга'),
     ('min_rating', '500', 'Минимальный рейтинг (ниже не опускается)'),
-    ('last_decay_date', '2000-01-01', 'Дата последнего ежедневного списания рейтинга (YYYY-MM-DD)')
+    ('last_decay_date', '2000-01-01', 'Дата последнего ежедневного списания рейтинга (YYYY-MM-DD)'),
+    ('decay_cursor', '', 'Незавершённое снижение рейтинга: с|по|последний обработанный id (служебное)'),
+    ('rating_system', 'elo', 'Система рейтинга: points (фиксированные баллы), elo или glicko2'),
+    ('elo_k', '32', 'Коэффициент K Эло'),
+    ('elo_k_provisional', '40', 'Коэффициент K Эло для первых 30 партий'),
+    ('glicko_tau', '0.5', 'Параметр tau Глико-2 (скорость изменения волатильности)'),
+    ('glicko_period_days', '1', 'Дней без игры на один рейтинговый период Глико-2 (рост RD)')
 ON CONFLICT DO NOTHING;
 
 -- Default site settings
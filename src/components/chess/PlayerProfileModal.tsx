@@ -4,6 +4,7 @@ import { Badge } from '@/components/ui/badge';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 import API from '@/config/api';
+import { fetchGameDetail } from '@/lib/apiCache';
 
 const GAME_HISTORY_URL = API.gameHistory;
 
@@ -17,8 +18,8 @@ interface Game {
   time_control: string;
   difficulty: string | null;
   moves_count: number;
-  move_history: string | null;
-  move_times: string | null;
+  move_history?: string | null;
+  move_times?: string | null;
   rating_before: number;
   rating_after: number;
   rating_change: number;
@@ -113,6 +114,14 @@ const PlayerProfileModal = ({ open, onClose, userId, playerName, playerAvatar, p
       .finally(() => setLoading(false));
   }, [open, userId]);
 
+  const openGame = async (game: Game) => {
+    setSelectedGame(game);
+    if (userId && game.move_history === undefined) {
+      const full = await fetchGameDetail(userId, game);
+      setSelectedGame(current => (current && current.id === game.id ? full : current));
+    }
+  };
+
   const winRate = profile && profile.games_played > 0
     ? Math.round((profile.wins / profile.games_played) * 100)
     : 0;
@@ -282,7 +291,7 @@ const PlayerProfileModal = ({ open, onClose, userId, playerName, playerAvatar, p
                 {games.map((game) => (
                   <div
                     key={game.id}
-                    onClick={() => setSelectedGame(game)}
+                    onClick={() => openGame(game)}
                     className="flex items-center gap-3 p-2.5 rounded-lg bg-white dark:bg-slate-800 border border-slate-200 dark:border-slate-700 hover:border-amber-400 dark:hover:border-amber-500 cursor-pointer transition-colors"
                   >
                     <div className={`w-2 h-8 rounded-full flex-shrink-0 ${
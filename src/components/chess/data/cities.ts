@@ -1,3 +1,5 @@
+// Те же пары лежат в таблице city_regions (db_migrations/V0049__create_city_regions.sql): по ней бэкенд
+// проверяет регион игрока. Новый город или регион — новая миграция с этими же парами
 export const cityRegions: Record<string, string> = {
   'Москва': 'Москва',
   'Санкт-Петербург': 'Санкт-Петербург',
@@ -4,6 +4,7 @@ import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 import { NameStep, EmailStep, OtpStep, CityStep, SEND_OTP_URL, VERIFY_OTP_URL } from './RegistrationSteps';
 import getDeviceToken from '@/lib/deviceToken';
+import { cityRegions } from '@/components/chess/data/cities';
 
 interface AuthModalProps {
   showAuthModal: boolean;
@@ -95,6 +96,9 @@ export const AuthModal = ({
         payload.mode = 'register';
         payload.name = userName.trim();
         payload.city = selectedCity;
+        // Регион нужен для таблицы рейтинга региона; по IP — только если город совпал с выбранным
+        payload.region = cityRegions[selectedCity]
+          || (sessionStorage.getItem('detectedCity') === selectedCity ? sessionStorage.getItem('detectedRegion') || '' : '');
       }
 
       const res = await fetch(VERIFY_OTP_URL, {
@@ -109,6 +113,7 @@ export const AuthModal = ({
           name: user.username,
           email: userEmail.trim().toLowerCase(),
           city: user.city || selectedCity,
+          region: user.region || '',
           rating: user.rating,
           id: user.id,
           userId: user.user_code || '',
@@ -3,7 +3,7 @@ import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
 import Icon from '@/components/ui/icon';
-import { cachedGameHistory } from '@/lib/apiCache';
+import { cachedGameHistory, fetchGameDetail, fetchGameHistoryPage } from '@/lib/apiCache';
 import { shareContent } from '@/lib/share';
 
 interface Game {
@@ -16,8 +16,8 @@ interface Game {
   time_control: string;
   difficulty: string | null;
   moves_count: number;
-  move_history: string | null;
-  move_times: string | null;
+  move_history?: string | null;
+  move_times?: string | null;
   rating_before: number;
   rating_after: number;
   rating_change: number;
@@ -47,6 +47,9 @@ export const HistorySection = ({ onOpenChat }: HistorySectionProps) => {
   const [selectedGame, setSelectedGame] = useState<Game | null>(null);
   const [loading, setLoading] = useState(true);
   const [shareOk, setShareOk] = useState(false);
+  const [historyUserId, setHistoryUserId] = useState('');
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchHistory();
@@ -62,16 +65,39 @@ export const HistorySection = ({ onOpenChat }: HistorySectionProps) => {
     const rawId = userData.email || userData.name || 'anonymous';
     const userId = 'u_' + rawId.replace(/[^a-zA-Z0-9@._-]/g, '').substring(0, 60);
 
+    setHistoryUserId(userId);
     try {
       const data = await cachedGameHistory(userId);
       if (data.user) setUserProfile(data.user);
       setGames(data.games || []);
+      setNextCursor(data.next_cursor || null);
     } catch (e) {
       console.error('Failed to fetch history:', e);
     }
     setLoading(false);
   };
 
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const data = await fetchGameHistoryPage(historyUserId, nextCursor);
+      setGames(prev => [...prev, ...(data.games || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (e) {
+      console.error('Failed to fetch history:', e);
+    }
+    setLoadingMore(false);
+  };
+
+  const openGame = async (game: Game) => {
+    setSelectedGame(game);
+    if (game.move_history === undefined) {
+      const full = await fetchGameDetail(historyUserId, game);
+      setSelectedGame(current => (current && current.id === game.id ? full : current));
+    }
+  };
+
   const formatDate = (dateString: string) => {
     const date = new Date(dateString);
     const now = new Date();
@@ -345,7 +371,7 @@ export const HistorySection = ({ onOpenChat }: HistorySectionProps) => {
               games.map((game) => (
                 <div
                   key={game.id}
-                  onClick={() => setSelectedGame(game)}
+                  onClick={() => openGame(game)}
                   className="flex items-center gap-2 sm:gap-4 p-3 sm:p-4 rounded-lg border bg-slate-50 dark:bg-slate-800/30 border-slate-200 dark:border-white/5 hover:border-blue-300 dark:hover:border-blue-500/30 transition-all cursor-pointer"
                 >
                   <div className="flex-shrink-0">
@@ -406,6 +432,11 @@ export const HistorySection = ({ onOpenChat }: HistorySectionProps) => {
                 </div>
               ))
             )}
+            {nextCursor && (
+              <Button onClick={loadMore} disabled={loadingMore} variant="outline" className="w-full">
+                {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+              </Button>
+            )}
           </div>
         </CardContent>
       </Card>
@@ -273,7 +273,21 @@ export function useHomeData() {
       if (userData.city) {
         setUserCity(userData.city);
         const region = cityRegions[userData.city];
-        setUserRegion(region || userData.city);
+        setUserRegion(region || userData.region || userData.city);
+      }
+      if (userData.id && userData.region === undefined) {
+        // Однократно сохраняем регион в профиле: по городу, а если города нет в справочнике — по IP
+        const params = new URLSearchParams({ user_id: userData.id });
+        const knownRegion = userData.city ? cityRegions[userData.city] : '';
+        if (knownRegion) params.set("region", knownRegion);
+        fetch(`${GEO_DETECT_URL}?${params}`)
+          .then((r) => r.json())
+          .then((data) => {
+            const region = knownRegion || (data.city === userData.city ? data.region : "") || "";
+            const latest = JSON.parse(localStorage.getItem("chessUser") || "null");
+            if (latest) localStorage.setItem("chessUser", JSON.stringify({ ...latest, region }));
+          })
+          .catch(() => {});
       }
       if (userData.rating) setUserRating(userData.rating);
     } else {
@@ -50,6 +50,22 @@ export async function cachedGameHistory(userId: string) {
   return data;
 }
 
+export async function fetchGameHistoryPage(userId: string, cursor: string) {
+  const res = await fetch(`${API.gameHistory}?user_id=${encodeURIComponent(userId)}&cursor=${encodeURIComponent(cursor)}`);
+  return res.json();
+}
+
+// Списки партий приходят без ходов; партия целиком — отдельным запросом при открытии
+export async function fetchGameDetail<T>(userId: string, game: T & { id: number }): Promise<T> {
+  try {
+    const res = await fetch(`${API.gameHistory}?user_id=${encodeURIComponent(userId)}&game_id=${game.id}`);
+    const data = await res.json();
+    return data.game ? { ...game, ...data.game } : game;
+  } catch {
+    return game;
+  }
+}
+
 export function invalidateGameHistory() {
   try {
     const keys = Object.keys(sessionStorage);
@@ -7,6 +7,35 @@ import API from '@/config/api';
 import { cachedGameHistory, invalidateGameHistory } from '@/lib/apiCache';
 const FINISH_GAME_URL = API.finishGame;
 const ONLINE_MOVE_URL = API.onlineMove;
+const LIVE_GAMES_URL = liveGamesUrl(ONLINE_MOVE_URL);
+
+// Push-канал партий (WebSocket / SSE) есть только у своего шлюза: /api/online-move → /api/live/games
+function liveGamesUrl(onlineMoveUrl: string): string | null {
+  if (!onlineMoveUrl.endsWith('/api/online-move')) return null;
+  return onlineMoveUrl.replace(/online-move$/, 'live/games');
+}
+
+function toWebSocketUrl(url: string): string {
+  if (/^https?:/.test(url)) return url.replace(/^http/, 'ws');
+  return `${window.location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}${url}`;
+}
+
+type ServerSignal = { id?: string; from: string; type: string; data: string };
+
+type LiveEvent = {
+  type: string;
+  move?: string;
+  move_number?: number;
+  white_time?: number;
+  black_time?: number;
+  status?: string;
+  winner?: string;
+  end_reason?: string;
+  id?: string;
+  from?: string;
+  signal_type?: string;
+  data?: string;
+};
 
 function replayMoves(moves: string[]): {
   board: Board;
@@ -194,6 +223,13 @@ export const useGameLogic = (
   const [opponentReconnecting, setOpponentReconnecting] = useState(false);
   const [opponentUserId, setOpponentUserId] = useState<string>('');
   const pollFailCountRef = useRef(0);
+  // Ходы, подтверждённые сервером, и ETag последнего ответа: опрос после первого полного ответа
+  // просит только ходы после известных (since_move), а без изменений получает 304
+  const serverMovesRef = useRef<string[] | null>(null);
+  const gameEtagRef = useRef<string | null>(null);
+  const serverMovesGameRef = useRef<number | undefined>(onlineGameId);
+  const liveEventRef = useRef<(event: LiveEvent) => void>(() => {});
+  const [liveConnected, setLiveConnected] = useState(false);
 
   const historyRef = useRef<HTMLDivElement>(null);
   const onChatMessageRef = useRef<((text: string) => void) | null>(null);
@@ -552,7 +588,7 @@ export const useGameLogic = (
         if (result.status === 'checkmate') setGameStatus('checkmate');
         else if (result.status === 'stalemate') setGameStatus('stalemate');
         else if (serverStatus === 'finished') {
-          if (endReason === 'draw' || endReason === 'stalemate') setGameStatus('draw');
+          if (endReason === 'draw' || endReason === 'stalemate' || endReason === 'repetition' || endReason === 'fifty_moves') setGameStatus('draw');
           else setGameStatus('checkmate');
         }
 
@@ -630,12 +666,47 @@ export const useGameLogic = (
   useEffect(() => {
     if (!isOnlineGame || !onlineGameId) return;
     let active = true;
+    if (serverMovesGameRef.current !== onlineGameId) {
+      // Рематч в том же экране: ходы и ETag прежней партии не годятся
+      serverMovesGameRef.current = onlineGameId;
+      serverMovesRef.current = null;
+      gameEtagRef.current = null;
+    }
+
+    const markOnline = () => {
+      if (pollFailCountRef.current >= 4) {
+        setConnectionRestored(true);
+        setTimeout(() => setConnectionRestored(false), 3000);
+      }
+      pollFailCountRef.current = 0;
+      setConnectionLost(false);
+    };
+
+    const handleSignals = (signals: ServerSignal[]) => {
+      const chatSignals = signals.filter(s => s.type === 'chat');
+      const rtcSignals = signals.filter(s => s.type !== 'chat');
+      for (const s of chatSignals) {
+        try {
+          const payload = JSON.parse(s.data);
+          if (payload.text && onChatMessageRef.current) onChatMessageRef.current(payload.text);
+        } catch { /* ignore */ }
+      }
+      if (rtcSignals.length > 0) processSignals(rtcSignals);
+    };
 
     const poll = async () => {
       try {
         let url = `${ONLINE_MOVE_URL}?game_id=${onlineGameId}`;
         if (myUserId) url += `&user_id=${encodeURIComponent(myUserId)}`;
-        const res = await fetch(url);
+        const known = serverMovesRef.current;
+        if (known) url += `&since_move=${known.length}`;
+        const res = await fetch(url, known && gameEtagRef.current
+          ? { headers: { 'If-None-Match': gameEtagRef.current } }
+          : undefined);
+        if (res.status === 304) {
+          if (active) markOnline();
+          return;
+        }
         if (!res.ok) {
           pollFailCountRef.current++;
           if (pollFailCountRef.current >= 4) setConnectionLost(true);
@@ -644,30 +715,20 @@ export const useGameLogic = (
         const data = await res.json();
         if (!active || !data.game) return;
 
-        if (pollFailCountRef.current >= 4) {
-          setConnectionRestored(true);
-          setTimeout(() => setConnectionRestored(false), 3000);
-        }
-        pollFailCountRef.current = 0;
-        setConnectionLost(false);
-
-        if (data.signals && data.signals.length > 0) {
-          const chatSignals = data.signals.filter((s: { type: string }) => s.type === 'chat');
-          const rtcSignals = data.signals.filter((s: { type: string }) => s.type !== 'chat');
-          for (const s of chatSignals) {
-            try {
-              const payload = JSON.parse(s.data);
-              if (payload.text && onChatMessageRef.current) onChatMessageRef.current(payload.text);
-            } catch { /* ignore */ }
-          }
-          if (rtcSignals.length > 0) processSignals(rtcSignals);
-        }
+        markOnline();
+        gameEtagRef.current = res.headers.get('ETag');
 
-        if (!p2pConnected) {
-          const serverMoves: string[] = data.game.move_history
+        if (data.signals && data.signals.length > 0) handleSignals(data.signals);
+
+        // Дельта — ходы после since_move; полный ответ — вся move_history
+        const serverMoves: string[] = data.delta
+          ? [...(serverMovesRef.current || []).slice(0, data.game.since_move), ...(data.game.moves || [])]
+          : data.game.move_history
             ? data.game.move_history.split(',').filter(Boolean)
             : [];
+        serverMovesRef.current = serverMoves;
 
+        if (!p2pConnected) {
           if (data.game.seconds_since_move !== undefined) {
             inactivitySyncRef.current = data.game.seconds_since_move;
           }
@@ -689,7 +750,7 @@ export const useGameLogic = (
         if (data.game.rematch_game_id) setRematchGameId(data.game.rematch_game_id);
         setDrawOfferedBy(data.game.draw_offered_by || null);
 
-        // Определяем ID соперника для синхронизации чата
+        // Определяем ID соперника для синхронизации чата (есть только в полном ответе)
         if (data.game.white_user_id && data.game.black_user_id && myUserId) {
           const oppId = playerColor === 'white' ? data.game.black_user_id : data.game.white_user_id;
           if (oppId) setOpponentUserId(oppId);
@@ -706,11 +767,43 @@ export const useGameLogic = (
       }
     };
 
+    // События push-канала: очередной ход применяется сразу, остальное — одним дельта-запросом
+    liveEventRef.current = (event: LiveEvent) => {
+      if (!active || event.type === 'ping' || event.type === 'error') return;
+      if (event.type === 'signal') {
+        handleSignals([{ id: event.id, from: event.from || '', type: event.signal_type || '', data: event.data || '' }]);
+        return;
+      }
+      const known = serverMovesRef.current;
+      if (event.type === 'move' && known && event.move && event.move_number !== undefined) {
+        if (event.move_number <= known.length) return;
+        if (event.move_number === known.length + 1) {
+          const serverMoves = [...known, event.move];
+          serverMovesRef.current = serverMoves;
+          if (!p2pConnected) {
+            applyServerState(
+              serverMoves,
+              event.white_time ?? getInitialTime(timeControl),
+              event.black_time ?? getInitialTime(timeControl),
+              event.status || 'playing',
+              event.move_number,
+              event.winner,
+              event.end_reason,
+              0
+            );
+          }
+          return;
+        }
+      }
+      // sync после подключения, state (ничья, рематч, конец партии), resync, signal_stored, пропущенный ход
+      poll();
+    };
+
     poll();
 
-    // P2P установлен → редкий poll только для рематча
-    // P2P ещё не установлен (сигналинг) → частый poll 1.5s
-    const interval = p2pConnected ? 30000 : 1500;
+    // Push-канал или P2P на связи → редкий страховочный poll
+    // Иначе (сигналинг, облачные функции без шлюза) → частый poll 1.5s, ответы — дельта или 304
+    const interval = p2pConnected || liveConnected ? 30000 : 1500;
 
     const intervalId = setInterval(() => {
       if (!active) return;
@@ -721,7 +814,65 @@ export const useGameLogic = (
       active = false;
       clearInterval(intervalId);
     };
-  }, [isOnlineGame, onlineGameId, timeControl, applyServerState, myUserId, p2pConnected, processSignals]);
+  }, [isOnlineGame, onlineGameId, timeControl, applyServerState, myUserId, p2pConnected, liveConnected, processSignals]);
+
+  // Push-канал шлюза: WebSocket, а если он не открывается — SSE. При обрыве остаётся частый опрос,
+  // переподключение с растущей паузой
+  useEffect(() => {
+    if (!isOnlineGame || !onlineGameId || !LIVE_GAMES_URL) return;
+    const query = myUserId ? `?user_id=${encodeURIComponent(myUserId)}` : '';
+    let socket: WebSocket | null = null;
+    let source: EventSource | null = null;
+    let retryTimer: ReturnType<typeof setTimeout> | null = null;
+    let closed = false;
+    let failures = 0;
+    let useSse = typeof WebSocket === 'undefined';
+
+    const onMessage = (raw: string) => {
+      try {
+        liveEventRef.current(JSON.parse(raw));
+      } catch { /* ignore */ }
+    };
+
+    const retry = (opened: boolean) => {
+      setLiveConnected(false);
+      if (closed) return;
+      failures = opened ? 1 : failures + 1;
+      if (!opened && !useSse && failures >= 3 && typeof EventSource !== 'undefined') useSse = true;
+      retryTimer = setTimeout(connect, Math.min(30000, 1000 * 2 ** Math.min(failures, 5)));
+    };
+
+    const connect = () => {
+      let opened = false;
+      if (useSse) {
+        source = new EventSource(`${LIVE_GAMES_URL}/${onlineGameId}/events${query}`);
+        source.onopen = () => { opened = true; failures = 0; setLiveConnected(true); };
+        source.onmessage = (msg) => onMessage(msg.data);
+        source.onerror = () => {
+          source?.close();
+          source = null;
+          retry(opened);
+        };
+        return;
+      }
+      socket = new WebSocket(toWebSocketUrl(`${LIVE_GAMES_URL}/${onlineGameId}${query}`));
+      socket.onopen = () => { opened = true; failures = 0; setLiveConnected(true); };
+      socket.onmessage = (msg) => onMessage(msg.data);
+      socket.onclose = () => {
+        socket = null;
+        retry(opened);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      if (retryTimer) clearTimeout(retryTimer);
+      socket?.close();
+      source?.close();
+      setLiveConnected(false);
+    };
+  }, [isOnlineGame, onlineGameId, myUserId]);
 
 
 
@@ -740,26 +891,29 @@ export const useGameLogic = (
       result = currentPlayerAtEnd === playerColor ? 'loss' : 'win';
     }
     const durationSeconds = Math.floor((Date.now() - gameStartTime.current) / 1000);
+    // Итог онлайн-партии сервер берёт из online_games и пересчитывает рейтинг обоим игрокам
+    const payload = {
+      user_id: userId,
+      username: userData.name || 'Player',
+      avatar: userData.avatar || '',
+      result,
+      opponent_name: isOnlineGame ? '' : 'bot',
+      opponent_type: isOnlineGame ? 'online' : 'bot',
+      online_game_id: isOnlineGame ? onlineGameId : undefined,
+      user_color: playerColor,
+      time_control: timeControl,
+      difficulty,
+      moves_count: moveHistory.length,
+      move_history: moveHistory.join(','),
+      move_times: moveTimes.join(','),
+      duration_seconds: durationSeconds,
+      end_reason: status
+    };
     try {
       const res = await fetch(FINISH_GAME_URL, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          user_id: userId,
-          username: userData.name || 'Player',
-          avatar: userData.avatar || '',
-          result,
-          opponent_name: 'bot',
-          opponent_type: 'bot',
-          user_color: playerColor,
-          time_control: timeControl,
-          difficulty,
-          moves_count: moveHistory.length,
-          move_history: moveHistory.join(','),
-          move_times: moveTimes.join(','),
-          duration_seconds: durationSeconds,
-          end_reason: status
-        })
+        body: JSON.stringify(payload)
       });
       const data = await res.json();
       invalidateGameHistory();
@@ -771,24 +925,9 @@ export const useGameLogic = (
       }
     } catch (e) {
       console.error('Failed to submit game result:', e);
-      queueGameResult(FINISH_GAME_URL, {
-        user_id: userId,
-        username: userData.name || 'Player',
-        avatar: userData.avatar || '',
-        result,
-        opponent_name: 'bot',
-        opponent_type: 'bot',
-        user_color: playerColor,
-        time_control: timeControl,
-        difficulty,
-        moves_count: moveHistory.length,
-        move_history: moveHistory.join(','),
-        move_times: moveTimes.join(','),
-        duration_seconds: durationSeconds,
-        end_reason: status
-      });
+      queueGameResult(FINISH_GAME_URL, payload);
     }
-  }, [playerColor, timeControl, difficulty, moveHistory, moveTimes]);
+  }, [playerColor, timeControl, difficulty, moveHistory, moveTimes, isOnlineGame, onlineGameId]);
 
   useEffect(() => {
     if (gameStatus !== 'playing' && !gameFinished.current && moveHistory.length > 2) {
@@ -935,9 +1074,9 @@ export const useGameLogic = (
           }
         });
         pendingMoveRef.current = null;
-        if (finalGameStatus !== 'playing') {
-          sendMoveToServer(moveNotation, finalGameStatus, winnerId);
-        }
+        // Сервер проверяет легальность каждого хода, поэтому ход уходит на сервер и при P2P
+        serverMoveNumberRef.current = moveHistory.length;
+        sendMoveToServer(moveNotation, finalGameStatus, winnerId);
       } else {
         sendMoveToServer(moveNotation, finalGameStatus, winnerId);
       }
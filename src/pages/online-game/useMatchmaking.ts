@@ -5,6 +5,7 @@ import API from '@/config/api';
 
 const MATCHMAKING_URL = API.matchmaking;
 const POLL_INTERVAL = 3000;
+const LONG_POLL_TIMEOUT = 25;
 const STAGE_DURATION = 5000;
 const FINAL_STAGE_DURATION = 5000;
 
@@ -41,6 +42,9 @@ const useMatchmaking = () => {
   const abortedRef = useRef(false);
   const matchFoundRef = useRef(false);
   const currentStageRef = useRef<SearchStage>('city');
+  const longPollRef = useRef<AbortController | null>(null);
+  const doSearchRef = useRef<(user: { id: string }, stage: SearchStage) => void>(() => {});
+  const waitForMatchRef = useRef<(user: { id: string }) => void>(() => {});
 
   const getUserData = useCallback(() => {
     const savedUser = localStorage.getItem('chessUser');
@@ -57,6 +61,7 @@ const useMatchmaking = () => {
     if (pollRef.current) { clearInterval(pollRef.current); pollRef.current = null; }
     if (searchTimerRef.current) { clearInterval(searchTimerRef.current); searchTimerRef.current = null; }
     if (stageTimerRef.current) { clearTimeout(stageTimerRef.current); stageTimerRef.current = null; }
+    if (longPollRef.current) { longPollRef.current.abort(); longPollRef.current = null; }
   }, []);
 
   const cancelSearch = useCallback(async () => {
@@ -137,6 +142,10 @@ const useMatchmaking = () => {
 
       if (data.status === 'matched') {
         handleMatchFound(data);
+      } else if (data.long_poll) {
+        // Пару составляет сервер: вместо опроса ждём её в long-poll, открытое соединение заменяет пульс
+        if (pollRef.current) { clearInterval(pollRef.current); pollRef.current = null; }
+        if (!longPollRef.current) waitForMatchRef.current(user);
       } else {
         // Второй игрок: проверяем, не создана ли уже игра для нас
         await checkActiveGame(user.id);
@@ -145,6 +154,43 @@ const useMatchmaking = () => {
       // Network error, will retry on next poll
     }
   }, [opponentType, timeControl, handleMatchFound, checkActiveGame]);
+  doSearchRef.current = doSearch;
+
+  const waitForMatch = useCallback(async (user: { id: string }) => {
+    const controller = new AbortController();
+    longPollRef.current = controller;
+    try {
+      while (!abortedRef.current && !matchFoundRef.current && !controller.signal.aborted) {
+        const res = await fetch(
+          `${MATCHMAKING_URL}/wait?user_id=${encodeURIComponent(user.id)}&timeout=${LONG_POLL_TIMEOUT}`,
+          { signal: controller.signal }
+        );
+        if (!res.ok) break;
+        const data = await res.json();
+        if (abortedRef.current || matchFoundRef.current || controller.signal.aborted) return;
+        if (data.active_game) {
+          handleMatchFound({
+            opponent_name: data.active_game.opponent_name,
+            opponent_rating: data.active_game.opponent_rating,
+            opponent_avatar: data.active_game.opponent_avatar,
+            player_color: data.active_game.player_color,
+            game_id: data.active_game.game_id
+          }, data.active_game.is_bot_game);
+          return;
+        }
+        if (!data.long_poll || !data.in_queue) break;
+      }
+    } catch {
+      if (controller.signal.aborted) return;
+    }
+    if (longPollRef.current === controller) longPollRef.current = null;
+    // Long-poll недоступен или игрок выпал из очереди — возвращаемся к опросу, он же заново встанет в очередь
+    if (!abortedRef.current && !matchFoundRef.current && !controller.signal.aborted && !pollRef.current) {
+      pollRef.current = setInterval(() => doSearchRef.current(user, currentStageRef.current), POLL_INTERVAL);
+      doSearchRef.current(user, currentStageRef.current);
+    }
+  }, [handleMatchFound]);
+  waitForMatchRef.current = waitForMatch;
 
   const advanceToNextStage = useCallback((user: { id: string; name?: string; avatar?: string; rating?: number; city?: string; region?: string }) => {
     if (abortedRef.current || matchFoundRef.current) return;
@@ -152,6 +198,7 @@ const useMatchmaking = () => {
     const currentIdx = STAGE_ORDER.indexOf(currentStageRef.current);
     if (currentIdx >= STAGE_ORDER.length - 1) {
       if (pollRef.current) { clearInterval(pollRef.current); pollRef.current = null; }
+      if (longPollRef.current) { longPollRef.current.abort(); longPollRef.current = null; }
       setSearchStatus('no_opponents');
       return;
     }
@@ -163,7 +210,9 @@ const useMatchmaking = () => {
     if (pollRef.current) { clearInterval(pollRef.current); pollRef.current = null; }
 
     doSearch(user, nextStage);
-    pollRef.current = setInterval(() => doSearch(user, nextStage), POLL_INTERVAL);
+    if (!longPollRef.current) {
+      pollRef.current = setInterval(() => doSearch(user, nextStage), POLL_INTERVAL);
+    }
 
     const duration = nextStage === 'any' ? FINAL_STAGE_DURATION : STAGE_DURATION;
     stageTimerRef.current = setTimeout(() => advanceToNextStage(user), duration);